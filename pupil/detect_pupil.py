@@ -18,6 +18,7 @@ import numpy as np
 import av
 
 import itertools
+import os
 from IPython.core.debugger import Pdb
 ipdb = Pdb()
 import argparse
@@ -27,11 +28,29 @@ def nothing(x):
 
 def load_distortion_map(filename):
     """Load the distortion map from the file and return as map_x, map_y
+
+    The float maps of the XML file are converted once to the fixed point
+    format of cv2.remap (map_x is CV_16SC2, map_y is CV_16UC1) and cached
+    next to it as ``<name>_map1.npy`` and ``<name>_map2.npy``. Later runs
+    memory map the cached tables instead of parsing the XML again.
     """
+    cache_paths = [os.path.splitext(filename)[0] + '_map{}.npy'.format(i) for i in (1, 2)]
+    try:
+        if all(os.path.getmtime(path) >= os.path.getmtime(filename) for path in cache_paths):
+            return tuple(np.load(path, mmap_mode='c') for path in cache_paths)
+    except (IOError, OSError, ValueError):
+        pass
+
     fs = cv2.FileStorage(filename, cv2.FileStorage_READ)
     map_x = fs.getNode('map_x').mat()
     map_y = fs.getNode('map_y').mat()
     fs.release()
+    map_x, map_y = cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
+    try:
+        for path, table in zip(cache_paths, (map_x, map_y)):
+            np.save(path, table)
+    except (IOError, OSError):
+        pass
     return (map_x, map_y)
 
 def threshold_example():
@@ -538,7 +538,7 @@ def eye(timebase, is_alive_flag, ipc_pub_url, ipc_sub_url, ipc_push_url,
                         elif frame_publish_format == "bgr":
                             data = frame.bgr
                         elif frame_publish_format == "gray":
-                            data = frame.gray
+                            data = np.ascontiguousarray(frame.gray)
                         assert data is not None
                     except (AttributeError, AssertionError, NameError):
                         if not frame_publish_format_recent_warning:
@@ -584,7 +584,7 @@ def eye(timebase, is_alive_flag, ipc_pub_url, ipc_sub_url, ipc_push_url,
                         if g_pool.display_mode == 'algorithm':
                             g_pool.image_tex.update_from_ndarray(frame.img)
                         elif g_pool.display_mode in ('camera_image', 'roi'):
-                            g_pool.image_tex.update_from_ndarray(frame.gray)
+                            g_pool.image_tex.update_from_ndarray(np.ascontiguousarray(frame.gray))
                         else:
                             pass
                     glViewport(0, 0, *camera_render_size)
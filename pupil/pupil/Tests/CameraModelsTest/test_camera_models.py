@@ -0,0 +1,128 @@
+'''
+(*)~---------------------------------------------------------------------------
+Pupil - eye tracking platform
+Copyright (C) 2012-2018 Pupil Labs
+
+Distributed under the terms of the GNU
+Lesser General Public License (LGPL v3.0).
+See COPYING and COPYING.LESSER for license details.
+---------------------------------------------------------------------------~(*)
+'''
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+import TestUtils  # noqa: F401, makes pupil importable
+from pupil import camera_models
+
+
+def pre_recorded_camera(cam_name, resolution):
+    intrinsics = camera_models.pre_recorded_calibrations[cam_name][str(resolution)]
+    if intrinsics['cam_type'] == 'fisheye':
+        camera = camera_models.Fisheye_Dist_Camera
+    else:
+        camera = camera_models.Radial_Dist_Camera
+    return camera(intrinsics['camera_matrix'], intrinsics['dist_coefs'], resolution, cam_name)
+
+
+def random_image_points(camera, count, max_radius=None, seed=0):
+    '''Uniform image points, optionally only within `max_radius` of the principal point in normalized coordinates'''
+    rng = np.random.RandomState(seed)
+    points = rng.uniform((0, 0), camera.resolution, size=(count, 2))
+    if max_radius is not None:
+        radius = np.linalg.norm((points - camera.K[:2, 2]) / np.diag(camera.K)[:2], axis=1)
+        points = points[radius < max_radius]
+    return points
+
+
+def random_object_points(count, seed=0):
+    # in front of the camera, within a field of view of about 100 degrees
+    rng = np.random.RandomState(seed)
+    points = rng.uniform((-1.2, -1.2, 1.), (1.2, 1.2, 1.), size=(count, 3))
+    return points * rng.uniform(.5, 5., size=(count, 1))
+
+
+def image_edge_points(camera, count=50):
+    width, height = camera.resolution
+    t = np.linspace(0., 1., count)
+    return np.concatenate([np.column_stack((t * (width - 1), np.zeros(count))),
+                           np.column_stack((t * (width - 1), np.full(count, height - 1.))),
+                           np.column_stack((np.zeros(count), t * (height - 1))),
+                           np.column_stack((np.full(count, width - 1.), t * (height - 1)))])
+
+
+def check_batch_matches(camera, image_points):
+    for use_distortion in (True, False):
+        for normalize in (True, False):
+            expected = camera.unprojectPoints(image_points, use_distortion=use_distortion, normalize=normalize)
+            result = camera.unprojectPointsBatch(image_points, use_distortion=use_distortion, normalize=normalize)
+            assert result.shape == expected.shape
+            assert np.abs(result - expected).max() < 1e-6
+
+        object_points = random_object_points(500)
+        expected = camera.projectPoints(object_points, use_distortion=use_distortion)
+        result = camera.projectPointsBatch(object_points, use_distortion=use_distortion)
+        assert result.shape == expected.shape
+        assert np.abs(result - expected).max() < 1e-6
+
+
+def test_radial_batch():
+    camera = pre_recorded_camera('Logitech Webcam C930e', (1280, 720))
+    check_batch_matches(camera, random_image_points(camera, 1000))
+    check_batch_matches(camera_models.Dummy_Camera((1280, 720), 'dummy'), random_image_points(camera, 1000))
+
+    # the 5 iterations of cv2.undistortPoints only converge close to the center for strong distortion
+    camera = pre_recorded_camera('Pupil Cam1 ID2', (640, 480))
+    for use_distortion in (True, False):
+        object_points = random_object_points(500)
+        expected = camera.projectPoints(object_points, use_distortion=use_distortion)
+        assert np.abs(camera.projectPointsBatch(object_points, use_distortion=use_distortion) - expected).max() < 1e-6
+    image_points = random_image_points(camera, 1000, max_radius=.6)
+    reprojected = camera.projectPoints(camera.unprojectPointsBatch(image_points))
+    assert np.abs(reprojected - image_points).max() < 1e-6
+
+
+def test_fisheye_batch():
+    camera = pre_recorded_camera('Pupil Cam1 ID2', (1920, 1080))
+    # the float32 fixed point iteration of unprojectPoints converges within this radius
+    check_batch_matches(camera, random_image_points(camera, 2000, max_radius=.7))
+
+
+def test_fisheye_newton_at_image_edge():
+    camera = pre_recorded_camera('Pupil Cam1 ID2', (1920, 1080))
+    image_points = image_edge_points(camera)
+    for use_distortion in (True, False):
+        unprojected = camera.unprojectPointsBatch(image_points, use_distortion=use_distortion)
+        assert np.isfinite(unprojected).all()
+        reprojected = camera.projectPoints(unprojected, use_distortion=use_distortion)
+        assert np.abs(reprojected - image_points).max() < 1e-6
+        reprojected = camera.projectPointsBatch(unprojected, use_distortion=use_distortion)
+        assert np.abs(reprojected - image_points).max() < 1e-6
+
+    # the principal point maps to the optical axis
+    center = camera.unprojectPointsBatch(camera.K[:2, 2])
+    assert np.allclose(center, (0., 0., 1.))
+
+
+def test_batch_out():
+    camera = pre_recorded_camera('Pupil Cam1 ID2', (1920, 1080))
+    image_points = random_image_points(camera, 100)
+    out = np.empty((len(image_points), 3))
+    assert camera.unprojectPointsBatch(image_points, out=out) is out
+    try:
+        camera.unprojectPointsBatch(image_points, out=np.empty((len(image_points), 2)))
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('accepted an out array of the wrong shape')
+
+
+if __name__ == '__main__':
+    test_radial_batch()
+    test_fisheye_batch()
+    test_fisheye_newton_at_image_edge()
+    test_batch_out()
+    print('camera model tests passed')
@@ -0,0 +1,186 @@
+'''
+(*)~---------------------------------------------------------------------------
+Pupil - eye tracking platform
+Copyright (C) 2012-2018 Pupil Labs
+
+Distributed under the terms of the GNU
+Lesser General Public License (LGPL v3.0).
+See COPYING and COPYING.LESSER for license details.
+---------------------------------------------------------------------------~(*)
+'''
+
+import os
+import sys
+import threading
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from TestUtils import temp_directory
+from pupil import file_methods as fm
+
+
+def make_pupil_data(count, start_ts=0.):
+    data = []
+    for i in range(count):
+        datum = {'topic': 'pupil', 'timestamp': start_ts + i / 30., 'confidence': (i % 10) / 10.,
+                 'norm_pos': (i / count, 1. - i / count), 'diameter': 30. + i,
+                 'ellipse': {'center': (100. + i, 200. - i), 'axes': (30. + i, 28. + i), 'angle': float(i)},
+                 'id': i % 2}
+        if i % 3:  # mix in 2d only datums
+            datum['model_id'] = i
+            datum['sphere'] = {'center': (1., 2., 3. + i), 'radius': 12.}
+        data.append(datum)
+    return data
+
+
+def write_pldata(directory, data, name='pupil'):
+    with fm.PLData_Writer(directory, name) as writer:
+        writer.extend(data)
+
+
+def test_columns_round_trip():
+    data = make_pupil_data(25)
+    with temp_directory() as directory:
+        write_pldata(directory, data)
+        fm.export_pldata_columns(directory, 'pupil', chunk_size=7)
+        columns = fm.load_pldata_columns(directory, 'pupil').columns
+        assert len(columns['confidence']) == len(data)
+        for i, datum in enumerate(data):
+            assert columns['confidence'][i] == datum['confidence']
+            assert tuple(columns['ellipse_center'][i]) == datum['ellipse']['center']
+            assert columns['id'][i] == datum['id']
+            if 'model_id' in datum:
+                assert columns['model_id'][i] == datum['model_id']
+                assert tuple(columns['sphere_center'][i]) == datum['sphere']['center']
+            else:
+                assert columns['model_id'][i] == -1
+                assert np.isnan(columns['sphere_center'][i]).all()
+
+
+def test_columns_subset():
+    data = make_pupil_data(10)
+    with temp_directory() as directory:
+        write_pldata(directory, data)
+        columns = fm.load_pldata_columns(directory, 'pupil', columns=('diameter', 'norm_pos')).columns
+        assert sorted(columns) == ['diameter', 'norm_pos']
+        assert not os.path.exists(os.path.join(directory, 'pupil_confidence.npy'))
+        assert [float(d) for d in columns['diameter']] == [d['diameter'] for d in data]
+
+
+def test_range_round_trip():
+    data = make_pupil_data(40)
+    with temp_directory() as directory:
+        write_pldata(directory, data)
+        timestamps = [d['timestamp'] for d in data]
+        for rebuild in (False, True):
+            if rebuild:  # older recordings have no offsets file
+                os.remove(os.path.join(directory, 'pupil_offsets.npy'))
+            offsets = fm.load_pldata_offsets(directory, 'pupil')
+            assert len(offsets) == len(data) and offsets[0] == 0
+            for start, stop in ((0, 40), (5, 17), (39, 40), (12, 12)):
+                stop_ts = timestamps[stop] if stop < len(data) else timestamps[-1] + 1
+                loaded = fm.load_pldata_range(directory, 'pupil', timestamps[start], stop_ts)
+                assert list(loaded.timestamps) == timestamps[start:stop]
+                assert [d['diameter'] for d in loaded.data] == [d['diameter'] for d in data[start:stop]]
+        assert os.path.exists(os.path.join(directory, 'pupil_offsets.npy'))
+        assert not len(fm.load_pldata_range(directory, 'pupil', -10., -1.).data)
+
+
+def test_iter_matches_load():
+    data = make_pupil_data(30)
+    long_topic = 'pupil.' + 'x' * 40  # str 8 header instead of fixstr
+    for i, datum in enumerate(data):
+        datum['topic'] = ('pupil.0', 'pupil.1', long_topic)[i % 3]
+    data[7]['padding'] = 'y' * 70000  # bin 32 payload
+    with temp_directory() as directory:
+        write_pldata(directory, data)
+        loaded = fm.load_pldata_file(directory, 'pupil')
+        iterated = list(fm.iter_pldata_file(directory, 'pupil'))
+        assert [ts for ts, _, _ in iterated] == list(loaded.timestamps)
+        assert [topic for _, topic, _ in iterated] == list(loaded.topics)
+        for (_, _, datum), expected in zip(iterated, loaded.data):
+            assert datum.serialized == expected.serialized
+        del iterated, datum
+
+        filtered = [(ts, topic) for ts, topic, _ in fm.iter_pldata_file(directory, 'pupil', topics=(long_topic,))]
+        assert filtered == [(d['timestamp'], d['topic']) for d in data if d['topic'] == long_topic]
+
+        # payloads that were decoded stay usable after the iterator is closed
+        records = fm.iter_pldata_file(directory, 'pupil')
+        _, _, first = next(records)
+        assert first['diameter'] == data[0]['diameter']
+        records.close()
+        assert first['diameter'] == data[0]['diameter']
+
+
+class Gated_File(object):
+    """Holds the writer thread in write() until `gate` is set"""
+    def __init__(self, file_handle):
+        self.file_handle = file_handle
+        self.entered = threading.Event()
+        self.gate = threading.Event()
+
+    def write(self, buffer):
+        self.entered.set()
+        self.gate.wait()
+        return self.file_handle.write(buffer)
+
+    def close(self):
+        self.file_handle.close()
+
+
+def gated_writer(directory, overflow):
+    # every append fills a buffer, at most one buffer waits besides the one in write()
+    writer = fm.Buffered_PLData_Writer(directory, 'pupil', buffer_size=1, max_pending=1, overflow=overflow)
+    writer.file_handle = Gated_File(writer.file_handle)
+    return writer
+
+
+def test_buffered_writer_drop():
+    data = make_pupil_data(10)
+    with temp_directory() as directory:
+        writer = gated_writer(directory, 'drop')
+        writer.append(data[0])
+        assert writer.file_handle.entered.wait(5.)
+        writer.extend(data[1:])  # data[1] is queued, the rest does not fit
+        assert writer.dropped == len(data) - 2
+        writer.file_handle.gate.set()
+        writer.close()
+
+        loaded = fm.load_pldata_file(directory, 'pupil')
+        assert list(loaded.timestamps) == [d['timestamp'] for d in data[:2]]
+        assert [d['diameter'] for d in loaded.data] == [d['diameter'] for d in data[:2]]
+        assert len(fm.load_pldata_offsets(directory, 'pupil')) == 2
+
+
+def test_buffered_writer_block():
+    data = make_pupil_data(10)
+    with temp_directory() as directory:
+        writer = gated_writer(directory, 'block')
+        appending = threading.Thread(target=writer.extend, args=(data,))
+        appending.start()
+        assert writer.file_handle.entered.wait(5.)
+        appending.join(.2)
+        assert appending.is_alive()  # waits for the writer thread
+        writer.file_handle.gate.set()
+        appending.join(5.)
+        writer.close()
+
+        assert writer.dropped == 0
+        loaded = fm.load_pldata_file(directory, 'pupil')
+        assert list(loaded.timestamps) == [d['timestamp'] for d in data]
+        offsets = fm.load_pldata_offsets(directory, 'pupil')
+        loaded = fm.load_pldata_range(directory, 'pupil', data[3]['timestamp'], data[5]['timestamp'])
+        assert len(offsets) == len(data)
+        assert [d['diameter'] for d in loaded.data] == [d['diameter'] for d in data[3:5]]
+
+
+if __name__ == '__main__':
+    test_columns_round_trip()
+    test_columns_subset()
+    test_range_round_trip()
+    test_iter_matches_load()
+    test_buffered_writer_drop()
+    test_buffered_writer_block()
+    print('pldata tests passed')
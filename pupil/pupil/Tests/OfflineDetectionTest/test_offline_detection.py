@@ -0,0 +1,115 @@
+'''
+(*)~---------------------------------------------------------------------------
+Pupil - eye tracking platform
+Copyright (C) 2012-2018 Pupil Labs
+
+Distributed under the terms of the GNU
+Lesser General Public License (LGPL v3.0).
+See COPYING and COPYING.LESSER for license details.
+---------------------------------------------------------------------------~(*)
+'''
+
+import os
+import sys
+
+import av
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from TestUtils import temp_directory
+from pupil import offline_detection
+from pupil.file_methods import load_pldata_file
+
+
+def keyframes_at(frame_count, indices):
+    keyframes = np.zeros(frame_count, dtype=bool)
+    keyframes[list(indices)] = True
+    return keyframes
+
+
+def test_gop_chunks():
+    keyframes = keyframes_at(35, range(0, 35, 10))
+    # one chunk per gop, the last one is short
+    assert offline_detection.gop_chunks(keyframes, 1) == [(0, 10), (10, 20), (20, 30), (30, 35)]
+    assert offline_detection.gop_chunks(keyframes, 10) == [(0, 10), (10, 20), (20, 30), (30, 35)]
+    # gops are merged until a chunk holds min_chunk_size frames, the trailing chunk keeps the rest
+    assert offline_detection.gop_chunks(keyframes, 11) == [(0, 20), (20, 35)]
+    assert offline_detection.gop_chunks(keyframes, 25) == [(0, 30), (30, 35)]
+    assert offline_detection.gop_chunks(keyframes, 100) == [(0, 35)]
+
+    # the first chunk starts at 0 even if the first frame is no keyframe
+    assert offline_detection.gop_chunks(keyframes_at(20, (5, 15)), 1) == [(0, 5), (5, 15), (15, 20)]
+    assert offline_detection.gop_chunks(np.zeros(7, dtype=bool), 1) == [(0, 7)]
+    assert offline_detection.gop_chunks(np.zeros(0, dtype=bool), 1) == []
+
+    # irregular gops, chunks start on keyframes and cover all frames once
+    keyframes = keyframes_at(100, (0, 3, 4, 20, 21, 50, 90, 99))
+    for min_chunk_size in range(1, 30):
+        chunks = offline_detection.gop_chunks(keyframes, min_chunk_size)
+        assert chunks[0][0] == 0 and chunks[-1][1] == len(keyframes)
+        assert all(stop == start for (_, stop), (start, _) in zip(chunks, chunks[1:]))
+        assert all(keyframes[start] for start, _ in chunks)
+        assert all(stop - start >= min_chunk_size for start, stop in chunks[:-1])
+
+
+def write_video(path, frame_count, gop_size):
+    # the gray value encodes the frame index
+    container = av.open(path, 'w')
+    stream = container.add_stream('mpeg4', rate=30)
+    stream.width, stream.height = 64, 48
+    stream.pix_fmt = 'yuv420p'
+    stream.gop_size = gop_size
+    stream.bit_rate = 4000000
+    for i in range(frame_count):
+        img = np.full((48, 64, 3), 4 * i, dtype=np.uint8)
+        for packet in stream.encode(av.VideoFrame.from_ndarray(img, format='bgr24')):
+            container.mux(packet)
+    for packet in stream.encode():
+        container.mux(packet)
+    container.close()
+
+
+class Brightness_Detector(object):
+    """Stands in for Detector_2D, reports which frame it got"""
+    def detect(self, frame, roi, visualize):
+        return {'timestamp': frame.timestamp, 'index': frame.index, 'brightness': float(frame.gray.mean())}
+
+
+def _init_brightness_worker(video_path, settings, topic, eye_id):
+    offline_detection._worker.update(video_path=video_path, topic=topic, eye_id=eye_id,
+                                     detector=Brightness_Detector())
+
+
+def test_detect_recording_order():
+    frame_count = 50
+    init_worker = offline_detection._init_worker
+    # the workers are forked and inherit the patched initializer
+    offline_detection._init_worker = _init_brightness_worker
+    try:
+        with temp_directory() as directory:
+            video_path = os.path.join(directory, 'eye1.mp4')
+            write_video(video_path, frame_count, gop_size=8)
+            timestamps = 100. + np.arange(frame_count) / 30.
+            np.save(os.path.join(directory, 'eye1_timestamps.npy'), timestamps)
+
+            # more chunks than workers, chunks finish out of order
+            written = offline_detection.detect_recording(video_path, workers=3, min_chunk_size=1)
+            assert written == frame_count
+
+            pupil_data = load_pldata_file(directory, 'pupil')
+            assert list(pupil_data.timestamps) == list(timestamps)
+            assert set(pupil_data.topics) == {'pupil'}
+            for i, datum in enumerate(pupil_data.data):
+                assert datum['index'] == i
+                assert datum['timestamp'] == timestamps[i]
+                # limited range luma
+                assert abs(datum['brightness'] - (16 + 4 * i * 219 / 255.)) < 2
+                assert datum['id'] == 1 and datum['topic'] == 'pupil'
+    finally:
+        offline_detection._init_worker = init_worker
+
+
+if __name__ == '__main__':
+    test_gop_chunks()
+    test_detect_recording_order()
+    print('offline detection tests passed')
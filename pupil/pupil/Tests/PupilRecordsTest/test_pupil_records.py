@@ -0,0 +1,86 @@
+'''
+(*)~---------------------------------------------------------------------------
+Pupil - eye tracking platform
+Copyright (C) 2012-2018 Pupil Labs
+
+Distributed under the terms of the GNU
+Lesser General Public License (LGPL v3.0).
+See COPYING and COPYING.LESSER for license details.
+---------------------------------------------------------------------------~(*)
+'''
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from TestUtils import temp_directory
+from pupil import pupil_records
+
+
+def make_datum_2d(i):
+    # as returned by Detector_2D.detect, without 'id'
+    return {'topic': 'pupil', 'method': '2d c++', 'timestamp': i / 30., 'confidence': .5,
+            'norm_pos': (.25, .75), 'diameter': 30. + i,
+            'ellipse': {'center': (100. + i, 200.), 'axes': (30., 28.), 'angle': float(i)}}
+
+
+def make_datum_3d(i):
+    datum = make_datum_2d(i)
+    datum.update({'method': '3d c++', 'id': 1, 'diameter_3d': 4., 'theta': 1.5, 'phi': -1.5,
+                  'circle_3d': {'center': (1., 2., 3.), 'normal': (0., 0., -1.), 'radius': 2.},
+                  'sphere': {'center': (1., 2., 15.), 'radius': 12.},
+                  'projected_sphere': {'center': (320., 240.), 'axes': (200., 200.), 'angle': 90.},
+                  'model_confidence': 1., 'model_id': 3, 'model_birth_timestamp': 0.})
+    return datum
+
+
+def test_records_round_trip_3d():
+    data = [make_datum_3d(i) for i in range(25)]
+    with temp_directory() as directory:
+        with pupil_records.PLRecord_Writer(directory, 'pupil', kind='3d', buffer_records=10) as writer:
+            writer.extend(data)
+        records, kind = pupil_records.load_pupil_records(directory, 'pupil')
+        assert kind == '3d' and len(records) == len(data)
+        assert records['model_id'].tolist() == [3] * len(data)
+        # values are stored as float32, the test data is exact in float32
+        assert list(pupil_records.iter_pupil_datums(directory, 'pupil')) == data
+        del records
+
+
+def test_records_without_id():
+    data = [make_datum_2d(i) for i in range(5)]
+    with temp_directory() as directory:
+        with pupil_records.PLRecord_Writer(directory, 'eye1', kind='2d', eye_id=1) as writer:
+            writer.extend(data)
+        datums = list(pupil_records.iter_pupil_datums(directory, 'eye1'))
+        assert [d['id'] for d in datums] == [1] * len(data)
+        for datum in datums:
+            del datum['id']
+        assert datums == data
+
+        # 2d datums in the 3d schema leave the 3d fields missing
+        record = np.zeros(1, dtype=pupil_records.pupil_3d_dtype)[0]
+        pupil_records.datum_to_record(data[0], record)
+        assert record['id'] == 0 and record['model_id'] == -1
+        assert np.isnan(record['sphere_center']).all()
+
+
+def test_not_a_record_file():
+    with temp_directory() as directory:
+        with open(os.path.join(directory, 'pupil.plrec'), 'wb') as fh:
+            fh.write(b'\0' * 32)
+        try:
+            pupil_records.load_pupil_records(directory, 'pupil')
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('loaded an invalid record file')
+
+
+if __name__ == '__main__':
+    test_records_round_trip_3d()
+    test_records_without_id()
+    test_not_a_record_file()
+    print('pupil record tests passed')
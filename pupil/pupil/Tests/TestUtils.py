@@ -0,0 +1,32 @@
+'''
+(*)~---------------------------------------------------------------------------
+Pupil - eye tracking platform
+Copyright (C) 2012-2018 Pupil Labs
+
+Distributed under the terms of the GNU
+Lesser General Public License (LGPL v3.0).
+See COPYING and COPYING.LESSER for license details.
+---------------------------------------------------------------------------~(*)
+'''
+"""Helpers shared by the test scripts in the subdirectories
+
+Importing this module makes the `pupil` package importable.
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir)))
+
+
+@contextmanager
+def temp_directory():
+    '''Yields a new temporary directory, which is removed with its content afterwards'''
+    directory = tempfile.mkdtemp()
+    try:
+        yield directory
+    finally:
+        shutil.rmtree(directory)
@@ -12,6 +12,7 @@ See COPYING and COPYING.LESSER for license details.
 import numpy as np
 import cv2
 import os
+import hashlib
 from pupil.file_methods import save_object, load_object
 
 # logging
@@ -90,12 +91,53 @@ def load_intrinsics(directory, cam_name, resolution):
             intrinsics = {'cam_type': 'dummy'}
 
 
+    # the undistortion tables are cached next to the intrinsics file
     if intrinsics['cam_type'] == 'dummy':
-        return Dummy_Camera(resolution, cam_name)
+        return Dummy_Camera(resolution, cam_name, cache_dir=directory)
     elif intrinsics['cam_type'] == 'fisheye':
-        return Fisheye_Dist_Camera(intrinsics['camera_matrix'], intrinsics['dist_coefs'], resolution, cam_name)
+        return Fisheye_Dist_Camera(intrinsics['camera_matrix'], intrinsics['dist_coefs'], resolution, cam_name, cache_dir=directory)
     elif intrinsics['cam_type'] == 'radial':
-        return Radial_Dist_Camera(intrinsics['camera_matrix'], intrinsics['dist_coefs'], resolution, cam_name)
+        return Radial_Dist_Camera(intrinsics['camera_matrix'], intrinsics['dist_coefs'], resolution, cam_name, cache_dir=directory)
+
+
+def _as_points(points, dim):
+    """Returns `points` as contiguous float64 array of shape Nxdim, copies only if needed"""
+    return np.ascontiguousarray(points, dtype=np.float64).reshape(-1, dim)
+
+
+def _output_array(out, shape):
+    if out is None:
+        return np.empty(shape, dtype=np.float64)
+    if out.shape != shape or out.dtype != np.float64:
+        raise ValueError('out needs to be a float64 array of shape {}'.format(shape))
+    return out
+
+
+def _cached_remap_tables(cache_dir, key, build_tables):
+    """
+    Loads fixed point remap tables from `cache_dir` or builds and stores them there.
+    The tables are memory mapped (copy on write) so that only the touched pages are read.
+    :param key: bytes that identify the tables, e.g. model type, K, D and resolution
+    :param build_tables: callable returning the (map1, map2) tuple
+    :return: map1 (CV_16SC2), map2 (CV_16UC1)
+    """
+    if cache_dir is None:
+        return build_tables()
+
+    digest = hashlib.sha1(key).hexdigest()
+    paths = [os.path.join(cache_dir, 'remap_{}_map{}.npy'.format(digest, i)) for i in (1, 2)]
+    try:
+        return tuple(np.load(path, mmap_mode='c') for path in paths)
+    except (IOError, OSError, ValueError):
+        pass
+
+    tables = build_tables()
+    try:
+        for path, table in zip(paths, tables):
+            np.save(path, table)
+    except (IOError, OSError):
+        logger.warning('Could not cache undistortion tables in {}'.format(cache_dir))
+    return tables
 
 
 def save_intrinsics(directory, cam_name, resolution, intrinsics):
@@ -127,11 +169,41 @@ class Fisheye_Dist_Camera(object):
         The implementation of cv2.fisheye is buggy and some functions had to be customized.
     """
 
-    def __init__(self, K, D, resolution, name):
+    # coefficients of the tan(theta) series, used to unproject/project without distortion
+    _undistorted_k = np.asarray([1. / 3., 2. / 15., 17. / 315., 62. / 2835.])
+
+    def __init__(self, K, D, resolution, name, cache_dir=None):
         self.K = np.array(K)
         self.D = np.array(D)
         self.resolution = resolution
         self.name = name
+        self.cache_dir = cache_dir  # where remap_tables stores the undistortion tables, None keeps them in memory only
+        # derived intrinsics used by the batch methods
+        self._f = np.array((self.K[0, 0], self.K[1, 1]), dtype=np.float64)
+        self._c = np.array((self.K[0, 2], self.K[1, 2]), dtype=np.float64)
+        self._k = self.D.ravel().astype(np.float64)
+        self._remap_tables = None
+
+    def remap_tables(self, cache_dir=None):
+        """
+        Fixed point undistortion tables for cv2.remap. They are built once per camera model and,
+        if `cache_dir` (default: the model's cache_dir) is given, stored there to be reused by other
+        models with the same intrinsics.
+        :return: map1 (CV_16SC2), map2 (CV_16UC1)
+        """
+        if self._remap_tables is None:
+            def build_tables():
+                return cv2.fisheye.initUndistortRectifyMap(
+                    np.array(self.K),
+                    np.array(self.D),
+                    np.eye(3),
+                    np.array(self.K),
+                    tuple(self.resolution),
+                    cv2.CV_16SC2
+                )
+            key = b'fisheye' + self.K.tobytes() + self.D.tobytes() + str(tuple(self.resolution)).encode()
+            self._remap_tables = _cached_remap_tables(cache_dir or self.cache_dir, key, build_tables)
+        return self._remap_tables
 
     def undistort(self, img):
         """
@@ -139,16 +211,7 @@ class Fisheye_Dist_Camera(object):
         :param img: Distorted input image
         :return: Undistorted image
         """
-        R = np.eye(3)
-
-        map1, map2 = cv2.fisheye.initUndistortRectifyMap(
-            np.array(self.K),
-            np.array(self.D),
-            R,
-            np.array(self.K),
-            self.resolution,
-            cv2.CV_16SC2
-        )
+        map1, map2 = self.remap_tables()
 
         undistorted_img = cv2.remap(
             img,
@@ -252,6 +315,72 @@ class Fisheye_Dist_Camera(object):
             image_points.shape = (-1, 1, 2)
         return image_points
 
+    def unprojectPointsBatch(self, pts_2d, use_distortion=True, normalize=False, out=None,
+                             tol=1e-10, max_iter=20):
+        """
+        Unprojects a whole recording of image points at once.
+        Same model as unprojectPoints but computed in float64. The distorted angle is inverted with
+        Newton's method which stops as soon as all points changed less than `tol`.
+        :param pts_2d: Distorted image points, shape: Nx2
+        :param out: Optional float64 array of shape Nx3 the result is written to
+        :return: Array of unprojected 3d points, shape: Nx3
+        """
+        pts_2d = _as_points(pts_2d, 2)
+        pts_3d = _output_array(out, (pts_2d.shape[0], 3))
+        k = self._k if use_distortion else self._undistorted_k
+
+        pw = pts_3d[:, :2]
+        np.subtract(pts_2d, self._c, out=pw)
+        pw /= self._f
+
+        theta_d = np.hypot(pw[:, 0], pw[:, 1])
+        theta = theta_d.copy()
+        for _ in range(max_iter):
+            theta2 = theta * theta
+            # theta_d(theta) = theta * (1 + k0 theta^2 + k1 theta^4 + k2 theta^6 + k3 theta^8)
+            f = theta * (1 + theta2 * (k[0] + theta2 * (k[1] + theta2 * (k[2] + theta2 * k[3])))) - theta_d
+            df = 1 + theta2 * (3 * k[0] + theta2 * (5 * k[1] + theta2 * (7 * k[2] + theta2 * 9 * k[3])))
+            step = f / df
+            theta -= step
+            if np.all(np.abs(step) < tol):
+                break
+
+        # tan(theta)/theta_d converges to 1 for points on the optical axis
+        scale = np.ones_like(theta_d)
+        np.divide(np.tan(theta), theta_d, out=scale, where=theta_d > 0)
+        pw *= scale[:, np.newaxis]
+        pts_3d[:, 2] = 1.
+
+        if normalize:
+            pts_3d /= np.linalg.norm(pts_3d, axis=1)[:, np.newaxis]
+
+        return pts_3d
+
+    def projectPointsBatch(self, object_points, use_distortion=True, out=None):
+        """
+        Projects a whole recording of 3D points given in camera coordinates at once.
+        Same model as projectPoints without rotation and translation.
+        :param object_points: 3D points in camera coordinates, shape: Nx3
+        :param out: Optional float64 array of shape Nx2 the result is written to
+        :return: Projected 2D points, shape: Nx2
+        """
+        object_points = _as_points(object_points, 3)
+        image_points = _output_array(out, (object_points.shape[0], 2))
+        k = self._k if use_distortion else self._undistorted_k
+
+        np.divide(object_points[:, :2], object_points[:, 2:], out=image_points)
+        r = np.hypot(image_points[:, 0], image_points[:, 1])
+        theta = np.arctan(r)
+        theta2 = theta * theta
+        theta_d = theta * (1 + theta2 * (k[0] + theta2 * (k[1] + theta2 * (k[2] + theta2 * k[3]))))
+
+        scale = np.ones_like(r)
+        np.divide(theta_d, r, out=scale, where=r > 0)
+        image_points *= scale[:, np.newaxis]
+        image_points *= self._f
+        image_points += self._c
+        return image_points
+
     def solvePnP(self, uv3d, xy):
         # xy_undist = self.unprojectPoints(xy)
         # f = np.array((self.K[0, 0], self.K[1, 1])).reshape(1, 2)
@@ -289,11 +418,48 @@ class Radial_Dist_Camera(object):
         Provides functionality to make use of a pinhole camera calibration that is also compensating for lense distortion
     """
 
-    def __init__(self, K, D, resolution, name):
+    def __init__(self, K, D, resolution, name, cache_dir=None):
         self.K = np.array(K)
         self.D = np.array(D)
         self.resolution = resolution
         self.name = name
+        self.cache_dir = cache_dir  # where remap_tables stores the undistortion tables, None keeps them in memory only
+        # derived intrinsics used by the batch methods
+        self._f = np.array((self.K[0, 0], self.K[1, 1]), dtype=np.float64)
+        self._c = np.array((self.K[0, 2], self.K[1, 2]), dtype=np.float64)
+        self._k = self.D.ravel().astype(np.float64)
+        self._remap_tables = None
+
+    def _distortion_coefs(self, use_distortion):
+        """Returns (k1, k2, p1, p2, k3) or None if the model uses more coefficients"""
+        if not use_distortion:
+            return 0., 0., 0., 0., 0.
+        if self._k.size == 4:
+            return tuple(self._k) + (0.,)
+        if self._k.size == 5:
+            return tuple(self._k)
+        return None
+
+    def remap_tables(self, cache_dir=None):
+        """
+        Fixed point undistortion tables for cv2.remap. They are built once per camera model and,
+        if `cache_dir` (default: the model's cache_dir) is given, stored there to be reused by other
+        models with the same intrinsics.
+        :return: map1 (CV_16SC2), map2 (CV_16UC1)
+        """
+        if self._remap_tables is None:
+            def build_tables():
+                return cv2.initUndistortRectifyMap(
+                    self.K,
+                    self.D,
+                    None,
+                    self.K,
+                    tuple(self.resolution),
+                    cv2.CV_16SC2
+                )
+            key = b'radial' + self.K.tobytes() + self.D.tobytes() + str(tuple(self.resolution)).encode()
+            self._remap_tables = _cached_remap_tables(cache_dir or self.cache_dir, key, build_tables)
+        return self._remap_tables
 
     def undistort(self, img):
         """
@@ -301,7 +467,8 @@ class Radial_Dist_Camera(object):
                 :param img: Distorted input image
                 :return: Undistorted image
                 """
-        undist_img = cv2.undistort(img, self.K, self.D)
+        map1, map2 = self.remap_tables()
+        undist_img = cv2.remap(img, map1, map2, interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT)
         return undist_img
 
     def unprojectPoints(self, pts_2d, use_distortion=True, normalize=False):
@@ -380,6 +547,78 @@ class Radial_Dist_Camera(object):
             image_points.shape = (-1, 1, 2)
         return image_points
 
+    def unprojectPointsBatch(self, pts_2d, use_distortion=True, normalize=False, out=None,
+                             tol=1e-10, max_iter=20):
+        """
+        Unprojects a whole recording of image points at once.
+        Same model as unprojectPoints but computed in float64. The distortion is inverted with the
+        fixed point iteration of cv2.undistortPoints which stops as soon as all points changed less than `tol`.
+        Unlike cv2.undistortPoints it doesn't stop after 5 iterations, thus results differ where those aren't
+        converged yet. Points outside the range in which the distortion is invertible do not converge.
+        :param pts_2d: Distorted image points, shape: Nx2
+        :param out: Optional float64 array of shape Nx3 the result is written to
+        :return: Array of unprojected 3d points, shape: Nx3
+        """
+        pts_2d = _as_points(pts_2d, 2)
+        pts_3d = _output_array(out, (pts_2d.shape[0], 3))
+        coefs = self._distortion_coefs(use_distortion)
+
+        if coefs is None:
+            # rational or thin prism model, let opencv handle it
+            pts_3d[:, :2] = cv2.undistortPoints(pts_2d.reshape(-1, 1, 2), self.K, self.D).reshape(-1, 2)
+        else:
+            k1, k2, p1, p2, k3 = coefs
+            x0 = (pts_2d[:, 0] - self._c[0]) / self._f[0]
+            y0 = (pts_2d[:, 1] - self._c[1]) / self._f[1]
+            x, y = x0.copy(), y0.copy()
+            for _ in range(max_iter if any(coefs) else 0):
+                r2 = x * x + y * y
+                icdist = 1. / (1 + r2 * (k1 + r2 * (k2 + r2 * k3)))
+                delta_x = 2 * p1 * x * y + p2 * (r2 + 2 * x * x)
+                delta_y = p1 * (r2 + 2 * y * y) + 2 * p2 * x * y
+                x_new = (x0 - delta_x) * icdist
+                y_new = (y0 - delta_y) * icdist
+                converged = np.all(np.abs(x_new - x) < tol) and np.all(np.abs(y_new - y) < tol)
+                x, y = x_new, y_new
+                if converged:
+                    break
+            pts_3d[:, 0] = x
+            pts_3d[:, 1] = y
+        pts_3d[:, 2] = 1.
+
+        if normalize:
+            pts_3d /= np.linalg.norm(pts_3d, axis=1)[:, np.newaxis]
+
+        return pts_3d
+
+    def projectPointsBatch(self, object_points, use_distortion=True, out=None):
+        """
+        Projects a whole recording of 3D points given in camera coordinates at once.
+        Same model as projectPoints without rotation and translation.
+        :param object_points: 3D points in camera coordinates, shape: Nx3
+        :param out: Optional float64 array of shape Nx2 the result is written to
+        :return: Projected 2D points, shape: Nx2
+        """
+        object_points = _as_points(object_points, 3)
+        image_points = _output_array(out, (object_points.shape[0], 2))
+        coefs = self._distortion_coefs(use_distortion)
+
+        if coefs is None:
+            image_points[:] = self.projectPoints(object_points).reshape(-1, 2)
+            return image_points
+
+        k1, k2, p1, p2, k3 = coefs
+        np.divide(object_points[:, :2], object_points[:, 2:], out=image_points)
+        x = image_points[:, 0].copy()
+        y = image_points[:, 1].copy()
+        r2 = x * x + y * y
+        radial = 1 + r2 * (k1 + r2 * (k2 + r2 * k3))
+        image_points[:, 0] = x * radial + 2 * p1 * x * y + p2 * (r2 + 2 * x * x)
+        image_points[:, 1] = y * radial + p1 * (r2 + 2 * y * y) + 2 * p2 * x * y
+        image_points *= self._f
+        image_points += self._c
+        return image_points
+
     def solvePnP(self, uv3d, xy):
         res = cv2.solvePnP(uv3d, xy, self.K, self.D, flags=cv2.SOLVEPNP_ITERATIVE)
         return res
@@ -400,12 +639,12 @@ class Dummy_Camera(Radial_Dist_Camera):
     Dummy Camera model assuming no lense distortion and idealized camera intrinsics.
     """
 
-    def __init__(self, resolution, name):
+    def __init__(self, resolution, name, cache_dir=None):
         camera_matrix = [[1000, 0., resolution[0] / 2.],
                          [0., 1000, resolution[1] / 2.],
                          [0., 0., 1.]]
         dist_coefs = [[0., 0., 0., 0., 0.]]
-        super().__init__(camera_matrix, dist_coefs, resolution, name)
+        super().__init__(camera_matrix, dist_coefs, resolution, name, cache_dir)
 
     def save(self, directory, custom_name=None):
         """
@@ -0,0 +1,36 @@
+'''
+(*)~---------------------------------------------------------------------------
+Pupil - eye tracking platform
+Copyright (C) 2012-2018 Pupil Labs
+
+Distributed under the terms of the GNU
+Lesser General Public License (LGPL v3.0).
+See COPYING and COPYING.LESSER for license details.
+---------------------------------------------------------------------------~(*)
+'''
+
+from coarse_pupil cimport center_surround, downsampled_integral, default_coarse_scale, coarse_result_t
+import numpy as np
+
+
+def coarse_scale(int roi_width):
+    return default_coarse_scale(roi_width)
+
+
+def coarse_integral(unsigned char[:,:] img, int scale):
+    # same size as cv2.integral(img[::scale, ::scale])
+    integral = np.empty(((img.shape[0] + scale - 1) // scale + 1, (img.shape[1] + scale - 1) // scale + 1), dtype=np.int32)
+    cdef int[:,::1] integral_view = integral
+    with nogil:
+        downsampled_integral(img, scale, integral_view)
+    return integral
+
+
+def coarse_candidates(int[:,::1] integral, int min_w, int max_w):
+    '''Returns the bounding box, the good and all candidates as (x, y, w, response) tuples'''
+    cdef coarse_result_t result
+    with nogil:
+        center_surround(integral, min_w, max_w, &result)
+    good = [(c.x, c.y, c.w, c.response) for c in result.good[:result.n_good]]
+    all_candidates = [(c.x, c.y, c.w, c.response) for c in result.all[:result.n_all]]
+    return (result.x1, result.y1, result.x2, result.y2), good, all_candidates
@@ -0,0 +1,16 @@
+'''
+(*)~---------------------------------------------------------------------------
+Pupil - eye tracking platform
+Copyright (C) 2012-2018 Pupil Labs
+
+Distributed under the terms of the GNU
+Lesser General Public License (LGPL v3.0).
+See COPYING and COPYING.LESSER for license details.
+---------------------------------------------------------------------------~(*)
+'''
+
+if __name__ == '__main__':
+    import sys
+    import subprocess as sp
+    sp.check_call([sys.executable, "setup_test.py", "build_ext", "--inplace"])
+    print("BUILD COMPLETE ______________________")
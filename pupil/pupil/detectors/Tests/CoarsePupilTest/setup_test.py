@@ -0,0 +1,38 @@
+'''
+(*)~---------------------------------------------------------------------------
+Pupil - eye tracking platform
+Copyright (C) 2012-2018 Pupil Labs
+
+Distributed under the terms of the GNU
+Lesser General Public License (LGPL v3.0).
+See COPYING and COPYING.LESSER for license details.
+---------------------------------------------------------------------------~(*)
+'''
+
+from setuptools import setup
+from setuptools.extension import Extension
+from Cython.Build import cythonize
+
+import os
+# coarse_pupil.pxd lives in the detectors directory
+detectors_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir))
+
+extensions = [
+    Extension(
+        name="CoarsePupilTest",
+        sources=['CoarsePupilTest.pyx'],
+        include_dirs=[detectors_dir],
+        extra_compile_args=['-O3', '-w'],
+        language="c"),
+]
+
+setup(
+    name="CoarsePupil Test",
+    version="0.1",
+    url="https://github.com/pupil-labs/pupil",
+    author='Pupil Labs',
+    author_email='info@pupil-labs.com',
+    license='GNU',
+    # integer division like the main build
+    ext_modules=cythonize(extensions, include_path=[detectors_dir], compiler_directives={'language_level': 2})
+)
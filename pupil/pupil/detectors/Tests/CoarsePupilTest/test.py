@@ -0,0 +1,102 @@
+'''
+(*)~---------------------------------------------------------------------------
+Pupil - eye tracking platform
+Copyright (C) 2012-2018 Pupil Labs
+
+Distributed under the terms of the GNU
+Lesser General Public License (LGPL v3.0).
+See COPYING and COPYING.LESSER for license details.
+---------------------------------------------------------------------------~(*)
+'''
+
+import numpy as np
+import cv2
+
+from CoarsePupilTest import coarse_scale, coarse_integral, coarse_candidates
+
+
+def reference_center_surround(img, min_w, max_w):
+    '''The python list version of center_surround, which the nogil version has to reproduce'''
+    f32 = np.float32
+    best_response = f32(-10000)
+    results = []
+    for h in range(min_w // 3, max_w // 3, 4):
+        w = 3 * h
+        outer_f, inner_f = f32(1.0 / (w * w)), f32(-1.0 / (h * h))
+        for i in range(0, img.shape[0] - w, 5):
+            for j in range(0, img.shape[1] - w, 5):
+                outer = int(img[i + w, j + w]) + img[i, j] - img[i, j + w] - img[i + w, j]
+                inner = int(img[i + 2 * h, j + 2 * h]) + img[i + h, j + h] - img[i + h, j + 2 * h] - img[i + 2 * h, j + h]
+                response = outer_f * f32(outer) + inner_f * f32(inner)
+                if response > best_response:
+                    best_response = response
+                    results.append((j, i, w, response))
+                    if len(results) > 30:
+                        results.pop(0)
+
+    bad = results[:]
+    for r in reversed(results):
+        x, y, w, response = r
+        if response < best_response * 0.4:
+            results.remove(r)
+            continue
+        for x2, y2, w2, _ in bad:
+            if x < x2 and y < y2 and x + w > x2 + w2 and y + w > y2 + w2:
+                results.remove(r)
+                break
+
+    x_b, y_b, x2_b, y2_b = 0, 0, 1, 1
+    if results:
+        x_b, y_b = results[0][:2]
+        for x, y, w, _ in results:
+            x_b, y_b = min(x, x_b), min(y, y_b)
+            x2_b, y2_b = max(x2_b, x + w), max(y2_b, y + w)
+    return (x_b, y_b, x2_b, y2_b), results, bad
+
+
+def eye_image(rng, height, width):
+    # dark pupil with a darker corner (eye lashes) on a noisy, bright background
+    img = rng.normal(170, 20, size=(height, width)).clip(0, 255).astype(np.uint8)
+    radius = rng.randint(height // 12, height // 5)
+    center = rng.randint(radius, width - radius), rng.randint(radius, height - radius)
+    cv2.circle(img, center, radius, int(rng.randint(10, 60)), -1)
+    cv2.rectangle(img, (0, 0), (width // 6, height // 8), 40, -1)
+    return np.ascontiguousarray(img)
+
+
+def test_integral():
+    rng = np.random.RandomState(0)
+    for height, width in ((480, 640), (400, 400), (97, 131)):
+        img = eye_image(rng, height, width)
+        for scale in (1, 2, 3, 5, coarse_scale(width)):
+            assert (coarse_integral(img, scale) == cv2.integral(img[::scale, ::scale])).all()
+        # a roi is a strided view into the frame
+        roi = img[10:-10, 20:-20]
+        assert (coarse_integral(roi, 3) == cv2.integral(roi[::3, ::3])).all()
+    assert coarse_scale(640) == 5 and coarse_scale(1280) == 10 and coarse_scale(100) == 1
+
+
+def test_center_surround():
+    rng = np.random.RandomState(1)
+    for n in range(40):
+        height, width = ((480, 640), (400, 400), (720, 1280))[n % 3]
+        img = eye_image(rng, height, width)
+        scale = 5 if n % 2 else coarse_scale(width)
+        integral = cv2.integral(img[::scale, ::scale])
+        # the default coarse filter sizes of Detector_2D
+        min_w, max_w = 128 // scale, 280 // scale
+        bounding_box, good, all_candidates = coarse_candidates(integral, min_w, max_w)
+        expected_box, expected_good, expected_all = reference_center_surround(integral, min_w, max_w)
+        assert bounding_box == expected_box
+        assert good == [(x, y, w, float(r)) for x, y, w, r in expected_good]
+        assert all_candidates == [(x, y, w, float(r)) for x, y, w, r in expected_all]
+
+
+def main():
+    test_integral()
+    test_center_surround()
+    print("coarse pupil tests passed")
+
+
+if __name__ == '__main__':
+    main()
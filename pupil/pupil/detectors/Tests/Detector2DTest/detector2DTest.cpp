@@ -0,0 +1,107 @@
+/*
+(*)~---------------------------------------------------------------------------
+Pupil - eye tracking platform
+Copyright (C) 2012-2018 Pupil Labs
+
+Distributed under the terms of the GNU
+Lesser General Public License (LGPL v3.0).
+See COPYING and COPYING.LESSER for license details.
+---------------------------------------------------------------------------~(*)
+*/
+
+#include <iostream>
+#include "../../detect_2d.hpp"
+
+
+namespace {
+
+    bool check(bool condition, const std::string& message)
+    {
+        if (!condition)
+            std::cout << "FAILED: " << message << std::endl;
+        return condition;
+    }
+
+    // the defaults of Detector_2D
+    Detector2DProperties defaultProperties()
+    {
+        Detector2DProperties props;
+        props.intensity_range = 23;
+        props.blur_size = 5;
+        props.canny_treshold = 160;
+        props.canny_ration = 2;
+        props.canny_aperture = 5;
+        props.pupil_size_max = 150;
+        props.pupil_size_min = 10;
+        props.strong_perimeter_ratio_range_min = 0.6;
+        props.strong_perimeter_ratio_range_max = 1.1;
+        props.strong_area_ratio_range_min = 0.8;
+        props.strong_area_ratio_range_max = 1.1;
+        props.contour_size_min = 5;
+        props.ellipse_roundness_ratio = 0.09;
+        props.initial_ellipse_fit_treshhold = 4.3;
+        props.final_perimeter_ratio_range_min = 0.5;
+        props.final_perimeter_ratio_range_max = 1.0;
+        props.ellipse_true_support_min_dist = 3.0;
+        props.support_pixel_ratio_exponent = 2.0;
+        return props;
+    }
+
+    // a dark pupil in a gray iris, surrounded by bright skin
+    cv::Mat createEyeImage(cv::Point center)
+    {
+        cv::Mat image(240, 320, CV_8UC1, cv::Scalar(200));
+        cv::circle(image, center, 70, cv::Scalar(110), -1);
+        cv::ellipse(image, center, cv::Size(30, 24), 20, 0, 360, cv::Scalar(30), -1);
+        cv::GaussianBlur(image, image, cv::Size(5, 5), 1.0);
+        return image;
+    }
+
+    bool sameEdges(const std::vector<cv::Point>& a, const std::vector<cv::Point>& b)
+    {
+        return a.size() == b.size() && std::equal(a.begin(), a.end(), b.begin());
+    }
+
+}
+
+bool testEdgesOnly()
+{
+    bool passed = true;
+    Detector2DProperties props = defaultProperties();
+    cv::Mat image = createEyeImage(cv::Point(170, 110));
+    cv::Mat color, debug;
+    cv::Rect roi(60, 30, 220, 180);
+
+    Detector2D detector;
+    auto full = detector.detect(props, image, color, debug, roi, false, false);
+    passed &= check(full->confidence > 0.9, "the full detection finds the pupil");
+    passed &= check(std::abs(full->ellipse.center[0] - 170) < 1.0 && std::abs(full->ellipse.center[1] - 110) < 1.0, "the full detection finds the pupil center");
+    passed &= check(!full->raw_edges.empty(), "the full detection keeps the raw edges");
+
+    // in between full detections only the raw edges are wanted, they have to be the same edges
+    detector.setEdgesOnly(true);
+    auto edgesOnly = detector.detect(props, image, color, debug, roi, false, false);
+    passed &= check(edgesOnly->confidence == 0.0 && edgesOnly->ellipse == Detector2DResult().ellipse, "edges only doesn't fit an ellipse");
+    passed &= check(edgesOnly->final_edges.empty(), "edges only has no final edges");
+    passed &= check(sameEdges(edgesOnly->raw_edges, full->raw_edges), "edges only finds the edges of the full detection");
+    passed &= check(edgesOnly->current_roi == roi && edgesOnly->image_width == image.cols && edgesOnly->image_height == image.rows, "edges only describes the roi");
+
+    // the next full detection is the same as without the edges only frame, the strong prior included
+    detector.setEdgesOnly(false);
+    Detector2D reference;
+    reference.detect(props, image, color, debug, roi, false, false);
+    auto again = detector.detect(props, image, color, debug, roi, false, false);
+    auto expected = reference.detect(props, image, color, debug, roi, false, false);
+    passed &= check(again->confidence == expected->confidence && again->ellipse.center == expected->ellipse.center, "edges only doesn't change the next full detection");
+
+    return passed;
+}
+
+
+int main()
+{
+    std::cout << "Start Test" << std::endl;
+    bool passed = testEdgesOnly();
+    std::cout << (passed ? "detector 2d tests passed" : "detector 2d tests FAILED") << std::endl;
+    return passed ? 0 : 1;
+}
@@ -0,0 +1,33 @@
+'''
+(*)~---------------------------------------------------------------------------
+Pupil - eye tracking platform
+Copyright (C) 2012-2018 Pupil Labs
+
+Distributed under the terms of the GNU
+Lesser General Public License (LGPL v3.0).
+See COPYING and COPYING.LESSER for license details.
+---------------------------------------------------------------------------~(*)
+'''
+
+if __name__ == '__main__':
+    import os
+    import sys
+    import sysconfig
+    import subprocess as sp
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    sources = ['eyeModelFitterTest.cpp',
+               '../../singleeyefitter/EyeModelFitter.cpp',
+               '../../singleeyefitter/EyeModel.cpp',
+               '../../singleeyefitter/utils.cpp']
+    python_lib = 'python{}.{}'.format(*sys.version_info[:2])
+    boost_lib = 'boost_python{}{}'.format(*sys.version_info[:2])
+    build = ("g++ -std=c++11 -O2 -D_USE_MATH_DEFINES -w "
+             "-I '/usr/local/include/eigen3' -I '/usr/include/eigen3' -I '/usr/local/include' -I '{}' "
+             "-I '../../../shared_cpp/include' -I '../../singleeyefitter' {} -o test "
+             "-L/usr/local/lib -lceres -lglog -lopencv_core -lopencv_imgproc -lopencv_video -l{} -l{} -pthread"
+             ).format(sysconfig.get_paths()['include'], ' '.join(sources), boost_lib, python_lib)
+    if sp.call(build, shell=True) != 0:
+        sys.exit("BUILD FAILED")
+    print("BUILD COMPLETE ______________________")
+    sys.exit(sp.call("./test", shell=True))
@@ -0,0 +1,421 @@
+/*
+(*)~---------------------------------------------------------------------------
+Pupil - eye tracking platform
+Copyright (C) 2012-2018 Pupil Labs
+
+Distributed under the terms of the GNU
+Lesser General Public License (LGPL v3.0).
+See COPYING and COPYING.LESSER for license details.
+---------------------------------------------------------------------------~(*)
+*/
+
+#include <Python.h> // the logger of the fitter needs an interpreter
+#include <iostream>
+#include "../../singleeyefitter/EyeModelFitter.h"
+#include "math/intersect.h"
+#include "mathHelper.h"
+#include "../TestUtils.h"
+
+
+namespace singleeyefitter {
+
+    class EyeModelFitterTest {
+        public:
+
+            static bool testUnprojectEdges();
+            static bool testFilterCircle3();
+            static bool testPredictPupilState();
+            static bool testPredictedFramesDontCountForTheModels();
+            static bool testPredictAndDetect();
+            static bool testAlternativeModelRoundRobin();
+
+        private:
+
+            static bool check(bool condition, const std::string& message);
+            static Edges2D createPupilEdges(const Circle& circle, double focalLength, const cv::Rect& roi, int clutter);
+            static std::shared_ptr<Detector2DResult> createObservation(double timestamp, Edges2D rawEdges = Edges2D());
+            // the per edge implementation filterCircle3 had before the edges became compact float arrays
+            static void referenceFilterCircle3(const EyeModelFitter& fitter, const Circle& predictedCircle, const Edges3D& edgesOnSphere, Detector3DResult& result);
+    };
+
+}
+
+using namespace singleeyefitter;
+
+namespace {
+
+    const double focalLength = 620;
+    const int imageWidth = 640;
+    const int imageHeight = 480;
+    const int imageWidthHalf = imageWidth / 2.0;
+    const int imageHeightHalf = imageHeight / 2.0;
+    const Sphere<double> eye(Vector3(1.5, -2.0, 38.0), 12.0);
+    // looks slightly past the camera
+    const double pupilTheta = M_PI / 2 + 0.1;
+    const double pupilPsi = -M_PI / 2 + 0.15;
+    const cv::Rect roi(180, 100, 320, 300);
+
+}
+
+bool EyeModelFitterTest::check(bool condition, const std::string& message)
+{
+    if (!condition)
+        std::cout << "FAILED: " << message << std::endl;
+    return condition;
+}
+
+Edges2D EyeModelFitterTest::createPupilEdges(const Circle& circle, double focalLength, const cv::Rect& roi, int clutter)
+{
+    // edges are relative to the roi, in image coordinates with y pointing down
+    Edges2D edges;
+    for (const auto& point : createProjectedCirclePoints(circle, focalLength, 400)) {
+        edges.emplace_back(std::round(point.x() + imageWidthHalf) - roi.x, std::round(imageHeightHalf - point.y()) - roi.y);
+    }
+    for (int i = 0; i < clutter; ++i) {
+        edges.emplace_back(random(0, roi.width - 1), random(0, roi.height - 1));
+    }
+    return edges;
+}
+
+std::shared_ptr<Detector2DResult> EyeModelFitterTest::createObservation(double timestamp, Edges2D rawEdges)
+{
+    // an unconfident 2D fit, the models ignore it
+    auto observation = std::make_shared<Detector2DResult>();
+    observation->ellipse = Ellipse(imageWidthHalf, imageHeightHalf, 40.0, 30.0, 0.0);
+    observation->confidence = 0.0;
+    observation->timestamp = timestamp;
+    observation->image_width = imageWidth;
+    observation->image_height = imageHeight;
+    observation->current_roi = roi;
+    observation->raw_edges = std::move(rawEdges);
+    return observation;
+}
+
+bool EyeModelFitterTest::testUnprojectEdges()
+{
+    bool passed = true;
+
+    for (const Vector3& cameraCenter : { Vector3(0, 0, 0), Vector3(0.4, -0.3, 0.2) }) {
+
+        EyeModelFitter fitter(focalLength, cameraCenter);
+        fitter.mCurrentSphere = eye;
+
+        // a grid over the roi, the rays around the border of the sphere miss it
+        // rays grazing the sphere are left out, float and double could decide differently for them
+        Edges2D edges;
+        Edges3D expected;
+        for (int y = 0; y < roi.height; y += 3) {
+            for (int x = 0; x < roi.width; x += 3) {
+                Vector3 point3D(x + roi.x - imageWidthHalf, imageHeightHalf - (y + roi.y), focalLength);
+                Vector3 direction = (point3D - cameraCenter).normalized();
+                Vector3 c = eye.center - cameraCenter;
+                double discriminant = math::sq(direction.dot(c)) - c.squaredNorm() + math::sq(eye.radius);
+                if (std::abs(discriminant) < 1.0)
+                    continue;
+
+                edges.emplace_back(x, y);
+                std::pair<Vector3, Vector3> unprojectedPoints;
+                if (intersect(Line3(cameraCenter, direction), eye, unprojectedPoints))
+                    expected.push_back(unprojectedPoints.first);
+            }
+        }
+
+        EdgesCompact3D edgesOnSphere = fitter.unprojectEdges(edges, roi.tl(), imageWidthHalf, imageHeightHalf);
+        passed &= check(expected.size() > 100 && expected.size() < edges.size(), "the grid covers hits and misses");
+        passed &= check(edgesOnSphere.rows() == int(expected.size()), "unprojectEdges keeps the edges which intersect the sphere");
+        if (edgesOnSphere.rows() == int(expected.size())) {
+            double maxError = 0.0;
+            for (size_t i = 0; i < expected.size(); ++i) {
+                maxError = std::max(maxError, (edgesOnSphere.row(i).transpose().cast<double>() - expected[i]).norm());
+            }
+            passed &= check(maxError < 1e-3, "unprojectEdges matches intersect, error " + std::to_string(maxError));
+        }
+
+        passed &= check(fitter.unprojectEdges(Edges2D(), roi.tl(), imageWidthHalf, imageHeightHalf).rows() == 0, "no edges, no edges on the sphere");
+    }
+
+    return passed;
+}
+
+void EyeModelFitterTest::referenceFilterCircle3(const EyeModelFitter& fitter, const Circle& predictedCircle, const Edges3D& edgesOnSphere, Detector3DResult& result)
+{
+    if (edgesOnSphere.size() == 0)
+        return;
+
+    const auto& sphere = fitter.mCurrentSphere;
+    int maxEdgeCount;
+    auto searchCenter = [&](Vector3 searchCenter, double positionVariance, double searchStep, int bandWidthPixel) -> Circle {
+
+        double h = sphere.radius - std::sqrt(sphere.radius * sphere.radius - predictedCircle.radius * predictedCircle.radius);
+        double pupilSphereRadiusSquared = 2.0 * sphere.radius * h;
+        double pupilSphereRadius = std::sqrt(pupilSphereRadiusSquared);
+        const double maxFilterDistanceSquared = pupilSphereRadiusSquared + std::pow(std::sin(positionVariance) * sphere.radius, 2);
+
+        Edges3D filteredEdges;
+        for (const auto& e : edgesOnSphere) {
+            if ((e - predictedCircle.center).squaredNorm() < maxFilterDistanceSquared)
+                filteredEdges.push_back(e);
+        }
+
+        Vector2 predictedPupilCenter = math::cart2sph(Vector3(searchCenter - sphere.center));
+        maxEdgeCount = 0;
+        Vector3 bestCircleCenter(0, 0, 0);
+        double bestCircleRadius = 0.0;
+
+        for (double i = predictedPupilCenter.x() - positionVariance; i <= predictedPupilCenter.x() + positionVariance; i += searchStep) {
+            for (double j = predictedPupilCenter.y() - positionVariance; j <= predictedPupilCenter.y() + positionVariance; j += searchStep) {
+
+                const Vector3 newPupilCenter = sphere.center + math::sph2cart(sphere.radius, i, j);
+                const double bandWidthHalf = bandWidthPixel * newPupilCenter.z() / fitter.mFocalLength / 2.0;
+                const double maxDistanceSquared = std::pow(pupilSphereRadius + bandWidthHalf, 2);
+                const double minDistanceSquared = std::pow(pupilSphereRadius - bandWidthHalf, 2);
+
+                int edgeCount = 0;
+                double accRadius = 0.0;
+                for (const auto& e : filteredEdges) {
+                    double distanceSquared = (e - newPupilCenter).squaredNorm();
+                    if (distanceSquared < maxDistanceSquared && distanceSquared > minDistanceSquared) {
+                        edgeCount++;
+                        accRadius += std::sqrt(distanceSquared);
+                    }
+                }
+
+                if (edgeCount > maxEdgeCount) {
+                    bestCircleCenter = newPupilCenter;
+                    bestCircleRadius = accRadius / edgeCount;
+                    maxEdgeCount = edgeCount;
+                }
+            }
+        }
+        if (maxEdgeCount == 0)
+            return Circle::Null;
+        return Circle(bestCircleCenter, (bestCircleCenter - sphere.center).normalized(), bestCircleRadius);
+    };
+
+    auto circle = searchCenter(predictedCircle.center, 0.2, 0.05, 6);
+    circle = searchCenter(circle.center, 0.05, 0.01, 2);
+
+    if (circle != Circle::Null) {
+        result.circle = circle;
+        result.ellipse = Ellipse(project(result.circle, fitter.mFocalLength));
+        result.confidence = std::min(maxEdgeCount / result.ellipse.circumference(), 1.0);
+    }
+}
+
+bool EyeModelFitterTest::testFilterCircle3()
+{
+    bool passed = true;
+
+    EyeModelFitter fitter(focalLength);
+    fitter.mCurrentSphere = eye;
+    fitter.mDebug = false;
+    Detector3DProperties props;
+
+    const Circle pupil = circleOnSphere(eye, pupilTheta, pupilPsi, 2.0);
+    const Circle predictedCircle = circleOnSphere(eye, pupilTheta + 0.05, pupilPsi - 0.04, 2.0);
+
+    EdgesCompact3D edgesOnSphere = fitter.unprojectEdges(createPupilEdges(pupil, focalLength, roi, 300), roi.tl(), imageWidthHalf, imageHeightHalf);
+    Edges3D edges;
+    for (int i = 0; i < edgesOnSphere.rows(); ++i) {
+        edges.push_back(edgesOnSphere.row(i).transpose().cast<double>());
+    }
+
+    Detector3DResult result, expected;
+    fitter.filterCircle3(predictedCircle, edgesOnSphere, props, result);
+    referenceFilterCircle3(fitter, predictedCircle, edges, expected);
+
+    passed &= check(expected.circle != Circle::Null && result.circle != Circle::Null, "filterCircle3 finds a circle");
+    if (result.circle != Circle::Null && expected.circle != Circle::Null) {
+        // float and double may tip a tie towards a neighbouring candidate, one step of the fine search is 0.01 rad
+        passed &= check((result.circle.center - expected.circle.center).norm() < 0.15, "filterCircle3 matches the per edge search");
+        passed &= check(std::abs(result.circle.radius - expected.circle.radius) < 0.05, "filterCircle3 matches the per edge radius");
+        passed &= check(std::abs(result.confidence - expected.confidence) < 0.05, "filterCircle3 matches the per edge confidence");
+        passed &= check((result.circle.center - pupil.center).norm() < 0.3 && std::abs(result.circle.radius - pupil.radius) < 0.2, "filterCircle3 finds the pupil");
+    }
+
+    Detector3DResult empty;
+    fitter.filterCircle3(predictedCircle, EdgesCompact3D(), props, empty);
+    passed &= check(empty.circle == Circle::Null && empty.confidence == 0.0, "no edges, no circle");
+
+    return passed;
+}
+
+bool EyeModelFitterTest::testPredictPupilState()
+{
+    bool passed = true;
+
+    EyeModelFitter fitter(focalLength);
+    fitter.mCurrentSphere = eye;
+    auto noiseIs = [&](double expected) {
+        const cv::Mat& noise = fitter.mPupilState.processNoiseCov;
+        return cv::norm(noise - cv::Mat::eye(7, 7, CV_64F) * expected) < 1e-12;
+    };
+
+    // full detections keep the fixed per frame process noise, whatever time passed
+    fitter.predictPupilState(0.1);
+    passed &= check(noiseIs(1e-4), "fixed process noise without scaling");
+    fitter.predictPupilState(1.0 / 120);
+    passed &= check(noiseIs(1e-4), "fixed process noise at any frame rate");
+
+    // tracked frames scale it with the time passed, one frame at 30fps is the fixed noise
+    fitter.predictPupilState(1.0 / 30, true);
+    passed &= check(noiseIs(1e-4), "scaled process noise of one frame at 30fps");
+    fitter.predictPupilState(0.1, true);
+    passed &= check(noiseIs(3e-4), "scaled process noise of 0.1s");
+    fitter.predictPupilState(5.0, true);
+    passed &= check(noiseIs(3e-3), "long gaps are capped at one second");
+    fitter.predictPupilState(-1.0, true);
+    passed &= check(noiseIs(0.0), "no noise for timestamps going back");
+
+    // the prediction is on the sphere
+    Circle predicted = fitter.predictPupilState(1.0 / 30);
+    passed &= check(std::abs((predicted.center - eye.center).norm() - eye.radius) < 1e-9, "the predicted pupil is on the sphere");
+
+    return passed;
+}
+
+bool EyeModelFitterTest::testPredictedFramesDontCountForTheModels()
+{
+    bool passed = true;
+    Detector3DProperties props;
+    props.model_sensitivity = 0.997;
+    props.model_max_alternatives = 3;
+    props.model_alternative_updates_per_frame = 1;
+    props.refinement_edges_per_pupil = 0;
+    // the timestamps are exact in binary, the frame rate is exactly 32
+    const double frameTime = 1.0 / 32;
+
+    // a detection stride of 1 only runs full detections, the models see every frame
+    EyeModelFitter everyFrame(focalLength);
+    for (int i = 0; i < 10; ++i) {
+        auto observation = createObservation(i * frameTime);
+        everyFrame.updateAndDetect(observation, props);
+    }
+    passed &= check(everyFrame.mApproximatedFramerate == 32, "full detections count for the framerate of the models");
+    passed &= check(everyFrame.mLastFrameTimestamp == 9 * frameTime && everyFrame.mLastObservationTimestamp == 9 * frameTime, "full detections are the last frame and observation");
+
+    // a detection stride of 2, the predicted frames advance the kalman filter but the models don't see them
+    EyeModelFitter everyOtherFrame(focalLength);
+    for (int i = 0; i < 10; ++i) {
+        auto observation = createObservation(i * frameTime);
+        if (i % 2 == 0) {
+            everyOtherFrame.updateAndDetect(observation, props);
+        } else {
+            Detector3DResult result = everyOtherFrame.predictAndDetect(observation, props);
+            // there is no model yet, nothing to predict
+            passed &= check(result.circle == Circle::Null && result.ellipse == Ellipse::Null && result.confidence == 0.0, "no prediction without a model");
+            passed &= check(result.timestamp == i * frameTime, "predicted frames keep their timestamp");
+        }
+    }
+    passed &= check(everyOtherFrame.mApproximatedFramerate == 16, "predicted frames don't count for the framerate of the models");
+    passed &= check(everyOtherFrame.mLastFrameTimestamp == 9 * frameTime && everyOtherFrame.mLastObservationTimestamp == 8 * frameTime, "predicted frames are the last frame but no observation");
+
+    return passed;
+}
+
+bool EyeModelFitterTest::testPredictAndDetect()
+{
+    bool passed = true;
+    Detector3DProperties props;
+
+    EyeModelFitter fitter(focalLength);
+    fitter.mCurrentSphere = eye;
+    fitter.mLastFrameTimestamp = 1.0;
+
+    // the pupil was here and at rest
+    cv::Mat& state = fitter.mPupilState.statePost;
+    state = cv::Mat::zeros(7, 1, CV_64F);
+    state.at<double>(0) = pupilTheta;
+    state.at<double>(1) = pupilPsi;
+    state.at<double>(6) = 2.0;
+
+    // and moved a bit in the meantime
+    const Circle pupil = circleOnSphere(eye, pupilTheta + 0.03, pupilPsi - 0.02, 2.0);
+    auto observation = createObservation(1.0 + 1.0 / 30, createPupilEdges(pupil, focalLength, roi, 100));
+    Detector3DResult result = fitter.predictAndDetect(observation, props);
+
+    passed &= check(result.circle != Circle::Null && (result.circle.center - pupil.center).norm() < 0.3, "predictAndDetect follows the pupil");
+    passed &= check(result.confidence > 0.0 && result.ellipse != Ellipse::Null, "the edges support the tracked pupil");
+    passed &= check(result.sphere == eye && result.modelID == fitter.mActiveModelPtr->getModelID(), "predictAndDetect reports the current model");
+    passed &= check(fitter.mLastFrameTimestamp == observation->timestamp, "predicted frames advance the kalman filter");
+    // the filter was corrected with the tracked circle
+    Vector2 params = paramsOnSphere(eye, pupil);
+    passed &= check(std::abs(state.at<double>(0) - params[0]) < std::abs(pupilTheta - params[0]), "the kalman filter is corrected towards the tracked pupil");
+
+    // without any edges the prediction is reported without confidence
+    observation = createObservation(1.0 + 2.0 / 30);
+    result = fitter.predictAndDetect(observation, props);
+    passed &= check(result.circle != Circle::Null && result.confidence == 0.0, "the prediction is reported without confidence");
+    passed &= check(std::abs((result.circle.center - eye.center).norm() - eye.radius) < 1e-9, "the reported prediction is on the sphere");
+
+    return passed;
+}
+
+bool EyeModelFitterTest::testAlternativeModelRoundRobin()
+{
+    bool passed = true;
+    Detector3DProperties props;
+
+    EyeModelFitter fitter(focalLength);
+    // models which haven't seen an observation yet take the timestamp of the first one as birth timestamp
+    for (int id = 10; id < 14; ++id) {
+        fitter.mAlternativeModelsPtrs.emplace_back(new EyeModel(id, -1, focalLength, Vector3::Zero()));
+    }
+    auto modelsAre = [&](std::vector<int> ids, std::vector<double> birthTimestamps) {
+        std::vector<int> modelIds;
+        std::vector<double> modelBirthTimestamps;
+        for (const auto& model : fitter.mAlternativeModelsPtrs) {
+            modelIds.push_back(model->getModelID());
+            modelBirthTimestamps.push_back(model->getBirthTimestamp());
+        }
+        return modelIds == ids && modelBirthTimestamps == birthTimestamps;
+    };
+    // an unconfident observation, the models don't keep it
+    auto observation2D = std::make_shared<Detector2DResult>();
+    observation2D->ellipse = Ellipse(project(circleOnSphere(eye, pupilTheta, pupilPsi, 2.0), focalLength));
+    observation2D->confidence = 0.5;
+    auto present = [&](double timestamp, int updatesPerFrame) {
+        observation2D->timestamp = timestamp;
+        props.model_alternative_updates_per_frame = updatesPerFrame;
+        fitter.presentToAlternativeModels(std::make_shared<const Observation>(observation2D, focalLength), props);
+    };
+
+    // one model per frame, the updated model goes to the back of the queue
+    present(1.0, 1);
+    passed &= check(modelsAre({ 11, 12, 13, 10 }, { -1, -1, -1, 1.0 }), "one alternative model per frame");
+    present(2.0, 1);
+    passed &= check(modelsAre({ 12, 13, 10, 11 }, { -1, -1, 1.0, 2.0 }), "the next frame updates the next model");
+
+    // more models per frame, the ones which waited longest come first
+    present(3.0, 3);
+    passed &= check(modelsAre({ 11, 12, 13, 10 }, { 2.0, 3.0, 3.0, 1.0 }), "three alternative models per frame");
+
+    // 0 or more updates than models update all of them and keep the order
+    present(4.0, 0);
+    passed &= check(modelsAre({ 11, 12, 13, 10 }, { 2.0, 3.0, 3.0, 1.0 }), "all alternative models with 0 updates per frame");
+    present(5.0, 7);
+    passed &= check(modelsAre({ 11, 12, 13, 10 }, { 2.0, 3.0, 3.0, 1.0 }), "all alternative models with more updates than models");
+
+    fitter.mAlternativeModelsPtrs.clear();
+    present(6.0, 1);
+    passed &= check(fitter.mAlternativeModelsPtrs.empty(), "no alternative models, nothing to update");
+
+    return passed;
+}
+
+
+int main()
+{
+    Py_Initialize();
+
+    std::cout << "Start Test" << std::endl;
+    bool passed = true;
+    passed &= EyeModelFitterTest::testUnprojectEdges();
+    passed &= EyeModelFitterTest::testFilterCircle3();
+    passed &= EyeModelFitterTest::testPredictPupilState();
+    passed &= EyeModelFitterTest::testPredictedFramesDontCountForTheModels();
+    passed &= EyeModelFitterTest::testPredictAndDetect();
+    passed &= EyeModelFitterTest::testAlternativeModelRoundRobin();
+    std::cout << (passed ? "eye model fitter tests passed" : "eye model fitter tests FAILED") << std::endl;
+    return passed ? 0 : 1;
+}
@@ -0,0 +1,29 @@
+'''
+(*)~---------------------------------------------------------------------------
+Pupil - eye tracking platform
+Copyright (C) 2012-2018 Pupil Labs
+
+Distributed under the terms of the GNU
+Lesser General Public License (LGPL v3.0).
+See COPYING and COPYING.LESSER for license details.
+---------------------------------------------------------------------------~(*)
+'''
+
+if __name__ == '__main__':
+    import os
+    import sys
+    import subprocess as sp
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    sources = ['eyeModelTest.cpp',
+               '../../singleeyefitter/EyeModel.cpp',
+               '../../singleeyefitter/utils.cpp']
+    build = ("g++ -std=c++11 -O2 -D_USE_MATH_DEFINES -w "
+             "-I '/usr/local/include/eigen3' -I '/usr/include/eigen3' -I '/usr/local/include' "
+             "-I '../../../shared_cpp/include' -I '../../singleeyefitter' {} -o test "
+             "-L/usr/local/lib -lceres -lglog -lopencv_core -pthread"
+             ).format(' '.join(sources))
+    if sp.call(build, shell=True) != 0:
+        sys.exit("BUILD FAILED")
+    print("BUILD COMPLETE ______________________")
+    sys.exit(sp.call("./test", shell=True))
@@ -0,0 +1,311 @@
+/*
+(*)~---------------------------------------------------------------------------
+Pupil - eye tracking platform
+Copyright (C) 2012-2018 Pupil Labs
+
+Distributed under the terms of the GNU
+Lesser General Public License (LGPL v3.0).
+See COPYING and COPYING.LESSER for license details.
+---------------------------------------------------------------------------~(*)
+*/
+
+#include <iostream>
+#include <chrono>
+#include <thread>
+#include "../../singleeyefitter/EyeModel.h"
+#include "mathHelper.h"
+#include "../TestUtils.h"
+
+
+namespace singleeyefitter {
+
+    class EyeModelTest {
+        public:
+
+            static bool testFindSphereCenter();
+            static bool testRefinementHandOff();
+            static bool testWarmStart();
+
+        private:
+
+            static bool check(bool condition, const std::string& message);
+            static ObservationPtr createObservation(const Circle& circle, double confidence, double timestamp);
+            // pupils looking around from the true eye, the same in every test
+            static std::vector<Circle> createPupilCircles();
+            // observations whose gaze lines don't pass near the projected eye center
+            static std::vector<ObservationPtr> createOutliers(int amount);
+            // the defaults of Detector_3D
+            static Detector3DProperties defaultProperties();
+            // hands the observations to the worker
+            static void scheduleRefinement(EyeModel& model, const std::vector<ObservationPtr>& observations, const Detector3DProperties& props);
+            static bool waitForRefinement(const EyeModel& model);
+            static bool isWorkPending(EyeModel& model);
+    };
+
+}
+
+using namespace singleeyefitter;
+
+namespace {
+
+    const double focalLength = 620;
+    // the camera is the origin
+    const Sphere<double> eye(Vector3(1.5, -2.0, 38.0), 12.0);
+    // looks slightly past the camera
+    const double pupilTheta = M_PI / 2 + 0.1;
+    const double pupilPsi = -M_PI / 2 + 0.15;
+
+}
+
+bool EyeModelTest::check(bool condition, const std::string& message)
+{
+    if (!condition)
+        std::cout << "FAILED: " << message << std::endl;
+    return condition;
+}
+
+ObservationPtr EyeModelTest::createObservation(const Circle& circle, double confidence, double timestamp)
+{
+    // a perfect 2D fit, ellipse and edges are in the coordinate system of the models
+    auto observation2D = std::make_shared<Detector2DResult>();
+    observation2D->ellipse = Ellipse(project(circle, focalLength));
+    for (const auto& point : createProjectedCirclePoints(circle, focalLength, 60)) {
+        observation2D->final_edges.emplace_back(std::round(point.x()), std::round(point.y()));
+    }
+    observation2D->confidence = confidence;
+    observation2D->timestamp = timestamp;
+    return std::make_shared<const Observation>(observation2D, focalLength);
+}
+
+std::vector<Circle> EyeModelTest::createPupilCircles()
+{
+    std::vector<Circle> circles;
+    for (int i = -3; i < 3; ++i) {
+        for (int j = -2; j < 3; ++j) {
+            circles.push_back(circleOnSphere(eye, pupilTheta + 0.1 * i, pupilPsi + 0.12 * j, 2.0));
+        }
+    }
+    return circles;
+}
+
+std::vector<ObservationPtr> EyeModelTest::createOutliers(int amount)
+{
+    const Vector2 eyeCenterProjected = project(eye.center, focalLength);
+    std::vector<ObservationPtr> outliers;
+    while (outliers.size() < size_t(amount)) {
+        Vector3 center(random(-8.0, 8.0), random(-8.0, 8.0), random(30.0, 45.0));
+        Vector3 normal(random(-1.0, 1.0), random(-1.0, 1.0), random(-1.0, -0.3));
+        auto outlier = createObservation(Circle(center, normal.normalized(), 2.0), 1.0, 0.0);
+        if (outlier->getProjectedCircleGaze().distance(eyeCenterProjected) > 50.0)
+            outliers.push_back(outlier);
+    }
+    return outliers;
+}
+
+Detector3DProperties EyeModelTest::defaultProperties()
+{
+    Detector3DProperties props;
+    props.model_sensitivity = 0.997;
+    props.refinement_max_solver_time = 0;
+    props.refinement_max_iterations = 400;
+    props.model_max_pupils = 300;
+    props.model_pupils_per_bin = 1;
+    props.refinement_edges_per_pupil = 0;
+    props.refinement_linear_solver = 0;
+    props.model_max_alternatives = 3;
+    props.model_alternative_updates_per_frame = 1;
+    return props;
+}
+
+void EyeModelTest::scheduleRefinement(EyeModel& model, const std::vector<ObservationPtr>& observations, const Detector3DProperties& props)
+{
+    // what presentObservation does, without collecting a finished refinement first
+    for (const auto& observation : observations) {
+        model.mSupportingPupilsToAdd.emplace_back(observation);
+    }
+    while (!model.tryTransferNewObservations(props.model_max_pupils)) {
+        std::this_thread::sleep_for(std::chrono::milliseconds(1));
+    }
+    {
+        std::lock_guard<std::mutex> lockWork(model.mWorkMutex);
+        model.mRefinementProps = props;
+        model.mWorkPending = true;
+    }
+    model.mWorkCondition.notify_one();
+}
+
+bool EyeModelTest::waitForRefinement(const EyeModel& model)
+{
+    const auto timeout = std::chrono::steady_clock::now() + std::chrono::seconds(60);
+    while (!model.mRefinementReady.load()) {
+        if (std::chrono::steady_clock::now() > timeout)
+            return false;
+        std::this_thread::sleep_for(std::chrono::milliseconds(5));
+    }
+    return true;
+}
+
+bool EyeModelTest::isWorkPending(EyeModel& model)
+{
+    std::lock_guard<std::mutex> lockWork(model.mWorkMutex);
+    return model.mWorkPending;
+}
+
+bool EyeModelTest::testFindSphereCenter()
+{
+    bool passed = true;
+    // findSphereCenter places the eye center at a fixed depth
+    const Vector3 expectedCenter = eye.center * 57.0 / eye.center.z();
+    const auto circles = createPupilCircles();
+
+    EyeModel model(1, 0.0, focalLength, Vector3::Zero());
+    passed &= check(model.findSphereCenter() == Sphere<double>::Null, "no pupils, no sphere");
+    model.mSupportingPupils.emplace_back(createObservation(circles.front(), 1.0, 0.0));
+    passed &= check(model.findSphereCenter() == Sphere<double>::Null, "one pupil, no sphere");
+    model.mSupportingPupils.clear();
+
+    for (const auto& circle : circles) {
+        model.mSupportingPupils.emplace_back(createObservation(circle, 1.0, 0.0));
+    }
+    const auto withoutRansac = model.findSphereCenter(false);
+    passed &= check(withoutRansac != Sphere<double>::Null && (withoutRansac.center - expectedCenter).norm() < 1e-6, "least squares intersection of the gaze lines");
+    const auto withRansac = model.findSphereCenter(true);
+    passed &= check(withRansac != Sphere<double>::Null && (withRansac.center - withoutRansac.center).norm() < 1e-6, "without outliers RANSAC finds the least squares intersection");
+
+    // the stray gaze lines are rejected, the inliers give the exact center
+    for (const auto& outlier : createOutliers(20)) {
+        model.mSupportingPupils.emplace_back(outlier);
+    }
+    passed &= check((model.findSphereCenter(false).center - expectedCenter).norm() > 1e-2, "the outliers pull the least squares intersection away");
+    for (int run = 0; run < 10; ++run) {
+        const auto sphere = model.findSphereCenter(true);
+        passed &= check(sphere != Sphere<double>::Null && (sphere.center - expectedCenter).norm() < 1e-6, "RANSAC ignores the outliers");
+    }
+
+    // the circles of the pair are disambiguated with the eye center, the gaze points away from it
+    double maxNormalError = 0.0;
+    for (size_t i = 0; i < circles.size(); ++i) {
+        maxNormalError = std::max(maxNormalError, (model.mSupportingPupils[i].mCircle.normal - circles[i].normal).norm());
+    }
+    passed &= check(maxNormalError < 1e-6, "the unprojected circles point away from the eye center, error " + std::to_string(maxNormalError));
+
+    return passed;
+}
+
+bool EyeModelTest::testRefinementHandOff()
+{
+    bool passed = true;
+    const auto props = defaultProperties();
+    std::vector<ObservationPtr> observations;
+    for (const auto& circle : createPupilCircles()) {
+        observations.push_back(createObservation(circle, 1.0, 0.0));
+    }
+    const std::vector<ObservationPtr> firstHalf(observations.begin(), observations.begin() + 15);
+    const std::vector<ObservationPtr> secondHalf(observations.begin() + 15, observations.end());
+
+    {
+        EyeModel model(1, 0.0, focalLength, Vector3::Zero());
+        scheduleRefinement(model, firstHalf, props);
+        passed &= check(waitForRefinement(model), "the worker finishes the refinement");
+
+        // the result waits for presentObservation to take it over
+        passed &= check(model.getSphere() == Sphere<double>::Null, "the refinement isn't used before it is collected");
+        const auto refined = model.mRefinement.sphere;
+        passed &= check(refined != Sphere<double>::Null && (refined.center - eye.center).norm() < 0.1, "the refinement finds the eye");
+
+        // more work while the result is still there, the worker must not overwrite it
+        scheduleRefinement(model, secondHalf, props);
+        std::this_thread::sleep_for(std::chrono::milliseconds(200));
+        passed &= check(isWorkPending(model), "the worker waits until the refinement is collected");
+        passed &= check(model.mRefinementReady.load() && model.mRefinement.sphere.center == refined.center, "the uncollected refinement is kept");
+
+        // collecting it frees the worker for the pending work
+        model.collectRefinement();
+        passed &= check(model.getSphere().center == refined.center && model.getSphere().radius == refined.radius, "the collected refinement is the model");
+        passed &= check(waitForRefinement(model), "the worker takes the pending work after the collection");
+        passed &= check(!isWorkPending(model) && model.mSupportingPupils.size() == observations.size(), "the second refinement uses all observations");
+
+        // one more, the model is destroyed with an uncollected refinement and pending work
+        scheduleRefinement(model, { observations.front() }, props);
+    }
+
+    {
+        // the model goes away while the worker refines
+        EyeModel model(2, 0.0, focalLength, Vector3::Zero());
+        scheduleRefinement(model, observations, props);
+    }
+
+    {
+        // the usual way, confident observations only through presentObservation
+        EyeModel model(3, 0.0, focalLength, Vector3::Zero());
+        for (const auto& observation : observations) {
+            model.presentObservation(observation, 30, props);
+        }
+        passed &= check(waitForRefinement(model), "presentObservation schedules a refinement");
+        model.presentObservation(createObservation(circleOnSphere(eye, pupilTheta, pupilPsi, 2.0), 0.0, 1.0), 30, props);
+        const auto sphere = model.getSphere();
+        passed &= check(sphere != Sphere<double>::Null && (sphere.center - eye.center).norm() < 0.1, "presentObservation takes over the refined eye");
+    }
+
+    return passed;
+}
+
+bool EyeModelTest::testWarmStart()
+{
+    bool passed = true;
+    auto props = defaultProperties();
+    std::vector<ObservationPtr> observations;
+    for (const auto& circle : createPupilCircles()) {
+        observations.push_back(createObservation(circle, 1.0, 0.0));
+    }
+    const std::vector<ObservationPtr> firstHalf(observations.begin(), observations.begin() + 15);
+    const std::vector<ObservationPtr> secondHalf(observations.begin() + 15, observations.end());
+    auto residualBlocksOfPupils = [](const EyeModel& model) {
+        bool allAdded = std::all_of(model.mSupportingPupils.begin(), model.mSupportingPupils.end(), [](const EyeModel::Pupil& p){ return bool(p.mParamBlock); });
+        return allAdded && model.mProblem->NumResidualBlocks() == int(model.mSupportingPupils.size());
+    };
+
+    {
+        EyeModel model(1, 0.0, focalLength, Vector3::Zero());
+        scheduleRefinement(model, firstHalf, props);
+        passed &= check(waitForRefinement(model), "the worker finishes the first refinement");
+        model.collectRefinement();
+        const auto first = model.getSphere();
+        passed &= check(model.mHasSolution && residualBlocksOfPupils(model), "every pupil is part of the problem");
+
+        // the second refinement continues from the first solution and only adds the new pupils
+        scheduleRefinement(model, secondHalf, props);
+        passed &= check(waitForRefinement(model), "the worker finishes the second refinement");
+        model.collectRefinement();
+        passed &= check(model.getInitialSphere().center == first.center && model.getInitialSphere().radius == first.radius, "the second refinement starts from the first solution");
+        passed &= check(model.mSupportingPupils.size() == observations.size() && residualBlocksOfPupils(model), "the new pupils are added to the problem");
+        passed &= check((model.getSphere().center - eye.center).norm() < 0.1, "the warm started refinement finds the eye");
+    }
+
+    {
+        // evicted pupils leave the problem
+        props.model_max_pupils = 20;
+        EyeModel model(2, 0.0, focalLength, Vector3::Zero());
+        scheduleRefinement(model, firstHalf, props);
+        passed &= check(waitForRefinement(model), "the worker finishes the first refinement");
+        model.collectRefinement();
+        scheduleRefinement(model, secondHalf, props);
+        passed &= check(waitForRefinement(model), "the worker finishes the second refinement");
+        model.collectRefinement();
+        passed &= check(model.mSupportingPupils.size() == 20 && residualBlocksOfPupils(model), "the problem keeps only the stored pupils");
+    }
+
+    return passed;
+}
+
+
+int main()
+{
+    std::cout << "Start Test" << std::endl;
+    bool passed = true;
+    passed &= EyeModelTest::testFindSphereCenter();
+    passed &= EyeModelTest::testRefinementHandOff();
+    passed &= EyeModelTest::testWarmStart();
+    std::cout << (passed ? "eye model tests passed" : "eye model tests FAILED") << std::endl;
+    return passed ? 0 : 1;
+}
@@ -0,0 +1,73 @@
+'''
+(*)~---------------------------------------------------------------------------
+Pupil - eye tracking platform
+Copyright (C) 2012-2018 Pupil Labs
+
+Distributed under the terms of the GNU
+Lesser General Public License (LGPL v3.0).
+See COPYING and COPYING.LESSER for license details.
+---------------------------------------------------------------------------~(*)
+'''
+
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), *[os.pardir] * 4)))
+from pupil.detectors.roi_tracking import Roi_Tracker
+
+bounds = (0, 0, 640, 480)
+
+
+def track(tracker, frames, confidence=1., start=(200., 200.), step=(3., -1.), diameter=40.):
+    # pupil moving with constant velocity at 30 fps
+    for i in range(frames):
+        center = start[0] + i * step[0], start[1] + i * step[1]
+        tracker.update(i / 30., center, diameter, confidence)
+
+
+def test_predict():
+    tracker = Roi_Tracker()
+    assert tracker.predict(0., bounds) is None
+    track(tracker, 1)
+    assert tracker.predict(1 / 30., bounds) is None  # needs two detections
+
+    track(tracker, 8)  # only the last 5 are kept
+    roi = tracker.predict(8 / 30., bounds)
+    # predicted center (224, 192), half size 1.5 * 40 / 2 widened by the motion of one frame
+    expected = (224 - 33, 192 - 31, 224 + 33, 192 + 31)
+    assert all(abs(a - b) <= 1 for a, b in zip(roi, expected))
+
+
+def test_predict_clipped():
+    tracker = Roi_Tracker()
+    track(tracker, 5, start=(10., 240.), step=(-1., 0.))
+    x1, y1, x2, y2 = tracker.predict(5 / 30., bounds)
+    assert x1 == 0 and x2 > 32 and 0 < y1 < y2 < 480
+
+    # the pupil leaves the user roi
+    assert tracker.predict(5 / 30., (100, 0, 640, 480)) is None
+
+
+def test_update_and_reset():
+    tracker = Roi_Tracker()
+    track(tracker, 5)
+    assert tracker.predict(5 / 30., bounds) is not None
+    tracker.update(5 / 30., (215., 195.), 40., .5)  # unconfident detections end the track
+    assert tracker.predict(6 / 30., bounds) is None
+
+    track(tracker, 5)
+    tracker.reset()
+    assert tracker.predict(5 / 30., bounds) is None
+
+    track(tracker, 5)
+    tracker.set_params(history=3, min_confidence=.4)
+    assert len(tracker.history) == 3
+    tracker.update(5 / 30., (215., 195.), 40., .5)
+    assert len(tracker.history) == 3 and tracker.predict(6 / 30., bounds) is not None
+
+
+if __name__ == '__main__':
+    test_predict()
+    test_predict_clipped()
+    test_update_and_reset()
+    print('roi tracking tests passed')
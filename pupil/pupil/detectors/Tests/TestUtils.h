@@ -10,6 +10,7 @@ See COPYING and COPYING.LESSER for license details.
 */
 
 #include "../singleeyefitter/utils.h" // random
+#include "../singleeyefitter/projection.h"
 #include "common/types.h"
 
 
@@ -51,3 +52,19 @@ std::vector<singleeyefitter::Vector3> createCirclePointsOnSphere( singleeyefitte
     return points;
 
 }
+
+// points along the contour of the circle projected into the image
+// they are in the coordinate system of the eye models, the origin is the image center and y points up
+std::vector<singleeyefitter::Vector2> createProjectedCirclePoints( const singleeyefitter::Circle& circle, double focal_length, int amount ){
+
+    using namespace singleeyefitter;
+
+    const Ellipse ellipse(project(circle, focal_length));
+    std::vector<Vector2> points;
+    for (int i = 0; i < amount; ++i)
+    {
+        points.push_back(pointAlongEllipse(ellipse, 2.0 * M_PI * i / amount));
+    }
+    return points;
+
+}
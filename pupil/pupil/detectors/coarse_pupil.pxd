@@ -10,6 +10,7 @@ See COPYING and COPYING.LESSER for license details.
 '''
 
 cimport cython
+from libc.stdlib cimport malloc, free
 import math
 
 cdef struct point_t :
@@ -29,15 +30,27 @@ cdef struct eye_t:
     int w
     int h
 
+cdef enum:
+    MAX_COARSE_CANDIDATES = 30
+    MAX_COARSE_SIZES = 64
+
+cdef struct candidate_t:
+    int x
+    int y
+    int w
+    float response
+
+cdef struct coarse_result_t:
+    # bounding box of the good candidates in integral image coordinates
+    int x1
+    int y1
+    int x2
+    int y2
+    int n_good
+    int n_all
+    candidate_t good[MAX_COARSE_CANDIDATES]
+    candidate_t all[MAX_COARSE_CANDIDATES]
 
-@cython.wraparound(False)
-@cython.boundscheck(False)
-cdef inline int area(int[:,::1] img,point_t size,point_t start,point_t end,point_t offset):
-  with cython.boundscheck(False):  # cython bug! ignores @cython.wraparound(False)
-      return    img[offset.r + end.r ,offset.c + end.c]\
-            + img[offset.r + start.r, offset.c + start.c]\
-            - img[offset.r + start.r, offset.c + end.c]\
-            - img[offset.r + end.r,offset.c + start.c]
 
 @cython.cdivision(True)
 cdef inline eye_t make_eye(int h) nogil:
@@ -60,85 +73,124 @@ cdef inline eye_t make_eye(int h) nogil:
     eye.w_half = w/2
     return eye
 
+
+cdef inline int default_coarse_scale(int roi_width) nogil:
+    # keeps the downsampled roi about 128 pixels wide
+    return max(1, roi_width / 128)
+
 @cython.boundscheck(False)
 @cython.wraparound(False)
-cdef inline center_surround(int[:,::1] img, int min_w,int max_w):
-    cdef point_t img_size
-    img_size.r =  img.shape[0]
-    img_size.c =  img.shape[1]
-    cdef int min_h = min_w/3
-    cdef int max_h = max_w/3
-    cdef int h=0, i=0, j=0
-    cdef float best_response = -10000
-    cdef point_t best_pos
-    cdef int best_h = 0
-    cdef int h_step = 4
-    cdef int step = 5
-    cdef eye_t eye
-    cdef point_t offset
-    cdef int x_pos,y_pos,width
-    cdef float response = 0
-    cdef float a,c,
-    cdef point_t b,d,e,f
-
-    cdef list results = []
-
-    #for h in prange(min_h,max_h,h_step):
-    for h from min_h <= h < max_h by h_step:
-      eye = make_eye(h)
-      #for i in range(0,img_size.r-eye.w,step): #step is slow
-      for i from 0 <= i < img_size.r-eye.w by step:
-        #for j in range(0,img_size.c-eye.w,step): #step is slow
-        for j from 0 <= j < img_size.c-eye.w by step:
-
-          offset.r = i
-          offset.c = j
-
-          response = eye.outer.f*area(img,img_size,eye.outer.s,eye.outer.e,offset) + eye.inner.f*area(img,img_size,eye.inner.s,eye.inner.e,offset)
-          if(response  > best_response):
-            best_response = response
-            best_pos.r = i
-            best_pos.c = j
-            best_h = h
-            results.append( (j ,i, h * 3 ,  response) )
-            if len(results) > 30:
-                results.pop(0)
+cdef inline void downsampled_integral(unsigned char[:,:] img, int scale, int[:,::1] integral) nogil:
+    # integral image of img[::scale, ::scale], `integral` has one extra row and column
+    cdef int rows = integral.shape[0] - 1
+    cdef int cols = integral.shape[1] - 1
+    cdef int r, c, row_sum
+    for c in range(cols + 1):
+        integral[0, c] = 0
+    for r in range(rows):
+        integral[r + 1, 0] = 0
+        row_sum = 0
+        for c in range(cols):
+            row_sum = row_sum + img[r * scale, c * scale]
+            integral[r + 1, c + 1] = integral[r, c + 1] + row_sum
 
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef inline void center_surround(int[:,::1] img, int min_w, int max_w, coarse_result_t* result) nogil:
+    cdef int rows = img.shape[0]
+    cdef int cols = img.shape[1]
+    cdef int h_step = 4
+    cdef eye_t eyes[MAX_COARSE_SIZES]
+    cdef int n_sizes = 0
+    cdef int h, i, j, k, p, w, a, b, n_positions
+    cdef float outer_f, inner_f, response, row_best
+    cdef float best_response = -10000
+    cdef int head = 0
+    # responses of all positions of one row, there are at most (cols + 4) / 5 of them
+    cdef float* responses = <float*> malloc(((cols + 4) / 5 + 1) * sizeof(float))
+
+    result.n_all = 0
+    result.n_good = 0
+    result.x1 = 0
+    result.y1 = 0
+    result.x2 = 1
+    result.y2 = 1
+    if responses == NULL:
+        return
+
+    h = min_w / 3
+    while h < max_w / 3 and n_sizes < MAX_COARSE_SIZES:
+        eyes[n_sizes] = make_eye(h)
+        n_sizes += 1
+        h += h_step
+
+    # same order as the python version, size by size, the candidates depend on it
+    for k in range(n_sizes):
+        w = eyes[k].w
+        a = eyes[k].h
+        b = a + a
+        outer_f = eyes[k].outer.f
+        inner_f = eyes[k].inner.f
+        n_positions = (cols - w + 4) / 5
+        for i in range(0, rows - w, 5):
+            # all positions of the row at once, without branches the compiler vectorises this loop
+            row_best = best_response
+            for p in range(n_positions):
+                j = 5 * p
+                response = outer_f * (img[i + w, j + w] + img[i, j] - img[i, j + w] - img[i + w, j]) \
+                         + inner_f * (img[i + b, j + b] + img[i + a, j + a] - img[i + a, j + b] - img[i + b, j + a])
+                responses[p] = response
+                row_best = response if response > row_best else row_best
+            if not row_best > best_response:
+                continue
+            # the row improves the best response, replay it in order
+            for p in range(n_positions):
+                response = responses[p]
+                if response > best_response:
+                    # keep the last improvements, like appending to a list and dropping its head
+                    best_response = response
+                    result.all[head].x = 5 * p
+                    result.all[head].y = i
+                    result.all[head].w = w
+                    result.all[head].response = response
+                    head = (head + 1) % MAX_COARSE_CANDIDATES
+                    if result.n_all < MAX_COARSE_CANDIDATES:
+                        result.n_all += 1
+    free(responses)
+
+    # oldest candidate first
+    cdef candidate_t ordered[MAX_COARSE_CANDIDATES]
+    cdef int first = (head - result.n_all + MAX_COARSE_CANDIDATES) % MAX_COARSE_CANDIDATES
+    for k in range(result.n_all):
+        ordered[k] = result.all[(first + k) % MAX_COARSE_CANDIDATES]
+    for k in range(result.n_all):
+        result.all[k] = ordered[k]
 
     #remove results which fully surround others, since we want the smalles ones
-    cdef list bad = []
-    cdef int x,y,w,x2,y2,w2
-    cdef float response2
-
-    bad = results[:]
-    for r in reversed(results):
-        x,y,w,response = r
-        # filter for response
-        if response < best_response*0.4 : #remove it anyway if it's bad
-            results.remove(r)
+    cdef bint keep
+    cdef candidate_t r, g
+    for k in range(result.n_all):
+        r = result.all[k]
+        if r.response < best_response*0.4 : #remove it anyway if it's bad
             continue
-
-        for g in bad:
-            x2,y2,w2,response2 = g
-            if x<x2 and y<y2 and x+w>x2+w2 and y+w>y2+w2: # g is fully included in r
-                results.remove(r)
+        keep = True
+        for i in range(result.n_all):
+            g = result.all[i]
+            if r.x<g.x and r.y<g.y and r.x+r.w>g.x+g.w and r.y+r.w>g.y+g.w: # g is fully included in r
+                keep = False
                 break
+        if keep:
+            result.good[result.n_good] = r
+            result.n_good += 1
 
     #calculate bounding box
-    cdef int x_b = 0
-    cdef int y_b = 0
-    cdef int x2_b = 1
-    cdef int y2_b = 1
-
-    if len(results) > 0 :
-        x_b , y_b  = results[0][:2]
-        for v  in results:
-            x,y,w,response = v
-            x_b  = min(x, x_b)
-            y_b  = min(y, y_b)
-            if x2_b < x + w:
-                x2_b = x+w
-            if y2_b < y + w:
-                y2_b = y+w
-
-    return  (x_b , y_b, x2_b, y2_b) , results , bad
+    if result.n_good > 0:
+        result.x1 = result.good[0].x
+        result.y1 = result.good[0].y
+        for k in range(result.n_good):
+            r = result.good[k]
+            result.x1 = min(r.x, result.x1)
+            result.y1 = min(r.y, result.y1)
+            result.x2 = max(r.x + r.w, result.x2)
+            result.y2 = max(r.y + r.w, result.y2)
@@ -39,6 +39,12 @@ class Detector2D {
 		Detector2D();
 		std::shared_ptr<Detector2DResult> detect(Detector2DProperties& props, cv::Mat& image, cv::Mat& color_image, cv::Mat& debug_image, cv::Rect& roi, bool visualize, bool use_debug_image, bool pause_video);
 		std::vector<cv::Point> ellipse_true_support(Detector2DProperties& props, Ellipse& ellipse, double ellipse_circumference, std::vector<cv::Point>& raw_edges);
+		// number of threads used to evaluate candidate ellipses, only has an effect if built with OpenMP
+		void setCandidateThreads(int threads) { mCandidateThreads = std::max(1, threads); };
+		// only find the raw edges and skip the ellipse search, the result has no ellipse
+		void setEdgesOnly(bool edgesOnly) { mEdgesOnly = edgesOnly; };
+		// whether the raw edges are moved into the result, only the 3D detector uses them
+		void setKeepRawEdges(bool keepRawEdges) { mKeepRawEdges = keepRawEdges; };
 
 
 	private:
@@ -46,6 +52,23 @@ class Detector2D {
 		bool mUse_strong_prior;
 		int mPupil_Size;
 		Ellipse mPrior_ellipse;
+		int mCandidateThreads;
+		bool mEdgesOnly;
+		bool mKeepRawEdges;
+
+		// working buffers, kept across frames. OpenCV only reallocates
+		// them if the roi size changes.
+		cv::Mat mHistogram;
+		cv::Mat mBinaryImg;
+		cv::Mat mSpecMask;
+		cv::Mat mPupilImage;
+		cv::Mat mEdges;
+		cv::Mat mSupportMask;
+		cv::Mat mSupportEdges;
+		const cv::Mat mDilateKernel;
+		const cv::Mat mOpenKernel;
+		Contours_2D mContours;
+		Contours_2D mApproxContours;
 
 
 
@@ -56,7 +79,9 @@ void printPoints(std::vector<cv::Point> points)
 	std::for_each(points.begin(), points.end(), [](cv::Point & p) { std::cout << p << std::endl;});
 }
 
-Detector2D::Detector2D(): mUse_strong_prior(false), mPupil_Size(100) {};
+Detector2D::Detector2D(): mUse_strong_prior(false), mPupil_Size(100), mCandidateThreads(1), mEdgesOnly(false), mKeepRawEdges(true),
+	mDilateKernel(cv::getStructuringElement(cv::MORPH_ELLIPSE, {7, 7})),
+	mOpenKernel(cv::getStructuringElement(cv::MORPH_ELLIPSE, {9, 9})) {};
 
 std::vector<cv::Point> Detector2D::ellipse_true_support(Detector2DProperties& props,Ellipse& ellipse, double ellipse_circumference, std::vector<cv::Point>& raw_edges)
 {
@@ -80,20 +105,22 @@ std::shared_ptr<Detector2DResult> Detector2D::detect(Detector2DProperties& props
 
 	const int image_width = image.size().width;
 	const int image_height = image.size().height;
-	const cv::Mat pupil_image = cv::Mat(image, roi).clone();  // image with roi, copy the image, since we alter it
-	const int w = pupil_image.size().width / 2;
+	// view into the caller's image, it is only read. The first morphology
+	// operation below writes its result into a separate pupil_image.
+	const cv::Mat roi_image = cv::Mat(image, roi);
+	const int w = roi_image.size().width / 2;
 	const float coarse_pupil_width = w / 2.0f;
 	const int padding = int(coarse_pupil_width / 4.0f);
 	const int offset = props.intensity_range;
 	const int spectral_offset = 5;
 
-	cv::Mat histogram;
+	cv::Mat& histogram = mHistogram;
 	int histSize;
 	histSize = 256; //from 0 to 255
 	/// Set the ranges
 	float range[] = { 0, 256 } ; //the upper boundary is exclusive
 	const float* histRange = { range };
-	cv::calcHist(&pupil_image, 1 , 0, cv::Mat(), histogram , 1 , &histSize, &histRange, true, false);
+	cv::calcHist(&roi_image, 1 , 0, cv::Mat(), histogram , 1 , &histSize, &histRange, true, false);
 
 	int lowest_spike_index = 255;
 	int highest_spike_index = 0;
@@ -117,21 +144,21 @@ std::shared_ptr<Detector2DResult> Detector2D::detect(Detector2DProperties& props
 	}
 
 	//create dark and spectral glint masks
-	cv::Mat binary_img,spec_mask,kernel;
-	cv::inRange(pupil_image, cv::Scalar(0) , cv::Scalar(lowest_spike_index + props.intensity_range), binary_img);    // binary threshold
-	kernel = cv::getStructuringElement(cv::MORPH_ELLIPSE, {7, 7});
-	cv::dilate(binary_img, binary_img, kernel, { -1, -1}, 2);
-	cv::inRange(pupil_image, cv::Scalar(0) , cv::Scalar(highest_spike_index - spectral_offset), spec_mask);    // binary threshold
-	cv::erode(spec_mask, spec_mask, kernel);
-
-	kernel = cv::getStructuringElement(cv::MORPH_ELLIPSE, {9, 9});
+	cv::Mat& binary_img = mBinaryImg;
+	cv::Mat& spec_mask = mSpecMask;
+	cv::inRange(roi_image, cv::Scalar(0) , cv::Scalar(lowest_spike_index + props.intensity_range), binary_img);    // binary threshold
+	cv::dilate(binary_img, binary_img, mDilateKernel, { -1, -1}, 2);
+	cv::inRange(roi_image, cv::Scalar(0) , cv::Scalar(highest_spike_index - spectral_offset), spec_mask);    // binary threshold
+	cv::erode(spec_mask, spec_mask, mDilateKernel);
+
 	//open operation to remove eye lashes
-	cv::morphologyEx(pupil_image, pupil_image, cv::MORPH_OPEN, kernel);
+	cv::Mat& pupil_image = mPupilImage;
+	cv::morphologyEx(roi_image, pupil_image, cv::MORPH_OPEN, mOpenKernel);
 
 	if (props.blur_size > 1)
 		cv::medianBlur(pupil_image, pupil_image, props.blur_size);
 
-	cv::Mat edges;
+	cv::Mat& edges = mEdges;
 	cv::Canny(pupil_image, edges, props.canny_treshold, props.canny_treshold * props.canny_ration, props.canny_aperture);
 
 	//remove edges in areas not dark enough and where the glint is (spectral refelction from IR leds)
@@ -184,6 +211,12 @@ std::shared_ptr<Detector2DResult> Detector2D::detect(Detector2DProperties& props
     // find zero crashes if it doesn't find one. replace with cv implementation if opencv version is 3.0 or above
 	singleeyefitter::cvx::findNonZero(edges, raw_edges);
 
+	if (mEdgesOnly) {
+		result->confidence = 0.0;
+		result->raw_edges = std::move(raw_edges);
+		return result;
+	}
+
 
 	///////////////////////////////
 	/// Strong Prior Part Begin ///
@@ -232,7 +265,7 @@ std::shared_ptr<Detector2DResult> Detector2D::detect(Detector2DProperties& props
 
 			//result->final_contours = std::move(best_contours); // no contours when strong prior
 			//result->contours = std::move(split_contours);
-			result->raw_edges = std::move(raw_edges); // do we need it when strong prior ?
+			if (mKeepRawEdges) result->raw_edges = std::move(raw_edges); // do we need it when strong prior ?
 			result->final_edges = std::move(support_pixels);  // need for optimisation
 	      	return result;
 	    }
@@ -243,23 +276,23 @@ std::shared_ptr<Detector2DResult> Detector2D::detect(Detector2DProperties& props
 	///////////////////////////////
 
 	//from edges to contours
-	Contours_2D contours ;
+	Contours_2D& contours = mContours;
 	cv::findContours(edges, contours, cv::RETR_LIST, cv::CHAIN_APPROX_NONE);
 
 	//first we want to filter out the bad stuff, to short ones
 	const auto contour_size_min_pred = [&props](const Contour_2D & contour) {
-		return contour.size() > props.contour_size_min;
+		return contour.size() <= props.contour_size_min;
 	};
-	contours = singleeyefitter::fun::filter(contour_size_min_pred , contours);
+	contours.erase(std::remove_if(contours.begin(), contours.end(), contour_size_min_pred), contours.end());
 
 	//now we learn things about each contour through looking at the curvature.
 	//For this we need to simplyfy the contour so that pt to pt angles become more meaningfull
-	Contours_2D approx_contours;
-	std::for_each(contours.begin(), contours.end(), [&](const Contour_2D & contour) {
-		std::vector<cv::Point> approx_c;
-		cv::approxPolyDP(contour, approx_c, 1.5, false);
-		approx_contours.push_back(std::move(approx_c));
-	});
+	// (the inner vectors of approx_contours keep their capacity between frames)
+	Contours_2D& approx_contours = mApproxContours;
+	approx_contours.resize(contours.size());
+	for (size_t i = 0; i < contours.size(); i++) {
+		cv::approxPolyDP(contours[i], approx_contours[i], 1.5, false);
+	}
 
 	// split contours looking at curvature and angle
 	double split_angle = 80;
@@ -316,7 +349,7 @@ std::shared_ptr<Detector2DResult> Detector2D::detect(Detector2DProperties& props
 		//result->ellipse = toEllipse<double>(refit_ellipse);
 		//result->final_contours = std::move(best_contours);
 		//result->contours = std::move(split_contours);
-		result->raw_edges = std::move(raw_edges);
+		if (mKeepRawEdges) result->raw_edges = std::move(raw_edges);
 		return result;
 	}
 
@@ -429,69 +462,89 @@ std::shared_ptr<Detector2DResult> Detector2D::detect(Detector2DProperties& props
     Contours_2D split_contours_resolved(split_contours.size()); // WILL CONTAIN RESOLVED SPLIT CONTOURS TO TEST QUALITY OF CANDIDATE ELLIPSES
 
     auto resolve_contour = [&](std::vector<cv::Point>& contour, cv::Mat & edges) -> std::vector<cv::Point> {
-		cv::Mat support_mask(edges.rows, edges.cols, edges.type(), {0, 0, 0});
+		cv::Mat& support_mask = mSupportMask;
+		support_mask.create(edges.rows, edges.cols, edges.type());
+		support_mask.setTo(0);
 		cv::polylines(support_mask, contour, false, {255, 255, 255}, 2);
-		cv::Mat new_edges;
+		cv::Mat& new_edges = mSupportEdges;
 		std::vector<cv::Point> new_contours;
 		cv::min(edges, support_mask, new_edges);
 		cv::findNonZero(new_edges, new_contours);
 		return new_contours;
 	};
 
-    double max_support_ratio = props.final_perimeter_ratio_range_min; //KEEPS TRACK OF MAXIMUM SUPPORT RATIO REACHED SO FAR
+	//RESOLVE ALL CONTOURS THAT ARE PART OF A SOLUTION, THIS USES THE SHARED SUPPORT MASK AND IS DONE UPFRONT
+	for (auto& s : solutions) {
+		for (int i : s) {
+		    if (split_contours_resolved[i].size()==0){
+                split_contours_resolved[i] = resolve_contour(split_contours[i], edges);
+            }
+		}
+	}
 
-	int index_best_Solution = -1;
-	int enum_index = 0;
+	//EVALUATE ALL CANDIDATES, THE CANDIDATES ARE INDEPENDENT OF EACH OTHER
+	struct CandidateEvaluation {
+		cv::RotatedRect cv_ellipse;
+		Ellipse ellipse;
+		double support_ratio;
+		bool is_ellipse;
+	};
+	std::vector<CandidateEvaluation> evaluations(solutions.size());
+	const int solution_count = solutions.size();
+	const int candidate_threads = std::max(1, std::min(mCandidateThreads, solution_count));
 
-	for (auto& s : solutions) {
+	#pragma omp parallel for num_threads(candidate_threads) schedule(dynamic) if(candidate_threads > 1)
+	for (int k = 0; k < solution_count; k++) {
 
 		std::vector<cv::Point> test_contour;
 
-		for (int i : s) {
+		//CONCATENATE CONTOURS TO ONE CONTOUR
+		for (int i : solutions[k]) {
+			const std::vector<cv::Point>& c = split_contours_resolved[i];
+     		test_contour.insert(test_contour.end(), c.begin(), c.end());
+		}
 
-            //RESOLVE CONTOUR IF IT IS PART OF A SOLUTION AND HAS NOT BEEN RESOLVED YET
-		    if (split_contours_resolved[i].size()==0){
-                std::vector<cv::Point> generated_edges = resolve_contour(split_contours[i], edges);
-                split_contours_resolved[i].reserve(std::distance(generated_edges.begin(), generated_edges.end()));
-                split_contours_resolved[i].insert(split_contours_resolved[i].end(), generated_edges.begin(), generated_edges.end());
-            }
+		CandidateEvaluation& evaluation = evaluations[k];
+		evaluation.cv_ellipse = cv::fitEllipse(test_contour);
+		evaluation.ellipse = toEllipse<double>(evaluation.cv_ellipse);
+		double ellipse_circumference = evaluation.ellipse.circumference();
+		std::vector<cv::Point>  support_pixels = ellipse_true_support(props, evaluation.ellipse, ellipse_circumference, test_contour);
+		evaluation.support_ratio = (support_pixels.size() / ellipse_circumference)*pow(support_pixels.size()/test_contour.size(), props.support_pixel_ratio_exponent);
+		evaluation.is_ellipse = is_Ellipse(evaluation.cv_ellipse);
+	}
 
-    		//CONCATENATE CONTOURS TO ONE CONTOUR
-			std::vector<cv::Point>& c = split_contours_resolved.at(i);
-     		test_contour.insert(test_contour.end(), c.begin(), c.end());
+	//SELECT THE BEST CANDIDATE IN SOLUTION ORDER, THIS KEEPS THE RESULT INDEPENDENT OF THE THREAD COUNT
+    double max_support_ratio = props.final_perimeter_ratio_range_min; //KEEPS TRACK OF MAXIMUM SUPPORT RATIO REACHED SO FAR
 
-		}
+	int index_best_Solution = -1;
 
-		auto cv_ellipse = cv::fitEllipse(test_contour);
+	for (int enum_index = 0; enum_index < solution_count; enum_index++) {
+
+		CandidateEvaluation& evaluation = evaluations[enum_index];
+		const double support_ratio = evaluation.support_ratio;
 
 		if (use_debug_image) {
-			cv::ellipse(debug_image, cv_ellipse , mRed_color);
+			cv::ellipse(debug_image, evaluation.cv_ellipse , mRed_color);
 		}
-
-		Ellipse ellipse = toEllipse<double>(cv_ellipse);
-		double ellipse_circumference = ellipse.circumference();
-		std::vector<cv::Point>  support_pixels = ellipse_true_support(props, ellipse, ellipse_circumference, test_contour);
-		double support_ratio = (support_pixels.size() / ellipse_circumference)*pow(support_pixels.size()/test_contour.size(), props.support_pixel_ratio_exponent);
 		//TODO: refine the selection of final candidate
 
-		if (support_ratio >= max_support_ratio && is_Ellipse(cv_ellipse)) {
+		if (support_ratio >= max_support_ratio && evaluation.is_ellipse) {
 
 			index_best_Solution = enum_index;
             max_support_ratio = support_ratio;
 
 			if (support_ratio >= props.strong_perimeter_ratio_range_min) {
+				Ellipse ellipse = evaluation.ellipse;
 				ellipse.center[0] += roi.x;
 				ellipse.center[1] += roi.y;
 				mPrior_ellipse = ellipse;
 				mUse_strong_prior = true;
 
 				if (use_debug_image) {
-					cv::ellipse(debug_image, cv_ellipse , mGreen_color);
+					cv::ellipse(debug_image, evaluation.cv_ellipse , mGreen_color);
 				}
 			}
 		}
-
-		enum_index++;
 	}
 
 	// select ellipse
@@ -503,7 +556,7 @@ std::shared_ptr<Detector2DResult> Detector2D::detect(Detector2DProperties& props
 		//result->ellipse = toEllipse<double>(refit_ellipse);
 		//result->final_contours = std::move(best_contours);
 		//result->contours = std::move(split_contours);
-		result->raw_edges = std::move(raw_edges);
+		if (mKeepRawEdges) result->raw_edges = std::move(raw_edges);
 		return result;
 	}
 
@@ -522,11 +575,13 @@ std::shared_ptr<Detector2DResult> Detector2D::detect(Detector2DProperties& props
 	//final fitting on resolved contour
 	auto final_fitting = [&](std::vector<std::vector<cv::Point>>& contours, cv::Mat & edges) -> std::vector<cv::Point> {
 		//use the real edge pixels to fit, not the aproximated contours
-		cv::Mat support_mask(edges.rows, edges.cols, edges.type(), {0, 0, 0});
+		cv::Mat& support_mask = mSupportMask;
+		support_mask.create(edges.rows, edges.cols, edges.type());
+		support_mask.setTo(0);
 		cv::polylines(support_mask, contours, false, {255, 255, 255}, 2);
 
 		//draw into the suport mask with thickness 2
-		cv::Mat new_edges;
+		cv::Mat& new_edges = mSupportEdges;
 		std::vector<cv::Point> new_contours;
 		cv::min(edges, support_mask, new_edges);
 
@@ -589,7 +644,7 @@ std::shared_ptr<Detector2DResult> Detector2D::detect(Detector2DProperties& props
 	// result->contours = std::move(split_contours);
 	result->final_edges = std::move(final_edges);// need for optimisation
 
-	result->raw_edges = std::move(raw_edges);
+	if (mKeepRawEdges) result->raw_edges = std::move(raw_edges);
 	return result;
 
 }
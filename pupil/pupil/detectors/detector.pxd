@@ -25,6 +25,7 @@ cdef extern from '<opencv2/core.hpp>' namespace 'cv':
   cdef cppclass Mat :
       Mat() except +
       Mat( int height, int width, int type, void* data  ) except+
+      Mat( int height, int width, int type, void* data, size_t step  ) except+
       Mat( int height, int width, int type ) except+
 
 cdef extern from '<opencv2/core.hpp>' namespace 'cv':
@@ -148,6 +149,14 @@ cdef extern from 'common/types.h':
 
     cdef struct Detector3DProperties:
         float model_sensitivity
+        float refinement_max_solver_time
+        int refinement_max_iterations
+        int model_max_pupils
+        int model_pupils_per_bin
+        int refinement_edges_per_pupil
+        int refinement_linear_solver
+        int model_max_alternatives
+        int model_alternative_updates_per_frame
 
 
 
@@ -159,6 +168,9 @@ cdef extern from 'detect_2d.hpp':
 
     Detector2D() except +
     shared_ptr[Detector2DResult] detect( Detector2DProperties& prop, Mat& image, Mat& color_image, Mat& debug_image, Rect_[int]& roi, bint visualize , bint use_debug_image )
+    void setCandidateThreads( int threads )
+    void setEdgesOnly( bint edgesOnly )
+    void setKeepRawEdges( bint keepRawEdges )
 
 
 cdef extern from "singleeyefitter/EyeModelFitter.h" namespace "singleeyefitter":
@@ -180,6 +192,8 @@ cdef extern from "singleeyefitter/EyeModelFitter.h" namespace "singleeyefitter":
         EyeModelFitter(double focalLength )
 
         Detector3DResult updateAndDetect( shared_ptr[Detector2DResult]& results, const Detector3DProperties& prop, bint fillDebugResult )
+        Detector3DResult predictAndDetect( shared_ptr[Detector2DResult]& results, const Detector3DProperties& prop, bint fillDebugResult )
+        bint hasModel()
 
         void reset()
         double getFocalLength()
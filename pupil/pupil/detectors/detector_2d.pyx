@@ -14,6 +14,7 @@ See COPYING and COPYING.LESSER for license details.
 import cv2
 import numpy as np
 from pupil.methods_python import Roi, normalize
+from pupil.detectors.roi_tracking import Roi_Tracker
 from pupil import methods, plugin
 from pupil.plugin import Plugin
 from pyglui import ui
@@ -24,9 +25,10 @@ from pyglui.cygl.utils import draw_gl_texture
 cimport detector
 from detector cimport *
 from detector_utils cimport *
-from coarse_pupil cimport center_surround
+from coarse_pupil cimport center_surround, downsampled_integral, default_coarse_scale, coarse_result_t
 
 from cython.operator cimport dereference as deref
+from libcpp.memory cimport shared_ptr
 import math
 import sys
 
@@ -51,9 +53,13 @@ cdef class Detector_2D:
 
    cdef int coarseDetectionPreviousWidth
    cdef object coarseDetectionPreviousPosition
+   cdef int[:,::1] coarseIntegral
+   cdef object roiTracker
    
    def __cinit__(self,g_pool = None, settings = None ):
        self.thisptr = new Detector2D()
+       # the raw edges are only used by the 3D search
+       self.thisptr.setKeepRawEdges(False)
    def __init__(self, g_pool = None, settings = None ):
        #debug window
        self._window = None
@@ -66,6 +72,7 @@ cdef class Detector_2D:
        self.detectProperties = settings or {}
        self.coarseDetectionPreviousWidth = -1
        self.coarseDetectionPreviousPosition =  (0,0)
+       self.roiTracker = Roi_Tracker()
        if not self.detectProperties:
            self.detectProperties["coarse_detection"] = True
            self.detectProperties["coarse_filter_min"] = 128
@@ -110,6 +117,7 @@ cdef class Detector_2D:
 
       """
       self.detectProperties = settings
+      self.roiTracker.reset()
 
    def on_resolution_change(self, old_size, new_size):
        self.detectProperties["pupil_size_max"] *= new_size[0] / old_size[0]
@@ -123,12 +131,29 @@ cdef class Detector_2D:
        print("Test method inside Detector_2D")
 
    def detect(self, frame_, user_roi, visualize, pause_video = False ):
+       cdef shared_ptr[Detector2DResult] cppResultPtr = self.detect_core(frame_, user_roi, visualize)
+       return convertTo2DPythonResult( deref(cppResultPtr), frame_ , user_roi )
+
+   def detect_into(self, frame_, user_roi, Pupil2DRecord[:] out, Py_ssize_t index, visualize = False ):
+       r"""Detect the pupil and write the result into row `index` of `out`
+
+       `out` is a structured array with the layout of
+       `pupil_records.pupil_2d_dtype`. Unlike `detect` no Python objects are
+       created for the result. The `id` field is not touched.
+       """
+       cdef shared_ptr[Detector2DResult] cppResultPtr = self.detect_core(frame_, user_roi, visualize)
+       convertTo2DRecord( deref(cppResultPtr), frame_.timestamp, frame_.width, frame_.height, &out[index] )
+
+   cdef shared_ptr[Detector2DResult] detect_core(self, frame_, user_roi, bint visualize):
 
        image_width = frame_.width
        image_height = frame_.height
 
-       cdef unsigned char[:,::1] img = frame_.gray
-       cdef Mat frame = Mat(image_height, image_width, CV_8UC1, <void *> &img[0,0] )
+       # the gray plane may be a strided view, only the pixels have to be contiguous
+       cdef unsigned char[:,:] img = frame_.gray
+       if img.strides[1] != 1:
+           img = np.ascontiguousarray(frame_.gray)
+       cdef Mat frame = Mat(image_height, image_width, CV_8UC1, <void *> &img[0,0], img.strides[0] )
 
        cdef unsigned char[:,:,:] img_color
        cdef Mat frameColor
@@ -147,8 +172,11 @@ cdef class Detector_2D:
            frameColor = Mat(image_height, image_width, CV_8UC3, <void *> &img_color[0,0,0] )
 
        if use_debugImage:
-           debugImage_array = np.zeros( (image_height, image_width, 3 ), dtype = np.uint8 ) #clear image every frame
-           self.debugImage = debugImage_array
+           # reuse the debug image, reallocate only if the frame size changed
+           if self.debugImage is None or self.debugImage.shape[0] != image_height or self.debugImage.shape[1] != image_width:
+               self.debugImage = np.zeros( (image_height, image_width, 3 ), dtype = np.uint8 )
+           else:
+               self.debugImage[:, :, :] = 0 #clear image every frame
            debugImage = Mat(image_height, image_width, CV_8UC3, <void *> &self.debugImage[0,0,0] )
 
        roi = Roi((0,0))
@@ -158,55 +186,86 @@ cdef class Detector_2D:
        roi_width  = roi.get()[2] - roi.get()[0]
        roi_height  = roi.get()[3] - roi.get()[1]
        cdef int[:,::1] integral
-
-       if self.detectProperties['coarse_detection'] and roi_width*roi_height > 320*240:
-           scale = 5 # half the integral image. boost up integral
-           # TODO maybe implement our own Integral so we don't have to half the image
-           user_roi_image = frame_.gray[user_roi.view]
-           integral = cv2.integral(user_roi_image[::scale,::scale])
-           coarse_filter_max = self.detectProperties['coarse_filter_max']
-           coarse_filter_min = self.detectProperties['coarse_filter_min']
-           bounding_box , good_ones , bad_ones = center_surround( integral, coarse_filter_min/scale , coarse_filter_max/scale )
+       cdef unsigned char[:,:] user_roi_image
+       cdef coarse_result_t coarse
+       cdef int scale, coarse_filter_min, coarse_filter_max
+
+       # optional, search only a window around the pupil predicted from the last frames
+       tracking = self.detectProperties.get('roi_tracking', False)
+       tracked_roi = None
+       if tracking:
+           self.roiTracker.set_params(
+               history=self.detectProperties.get('roi_tracking_history', 5),
+               min_confidence=self.detectProperties.get('roi_tracking_min_confidence', 0.8),
+               margin=self.detectProperties.get('roi_tracking_margin', 1.5))
+           tracked_roi = self.roiTracker.predict(frame_.timestamp, roi.get())
+
+       if tracked_roi is not None:
+           roi_x, roi_y, x2, y2 = tracked_roi
+           roi_width = x2 - roi_x
+           roi_height = y2 - roi_y
+           roi.set(tracked_roi)
+       elif self.detectProperties['coarse_detection'] and roi_width*roi_height > 320*240:
+           scale = self.detectProperties.get('coarse_scale') or default_coarse_scale(roi_width)
+           # integral image of the downsampled roi, built without copying the roi
+           user_roi_image = img[roi_y:roi_y+roi_height, roi_x:roi_x+roi_width]
+           integral_rows = (roi_height + scale - 1) // scale + 1
+           integral_cols = (roi_width + scale - 1) // scale + 1
+           if self.coarseIntegral is None or self.coarseIntegral.shape[0] != integral_rows or self.coarseIntegral.shape[1] != integral_cols:
+               self.coarseIntegral = np.empty((integral_rows, integral_cols), dtype=np.int32)
+           integral = self.coarseIntegral
+           coarse_filter_max = int(self.detectProperties['coarse_filter_max']) // scale
+           coarse_filter_min = int(self.detectProperties['coarse_filter_min']) // scale
+           with nogil:
+               downsampled_integral(user_roi_image, scale, integral)
+               center_surround(integral, coarse_filter_min, coarse_filter_max, &coarse)
 
            if visualize:
                # !! uncomment this to visualize coarse detection
-                # draw the candidates
-               # for v  in bad_ones:
-               #     p_x,p_y,w,response = v
-               #     x = p_x * scale + roi_x
-               #     y = p_y * scale + roi_y
-               #     width = w*scale
+               # draw the candidates
+               # for k in range(coarse.n_all):
+               #     x = coarse.all[k].x * scale + roi_x
+               #     y = coarse.all[k].y * scale + roi_y
+               #     width = coarse.all[k].w * scale
                #     cv2.rectangle( frame_.img , (x,y) , (x+width , y+width) , (0,0,255)  )
 
                # # draw the candidates
-               for v  in good_ones:
-                   p_x,p_y,w,response = v
-                   x = p_x * scale + roi_x
-                   y = p_y * scale + roi_y
-                   width = w*scale
+               for k in range(coarse.n_good):
+                   x = coarse.good[k].x * scale + roi_x
+                   y = coarse.good[k].y * scale + roi_y
+                   width = coarse.good[k].w * scale
                    cv2.rectangle( frame_.img , (x,y) , (x+width , y+width) , (255,255,0)  )
-                   #responseText = '{:2f}'.format(response)
+                   #responseText = '{:2f}'.format(coarse.good[k].response)
                    #cv2.putText(frame_.img, responseText,(int(x+width*0.5) , int(y+width*0.5)), cv2.FONT_HERSHEY_PLAIN,0.7,(0,0,255) , 1 )
 
                    #center = (int(x+width*0.5) , int(y+width*0.5))
                    #cv2.circle( frame_.img , center , 5 , (255,0,255) , -1  )
 
-           x1 , y1 , x2, y2 = bounding_box
-           width = x2 - x1
-           height = y2 - y1
-           roi_x = x1 * scale + roi_x
-           roi_y = y1 * scale + roi_y
+           width = coarse.x2 - coarse.x1
+           height = coarse.y2 - coarse.y1
+           roi_x = coarse.x1 * scale + roi_x
+           roi_y = coarse.y1 * scale + roi_y
            roi_width = width*scale
            roi_height = height*scale
            roi.set((roi_x, roi_y, roi_x+roi_width, roi_y+roi_height))
 
 
-       # every coordinates in the result are relative to the current ROI
-       cppResultPtr =  self.thisptr.detect(self.detectProperties, frame, frameColor, debugImage, Rect_[int](roi_x,roi_y,roi_width,roi_height),  visualize , use_debugImage )
-
-       py_result = convertTo2DPythonResult( deref(cppResultPtr), frame_ , roi )
+       # optional, evaluate candidate ellipses in parallel
+       self.thisptr.setCandidateThreads(self.detectProperties.get('candidate_threads', 1))
 
-       return py_result
+       # every coordinates in the result are relative to the current ROI
+       cdef shared_ptr[Detector2DResult] cppResultPtr = self.thisptr.detect(self.detectProperties, frame, frameColor, debugImage, Rect_[int](roi_x,roi_y,roi_width,roi_height),  visualize , use_debugImage )
+
+       if tracking:
+           confidence = deref(cppResultPtr).confidence
+           if tracked_roi is not None and confidence < self.roiTracker.min_confidence:
+               # lost the pupil, search the full roi of this frame again
+               self.roiTracker.reset()
+               return self.detect_core(frame_, user_roi, visualize)
+           ellipse_center = (deref(cppResultPtr).ellipse.center[0], deref(cppResultPtr).ellipse.center[1])
+           self.roiTracker.update(frame_.timestamp, ellipse_center, deref(cppResultPtr).ellipse.major_radius * 2.0, confidence)
+
+       return cppResultPtr
 
    @property
    def pretty_class_name(self):
@@ -13,7 +13,7 @@ See COPYING and COPYING.LESSER for license details.
 # cython: profile=False
 import cv2
 import numpy as np
-from coarse_pupil cimport center_surround
+from coarse_pupil cimport center_surround, downsampled_integral, default_coarse_scale, coarse_result_t
 from pupil.methods_python import Roi, normalize
 from pupil.plugin import Plugin
 from pyglui import ui
@@ -34,6 +34,27 @@ from cython.operator cimport dereference as deref
 def test_compile():
     print("hello from detector_3d")
 
+# optional 3D settings, filled in when missing from the settings given by the user
+default_3d_properties = {
+    'refinement_max_solver_time': 0, # seconds a single eye model refinement may take, 0 runs until convergence
+    'refinement_max_iterations': 400,
+    'model_max_pupils': 300,
+    'model_pupils_per_bin': 1,
+    'refinement_edges_per_pupil': 0, # 0 refines with all edges, n subsamples n edges of every pupil
+    'refinement_linear_solver': 0, # 0: dense schur, 1: sparse schur, 2: iterative schur
+    'model_max_alternatives': 3,
+    'model_alternative_updates_per_frame': 1, # 0 updates all alternative models every frame
+    # decimated detection, the full detection runs every n-th frame only, the frames in between
+    # track the kalman prediction of the pupil with the raw edges
+    'detection_stride': 1,
+    'predicted_min_confidence': 0.5, # below this a predicted frame forces a full detection on the next frame
+}
+
+def with_3d_defaults(properties):
+    for key, value in default_3d_properties.items():
+        properties.setdefault(key, value)
+    return properties
+
 cdef class Detector_3D:
 
     cdef Detector2D* detector2DPtr
@@ -42,6 +63,8 @@ cdef class Detector_3D:
     cdef dict detectProperties2D, detectProperties3D
     cdef object debugVisualizer3D
     cdef object pyResult3D
+    cdef int[:,::1] coarseIntegral
+    cdef int framesSinceDetection
     cdef readonly object g_pool
     cdef readonly basestring uniqueness
     cdef public object menu
@@ -99,6 +122,7 @@ cdef class Detector_3D:
 
         if not self.detectProperties3D:
             self.detectProperties3D["model_sensitivity"] = 0.997
+        with_3d_defaults(self.detectProperties3D)
 
     def get_settings(self):
         return {'2D_Settings': self.detectProperties2D , '3D_Settings' : self.detectProperties3D }
@@ -121,7 +145,7 @@ cdef class Detector_3D:
 
         """
         self.detectProperties2D = settings['2D_Settings']
-        self.detectProperties3D = settings['3D_Settings']
+        self.detectProperties3D = with_3d_defaults(settings['3D_Settings'])
 
     def on_resolution_change(self, old_size, new_size):
         self.detectProperties2D["pupil_size_max"] *= new_size[0] / old_size[0]
@@ -137,8 +161,11 @@ cdef class Detector_3D:
         image_height = frame.height
 
 
-        cdef unsigned char[:,::1] img = frame.gray
-        cdef Mat cv_image = Mat(image_height, image_width, CV_8UC1, <void *> &img[0,0] )
+        # the gray plane may be a strided view, only the pixels have to be contiguous
+        cdef unsigned char[:,:] img = frame.gray
+        if img.strides[1] != 1:
+            img = np.ascontiguousarray(frame.gray)
+        cdef Mat cv_image = Mat(image_height, image_width, CV_8UC1, <void *> &img[0,0], img.strides[0] )
 
         cdef unsigned char[:,:,:] img_color
         cdef Mat cv_image_color
@@ -156,49 +183,61 @@ cdef class Detector_3D:
         roi_width  = roi.get()[2] - roi.get()[0]
         roi_height  = roi.get()[3] - roi.get()[1]
         cdef int[:,::1] integral
+        cdef unsigned char[:,:] user_roi_image
+        cdef coarse_result_t coarse
+        cdef int scale, coarse_filter_min, coarse_filter_max
 
         if self.detectProperties2D['coarse_detection'] and roi_width*roi_height > 320*240:
-            scale = 2 # half the integral image. boost up integral
-            # TODO maybe implement our own Integral so we don't have to half the image
-            user_roi_image = frame.gray[user_roi.view]
-            integral = cv2.integral(user_roi_image[::scale,::scale])
-            coarse_filter_max = self.detectProperties2D['coarse_filter_max']
-            coarse_filter_min = self.detectProperties2D['coarse_filter_min']
-            bounding_box , good_ones , bad_ones = center_surround( integral, coarse_filter_min/scale , coarse_filter_max/scale )
+            scale = self.detectProperties2D.get('coarse_scale') or default_coarse_scale(roi_width)
+            # integral image of the downsampled roi, built without copying the roi
+            user_roi_image = img[roi_y:roi_y+roi_height, roi_x:roi_x+roi_width]
+            integral_rows = (roi_height + scale - 1) // scale + 1
+            integral_cols = (roi_width + scale - 1) // scale + 1
+            if self.coarseIntegral is None or self.coarseIntegral.shape[0] != integral_rows or self.coarseIntegral.shape[1] != integral_cols:
+                self.coarseIntegral = np.empty((integral_rows, integral_cols), dtype=np.int32)
+            integral = self.coarseIntegral
+            coarse_filter_max = int(self.detectProperties2D['coarse_filter_max']) // scale
+            coarse_filter_min = int(self.detectProperties2D['coarse_filter_min']) // scale
+            with nogil:
+                downsampled_integral(user_roi_image, scale, integral)
+                center_surround(integral, coarse_filter_min, coarse_filter_max, &coarse)
 
             if visualize:
                 # !! uncomment this to visualize coarse detection
-                #  # draw the candidates
-                # for v  in bad_ones:
-                #     p_x,p_y,w,response = v
-                #     x = p_x * scale + roi_x
-                #     y = p_y * scale + roi_y
-                #     width = w*scale
+                # draw the candidates
+                # for k in range(coarse.n_all):
+                #     x = coarse.all[k].x * scale + roi_x
+                #     y = coarse.all[k].y * scale + roi_y
+                #     width = coarse.all[k].w * scale
                 #     cv2.rectangle( frame.img , (x,y) , (x+width , y+width) , (0,0,255)  )
 
                 # # draw the candidates
-                for v  in good_ones:
-                    p_x,p_y,w,response = v
-                    x = p_x * scale + roi_x
-                    y = p_y * scale + roi_y
-                    width = w*scale
+                for k in range(coarse.n_good):
+                    x = coarse.good[k].x * scale + roi_x
+                    y = coarse.good[k].y * scale + roi_y
+                    width = coarse.good[k].w * scale
                     cv2.rectangle( frame.img , (x,y) , (x+width , y+width) , (255,255,0)  )
-                    #responseText = '{:2f}'.format(response)
+                    #responseText = '{:2f}'.format(coarse.good[k].response)
                     #cv2.putText(frame.img, responseText,(int(x+width*0.5) , int(y+width*0.5)), cv2.FONT_HERSHEY_PLAIN,0.7,(0,0,255) , 1 )
 
                     #center = (int(x+width*0.5) , int(y+width*0.5))
                     #cv2.circle( frame.img , center , 5 , (255,0,255) , -1  )
 
-
-            x1 , y1 , x2, y2 = bounding_box
-            width = x2 - x1
-            height = y2 - y1
-            roi_x = x1 * scale + roi_x
-            roi_y = y1 * scale + roi_y
+            width = coarse.x2 - coarse.x1
+            height = coarse.y2 - coarse.y1
+            roi_x = coarse.x1 * scale + roi_x
+            roi_y = coarse.y1 * scale + roi_y
             roi_width = width*scale
             roi_height = height*scale
             roi.set((roi_x, roi_y, roi_x+roi_width, roi_y+roi_height))
 
+        # optional, evaluate candidate ellipses in parallel
+        self.detector2DPtr.setCandidateThreads(self.detectProperties2D.get('candidate_threads', 1))
+
+        # decimated detection, in between full detections only the edges are needed
+        predict = self.framesSinceDetection + 1 < self.detectProperties3D['detection_stride'] and self.detector3DPtr.hasModel()
+        self.detector2DPtr.setEdgesOnly(predict)
+
         # every coordinates in the result are relative to the current ROI
         cpp2DResultPtr =  self.detector2DPtr.detect(self.detectProperties2D, cv_image, cv_image_color, debug_image, Rect_[int](roi_x,roi_y,roi_width,roi_height), visualize , False ) #we don't use debug image in 3d model
 
@@ -206,9 +245,20 @@ cdef class Detector_3D:
 
         ######### 3D Model Part ############
         debugDetector =  self.debugVisualizer3D.window
-        cdef Detector3DResult cpp3DResult  = self.detector3DPtr.updateAndDetect( cpp2DResultPtr , self.detectProperties3D, debugDetector)
+        cdef Detector3DResult cpp3DResult
+        if predict:
+            cpp3DResult = self.detector3DPtr.predictAndDetect( cpp2DResultPtr , self.detectProperties3D, debugDetector)
+            self.framesSinceDetection += 1
+        else:
+            cpp3DResult = self.detector3DPtr.updateAndDetect( cpp2DResultPtr , self.detectProperties3D, debugDetector)
+            self.framesSinceDetection = 0
 
         pyResult = convertTo3DPythonResult(cpp3DResult , frame )
+        if predict:
+            pyResult['method'] = '3d c++ predicted'
+            if pyResult['confidence'] < self.detectProperties3D['predicted_min_confidence']:
+                # lost the pupil, detect it again on the next frame
+                self.framesSinceDetection = self.detectProperties3D['detection_stride']
 
         if debugDetector:
             self.pyResult3D = prepareForVisualization3D(cpp3DResult)
@@ -40,6 +40,30 @@ cdef inline convertTo2DPythonResult( Detector2DResult& result, object frame, obj
 
     return py_result
 
+# one row of pupil_records.pupil_2d_dtype
+cdef packed struct Pupil2DRecord:
+    double timestamp
+    int id
+    float confidence
+    float norm_pos[2]
+    float diameter
+    float ellipse_center[2]
+    float ellipse_axes[2]
+    float ellipse_angle
+
+cdef inline void convertTo2DRecord( Detector2DResult& result, double timestamp, int width, int height, Pupil2DRecord* record ):
+    # same values as convertTo2DPythonResult, the id is left to the caller
+    record.timestamp = timestamp
+    record.confidence = result.confidence
+    record.ellipse_center[0] = result.ellipse.center[0]
+    record.ellipse_center[1] = result.ellipse.center[1]
+    record.ellipse_axes[0] = result.ellipse.minor_radius * 2.0
+    record.ellipse_axes[1] = result.ellipse.major_radius * 2.0
+    record.ellipse_angle = result.ellipse.angle * 180.0 / PI - 90.0
+    record.diameter = max(record.ellipse_axes[0], record.ellipse_axes[1])
+    record.norm_pos[0] = record.ellipse_center[0] / width
+    record.norm_pos[1] = 1.0 - record.ellipse_center[1] / height
+
 cdef inline convertTo3DPythonResult( Detector3DResult& result, object frame    ):
 
     #use negative z-coordinates to get from left-handed to right-handed coordinate system
@@ -0,0 +1,74 @@
+'''
+(*)~---------------------------------------------------------------------------
+Pupil - eye tracking platform
+Copyright (C) 2012-2018 Pupil Labs
+
+Distributed under the terms of the GNU
+Lesser General Public License (LGPL v3.0).
+See COPYING and COPYING.LESSER for license details.
+---------------------------------------------------------------------------~(*)
+'''
+
+from collections import deque
+
+import numpy as np
+
+
+class Roi_Tracker(object):
+    """Predicts a tight region of interest around the next pupil position
+
+    The prediction extrapolates the pupil center of the last confident
+    detections with their mean velocity. The window size follows the last
+    pupil diameter. Without a stable track (too few or unconfident
+    detections) no prediction is made and the full user ROI has to be
+    searched.
+    """
+
+    def __init__(self, history=5, min_confidence=0.8, margin=1.5, min_size=32):
+        self.min_confidence = min_confidence
+        self.margin = margin
+        self.min_size = min_size
+        self.history = deque(maxlen=history)  # (timestamp, center_x, center_y, diameter)
+
+    def set_params(self, history=5, min_confidence=0.8, margin=1.5):
+        if history != self.history.maxlen:
+            self.history = deque(self.history, maxlen=history)
+        self.min_confidence = min_confidence
+        self.margin = margin
+
+    def reset(self):
+        self.history.clear()
+
+    def update(self, timestamp, center, diameter, confidence):
+        """Adds a detection in image coordinates, unconfident detections end the track"""
+        if confidence >= self.min_confidence:
+            self.history.append((timestamp, center[0], center[1], diameter))
+        else:
+            self.reset()
+
+    def predict(self, timestamp, bounds):
+        """Returns the predicted roi (x1, y1, x2, y2) clipped to `bounds` or None
+
+        :param bounds: the user roi (x1, y1, x2, y2) the prediction has to lie in
+        """
+        if len(self.history) < min(2, self.history.maxlen):
+            return None
+
+        track = np.array(self.history, dtype=np.float64)
+        last_ts, center, diameter = track[-1, 0], track[-1, 1:3], track[-1, 3]
+        dt = timestamp - last_ts
+        duration = last_ts - track[0, 0]
+        velocity = (center - track[0, 1:3]) / duration if duration > 0 else np.zeros(2)
+        center = center + velocity * dt
+
+        # window around the predicted center, widened by the expected motion
+        half_size = max(self.min_size, self.margin * diameter) / 2. + np.abs(velocity * dt)
+        x1, y1 = np.floor(center - half_size).astype(int)
+        x2, y2 = np.ceil(center + half_size).astype(int)
+
+        x1, y1 = max(x1, bounds[0]), max(y1, bounds[1])
+        x2, y2 = min(x2, bounds[2]), min(y2, bounds[3])
+        if x2 - x1 < self.min_size or y2 - y1 < self.min_size:
+            # prediction left the user roi
+            return None
+        return x1, y1, x2, y2
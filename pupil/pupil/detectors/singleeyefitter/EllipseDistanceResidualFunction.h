@@ -14,7 +14,7 @@ namespace singleeyefitter{
 template<typename Scalar>
 class EllipseDistanceResidualFunction {
     public:
-        EllipseDistanceResidualFunction(/*const cv::Mat& eye_image,*/ const std::vector<cv::Point>& edges, const Scalar& eye_radius, const Scalar& focal_length) :
+        EllipseDistanceResidualFunction(/*const cv::Mat& eye_image,*/ const EdgesCompact2D& edges, const Scalar& eye_radius, const Scalar& focal_length) :
             /*eye_image(eye_image), */edges(edges), eye_radius(eye_radius), focal_length(focal_length) {}
 
         template <typename T>
@@ -26,18 +26,17 @@ class EllipseDistanceResidualFunction {
             Ellipse2D<T> pupil_ellipse(project(circleOnSphere(eye, pupil_param[0], pupil_param[1], pupil_param[2]), T(focal_length)));
             EllipseDistCalculator<T> ellipDist(pupil_ellipse);
 
-            for (int i = 0; i < edges.size(); ++i) {
-                const cv::Point& inlier = edges[i];
-                e[i] = ellipDist(Const(inlier.x), Const(inlier.y));
+            for (int i = 0; i < edges.rows(); ++i) {
+                e[i] = ellipDist(Const(edges(i, 0)), Const(edges(i, 1)));
             }
 
             return true;
         }
     private:
         //const cv::Mat& eye_image;
-        const std::vector<cv::Point>& edges;
-        const Scalar& eye_radius;
-        const Scalar& focal_length;
+        const EdgesCompact2D& edges; // owned by the observation
+        const Scalar eye_radius; // copied, the eye models keep this block alive and never change their radius
+        const Scalar focal_length;
 };
 } // namespace singleeyefitter
 
@@ -0,0 +1,1002 @@
+#include "EyeModel.h"
+
+#include <algorithm>
+#include <cassert>
+#include <future>
+
+#include <ceres/ceres.h>
+#include <ceres/problem.h>
+#include <ceres/autodiff_cost_function.h>
+#include <ceres/solver.h>
+#include <ceres/jet.h>
+
+#include "EllipseDistanceApproxCalculator.h"
+#include "EllipseDistanceResidualFunction.h"
+
+#include "CircleDeviationVariance3D.h"
+#include "CircleEvaluation3D.h"
+#include "CircleGoodness3D.h"
+
+#include "utils.h"
+#include "math/intersect.h"
+#include "projection.h"
+#include "fun.h"
+
+#include "mathHelper.h"
+#include "math/distance.h"
+
+
+
+
+namespace singleeyefitter {
+
+namespace {
+
+    // every model is scaled to the anthropomorphic average eye radius, the residual
+    // blocks of the refinement problem rely on it never changing
+    const double kEyeRadius = 12.0;
+
+}
+
+// EyeModel::EyeModel(EyeModel&& that) :
+//     mInitialUncheckedPupils(that.mInitialUncheckedPupils), mFocalLength(that.mFocalLength), mCameraCenter(that.mCameraCenter),
+//     mTotalBins(that.mTotalBins), mBinResolution(that.mBinResolution), mTimestamp(that.mTimestamp ),
+//     mModelID(that.mModelID)
+// {
+//     std::lock_guard<std::mutex> lock(that.mModelMutex);
+//     mSupportingPupils = std::move(that.mSupportingPupils);
+//     mSupportingPupilsToAdd = std::move(that.mSupportingPupilsToAdd);
+//     mSphere = std::move(that.mSphere);
+//     mInitialSphere = std::move(that.mInitialSphere);
+//     mSpatialBins = std::move(that.mSpatialBins);
+//     mBinPositions = std::move(that.mBinPositions);
+//     mFit = std::move(that.mFit);
+//     mPerformance = std::move(that.mPerformance);
+//     mMaturity = std::move(that.mMaturity);
+//     mModelSupports = std::move(that.mModelSupports);
+//     mSupportingPupilSize = mSupportingPupils.size();
+//     std::cout << "MOVE EYE MODEL" << std::endl;
+// }
+
+// EyeModel& EyeModel::operator=(EyeModel&& that){
+
+//     std::lock_guard<std::mutex> lock(that.mModelMutex);
+//     mSupportingPupils = std::move(that.mSupportingPupils);
+//     mSupportingPupilsToAdd = std::move(that.mSupportingPupilsToAdd);
+//     mSphere = std::move(that.mSphere);
+//     mInitialSphere = std::move(that.mInitialSphere);
+//     mSpatialBins = std::move(that.mSpatialBins);
+//     mBinPositions = std::move(that.mBinPositions);
+//     mFit = std::move(that.mFit);
+//     mPerformance = std::move(that.mPerformance);
+//     mMaturity = std::move(that.mMaturity);
+//     mModelSupports = std::move(that.mModelSupports);
+//     mSupportingPupilSize = mSupportingPupils.size();
+//     std::cout << "MOVE ASSGINE EYE MODEL" << std::endl;
+//     return *this;
+// }
+
+EyeModel::EyeModel( int modelId, double timestamp,  double focalLength, Vector3 cameraCenter, int initialUncheckedPupils, double binResolution  ):
+    mModelID(modelId),
+    mBirthTimestamp(timestamp),
+    mFocalLength(std::move(focalLength)),
+    mCameraCenter(std::move(cameraCenter)),
+    mInitialUncheckedPupils(initialUncheckedPupils),
+    mTotalBins(std::pow(std::floor(1.0/binResolution), 2 ) * 4 ),
+    mTotalBinsPerAxis(std::ceil(1.0/binResolution)),
+    mBinResolution(binResolution),
+    mSolverFit(0),
+    mPerformance(30),
+    mPerformanceGradient(0),
+    mLastPerformanceCalculationTime(),
+    mPerformanceWindowSize(3.0),
+    mWorkPending(false),
+    mStopWorker(false),
+    mRefinementReady(false),
+    mHasSolution(false)
+    {
+        resetProblem();
+
+        mWorker = std::thread(&EyeModel::refinementLoop, this);
+    };
+
+EyeModel::~EyeModel(){
+
+    {
+        std::lock_guard<std::mutex> lockWork(mWorkMutex);
+        mStopWorker = true;
+    }
+    mWorkCondition.notify_one();
+    //wait for thread to finish before we dealloc
+    if( mWorker.joinable() )
+        mWorker.join();
+}
+
+void EyeModel::refinementLoop()
+{
+    while (true) {
+
+        Detector3DProperties props;
+        {
+            // wait for new work, but never overwrite a refinement which wasn't collected yet
+            std::unique_lock<std::mutex> lockWork(mWorkMutex);
+            mWorkCondition.wait(lockWork, [this](){
+                return mStopWorker || (mWorkPending && !mRefinementReady.load(std::memory_order_acquire));
+            });
+            if (mStopWorker)
+                return;
+            mWorkPending = false;
+            props = mRefinementProps;
+        }
+
+        std::lock_guard<std::mutex> lockPupil(mPupilMutex);
+        Sphere sphere;
+        if (mHasSolution) {
+            // warm start from the previous solution, only the pupils added since then are initialised
+            sphere = Sphere(Vector3(mEyeParams[0], mEyeParams[1], mEyeParams[2]), kEyeRadius);
+        } else {
+            sphere = initialiseModel();
+        }
+        auto initialSphere = sphere;
+        double fit = refineWithEdges(sphere, props);
+
+        if (initialSphere != Sphere::Null && (!sphere.center.allFinite() || (sphere.center - initialSphere.center).norm() > kEyeRadius)) {
+            // the warm started solution diverged, start over from a fresh RANSAC estimate
+            resetProblem();
+            sphere = initialiseModel();
+            initialSphere = sphere;
+            fit = refineWithEdges(sphere, props);
+        }
+
+        mRefinement.sphere = sphere;
+        mRefinement.initialSphere = initialSphere;
+        mRefinement.fit = fit;
+        mRefinementReady.store(true, std::memory_order_release);
+    }
+}
+
+void EyeModel::collectRefinement()
+{
+    if (!mRefinementReady.load(std::memory_order_acquire))
+        return;
+
+    {
+        std::lock_guard<std::mutex> lockModel(mModelMutex);
+        mInitialSphere = mRefinement.initialSphere;
+        mSphere = mRefinement.sphere;
+        mSolverFit = mRefinement.fit;
+    }
+    mRefinementReady.store(false, std::memory_order_release);
+
+    // the worker might wait for us to take the result
+    { std::lock_guard<std::mutex> lockWork(mWorkMutex); }
+    mWorkCondition.notify_one();
+}
+
+
+std::pair<Circle,ConfidenceValue> EyeModel::presentObservation(const ObservationPtr newObservationPtr, double averageFramerate, const Detector3DProperties& props )
+{
+    // take over the latest refinement if the worker finished one
+    collectRefinement();
+
+    if (mBirthTimestamp == -1){
+        mBirthTimestamp = newObservationPtr->getTimestamp();
+        }
+
+    Circle circle;
+    bool shouldAddObservation = false;
+    int bin = -1;
+    int replaceSlot = -1;
+    double confidence2D = newObservationPtr->getConfidence2D();
+    ConfidenceValue oberservation_fit = ConfidenceValue(0,1);
+
+    // unlock when done
+    mModelMutex.lock(); // needed for mSphere and mSupportingPupilSize
+    //Check for properties if it's a candidate we can use
+    if (mSphere != Sphere::Null && (mSupportingPupilSize + mSupportingPupilsToAdd.size()) >= mInitialUncheckedPupils ) {
+
+        // select the right circle depending on the current model
+        const Circle& unprojectedCircle = selectUnprojectedCircle(mSphere, newObservationPtr->getUnprojectedCirclePair() );
+
+        // initialised circle. circle parameters addapted to our current eye model
+        circle = getIntersectedCircle(mSphere, unprojectedCircle);
+
+        if (unprojectedCircle != Circle::Null && circle != Circle::Null) {  // initialise failed
+            oberservation_fit = calculateModelOberservationFit(unprojectedCircle, circle , confidence2D);
+            updatePerformance( oberservation_fit, averageFramerate);
+        }
+
+        if (circle == Circle::Null){
+            circle = unprojectedCircle; // at least return the unprojected circle
+        }
+
+        //check first if the observations is strong enough to build the eye model ontop of it
+        // the confidence is above 0.99 only if we have a strong prior.
+        // also binchecking
+        if (confidence2D >= 0.98 && isSpatialRelevant(unprojectedCircle, props.model_pupils_per_bin, bin, replaceSlot)) {
+            shouldAddObservation = true;
+        } else {
+            //std::cout << " spatial check failed"  << std::endl;
+        }
+
+
+    } else if (confidence2D > 0.98) { // no valid sphere yet
+        shouldAddObservation = true;
+    }
+     mModelMutex.unlock();
+
+    if (shouldAddObservation) {
+        //if the observation passed all tests we can add it
+        mSupportingPupilsToAdd.emplace_back( newObservationPtr, bin, replaceSlot );
+
+    }
+
+    using namespace std::chrono;
+
+    Clock::time_point now( Clock::now() );
+    seconds pastSecondsRefinement = duration_cast<seconds>(now - mLastModelRefinementTime);
+
+    int amountNewObservations = mSupportingPupilsToAdd.size();
+   if( amountNewObservations > 1 &&  pastSecondsRefinement.count() + amountNewObservations > 10   ){
+
+            // tryTransferNewObservations is false as long as the worker is refining
+            if(tryTransferNewObservations(props.model_max_pupils) ) {
+                {
+                    std::lock_guard<std::mutex> lockWork(mWorkMutex);
+                    mRefinementProps = props;
+                    mWorkPending = true;
+                }
+                mWorkCondition.notify_one();
+                mLastModelRefinementTime =  Clock::now() ;
+            }
+     }
+
+    return {circle, oberservation_fit};
+}
+
+EyeModel::Sphere EyeModel::findSphereCenter( bool use_ransac /*= true*/)
+{
+    using math::sq;
+
+    Sphere sphere;
+
+    if (mSupportingPupils.size() < 2) {
+        return Sphere::Null;
+    }
+    const double eyeZ = 57; // could be any value
+
+    // should we save them some where else ?
+    std::vector<Line> pupilGazelinesProjected;
+    for (const auto& pupil : mSupportingPupils) {
+        pupilGazelinesProjected.push_back( pupil.mObservationPtr->getProjectedCircleGaze() );
+    }
+
+    // Get eyeball center
+    //
+    // Find a least-squares 'intersection' (point nearest to all lines) of
+    // the projected 2D gaze vectors. Then, unproject that circle onto a
+    // point a fixed distance away.
+    //
+    // For robustness, use RANSAC to eliminate stray gaze lines
+    //
+    // (This has to be done here because it's used by the pupil circle
+    // disambiguation)
+    Vector2 eyeCenterProjected;
+    bool validEye;
+
+    if ( use_ransac ) {
+        const int lineCount = pupilGazelinesProjected.size();
+        const int n = 2;
+        double w = 0.3;
+        double p = 0.9999;
+        int k = ceil(log(1 - p) / log(1 - pow(w, n)));
+        double epsilon = 10;
+        const int blockSize = 32; // hypotheses scored at once
+
+        // the lines in normal form n.x = c, the distance of a point to all lines is then a matrix product
+        Eigen::Matrix<double, 2, Eigen::Dynamic> normals(2, lineCount);
+        Eigen::VectorXd offsets(lineCount);
+        for (int i = 0; i < lineCount; ++i) {
+            const auto& line = pupilGazelinesProjected[i];
+            normals.col(i) << -line.direction().y(), line.direction().x();
+            offsets[i] = normals.col(i).dot(line.origin());
+        }
+        // per line terms of the least squares intersection: sum(n n^T) x = sum(n c)
+        Eigen::Matrix<double, Eigen::Dynamic, 5> normalTerms(lineCount, 5);
+        normalTerms.col(0) = normals.row(0).transpose().array().square();
+        normalTerms.col(1) = normals.row(0).transpose().array() * normals.row(1).transpose().array();
+        normalTerms.col(2) = normals.row(1).transpose().array().square();
+        normalTerms.col(3) = normals.row(0).transpose().array() * offsets.array();
+        normalTerms.col(4) = normals.row(1).transpose().array() * offsets.array();
+
+        Eigen::Matrix<double, 2, Eigen::Dynamic> hypotheses(2, blockSize);
+        Eigen::Matrix<double, 2, Eigen::Dynamic> inlierCenters(2, blockSize);
+        std::vector<int> inlierCenterCounts;
+        inlierCenterCounts.reserve(blockSize);
+
+        Vector2 bestEyeCenterProjected;
+        double bestLineDistanceError = std::numeric_limits<double>::infinity();
+        int bestInlierCount = 0;
+
+        for (int iteration = 0; iteration < k; ) {
+
+            // intersect random line pairs
+            const int block = std::min(blockSize, k - iteration);
+            int hypothesesCount = 0;
+            for (int i = 0; i < block; ++i) {
+                int a = random(0, lineCount - 1);
+                int b = random(0, lineCount - 2);
+                if (b >= a) ++b;
+                Eigen::Matrix2d A;
+                A << normals.col(a).transpose(), normals.col(b).transpose();
+                if (std::abs(A.determinant()) < 1e-12) {
+                    continue; // parallel lines
+                }
+                hypotheses.col(hypothesesCount++) = A.inverse() * Vector2(offsets[a], offsets[b]);
+            }
+            iteration += block;
+            if (hypothesesCount == 0) {
+                continue;
+            }
+
+            // inliers of every hypothesis
+            const Eigen::MatrixXd inliers = (((normals.transpose() * hypotheses.leftCols(hypothesesCount)).colwise() - offsets)
+                                             .array().abs() < epsilon).cast<double>();
+            const Eigen::VectorXd inlierCounts = inliers.colwise().sum().transpose();
+            const Eigen::Matrix<double, Eigen::Dynamic, 5> sums = inliers.transpose() * normalTerms;
+
+            // least squares intersection of the inliers
+            inlierCenterCounts.clear();
+            for (int i = 0; i < hypothesesCount; ++i) {
+                if (inlierCounts[i] <= w * lineCount) {
+                    continue;
+                }
+                Eigen::Matrix2d A;
+                A << sums(i, 0), sums(i, 1), sums(i, 1), sums(i, 2);
+                if (std::abs(A.determinant()) < 1e-12) {
+                    continue;
+                }
+                inlierCenters.col(inlierCenterCounts.size()) = A.inverse() * Vector2(sums(i, 3), sums(i, 4));
+                inlierCenterCounts.push_back(inlierCounts[i]);
+            }
+            if (inlierCenterCounts.empty()) {
+                continue;
+            }
+
+            // truncated squared distance of all lines to every inlier center
+            const Eigen::ArrayXd lineDistanceErrors = ((normals.transpose() * inlierCenters.leftCols(inlierCenterCounts.size())).colwise() - offsets)
+                                                      .array().square().min(epsilon * epsilon).colwise().sum().transpose();
+            for (size_t i = 0; i < inlierCenterCounts.size(); ++i) {
+                if (lineDistanceErrors[i] < bestLineDistanceError) {
+                    bestEyeCenterProjected = inlierCenters.col(i);
+                    bestLineDistanceError = lineDistanceErrors[i];
+                    bestInlierCount = inlierCenterCounts[i];
+                }
+            }
+
+            // adaptive termination, with the best inlier ratio found so far
+            // fewer hypotheses are needed to reach the confidence p
+            const double inlierRatio = double(bestInlierCount) / lineCount;
+            if (inlierRatio >= 1.0) {
+                break;
+            }
+            k = std::min(k, int(ceil(log(1 - p) / log(1 - pow(inlierRatio, n)))));
+        }
+
+        // std::cout << "Inliers: " << bestInlierCount
+        //     << " (" << (100.0*bestInlierCount / lineCount) << "%)"
+        //     << " = " << bestLineDistanceError
+        //     << std::endl;
+
+        if (bestInlierCount > 0) {
+            eyeCenterProjected = bestEyeCenterProjected;
+            validEye = true;
+
+        } else {
+            validEye = false;
+        }
+
+    } else {
+
+        eyeCenterProjected = nearest_intersect(pupilGazelinesProjected);
+        validEye = true;
+    }
+
+    if (validEye) {
+        sphere.center << eyeCenterProjected* eyeZ / mFocalLength,
+                   eyeZ;
+        sphere.radius = 1;
+
+        // Disambiguate pupil circles using projected eyeball center
+        //
+        // Assume that the gaze vector points away from the eye center, and
+        // so projected gaze points away from projected eye center. Pick the
+        // solution which satisfies this assumption
+
+        for (size_t i = 0; i < mSupportingPupils.size(); ++i) {
+            const auto& pupilPair = mSupportingPupils[i].mObservationPtr->getUnprojectedCirclePair();
+            const auto& line = mSupportingPupils[i].mObservationPtr->getProjectedCircleGaze();
+            const auto& originProjected = line.origin();
+            const auto& directionProjected = line.direction();
+
+            // Check if directionProjected going away from est eye center. If it is, then
+            // the first circle was correct. Otherwise, take the second one.
+            // The two normals will point in opposite directions, so only need
+            // to check one.
+            if ((originProjected - eyeCenterProjected).dot(directionProjected) >= 0) {
+                mSupportingPupils[i].mCircle =  pupilPair.first;
+
+            } else {
+                mSupportingPupils[i].mCircle = pupilPair.second;
+            }
+
+            // calculate the center variance of the projected gaze vectors to the current eye center
+          //  center_distance_variance += euclidean_distance_squared( eye.center, Line3(pupils[i].circle.center, pupils[i].circle.normal ) );
+
+        }
+        //center_distance_variance /= pupils.size();
+        //std::cout << "center distance variance " << center_distance_variance << std::endl;
+
+    } else {
+        // No inliers, so no eye
+        sphere = Sphere::Null;
+    }
+
+    return sphere;
+
+}
+
+EyeModel::Sphere EyeModel::initialiseModel(){
+
+
+    Sphere sphere = findSphereCenter();
+
+    if (sphere == Sphere::Null) {
+        return sphere;
+    }
+    //std::cout << "init model" << std::endl;
+
+    // Find pupil positions on eyeball to get radius
+    //
+    // For each image, calculate the 'most likely' position of the pupil
+    // circle given the eyeball sphere estimate and gaze vector. Re-estimate
+    // the gaze vector to be consistent with this position.
+    // First estimate of pupil center, used only to get an estimate of eye radius
+    double eyeRadiusAcc = 0;
+    int eyeRadiusCount = 0;
+
+    for (const auto& pupil : mSupportingPupils) {
+
+        // Intersect the gaze from the eye center with the pupil circle
+        // center projection line (with perfect estimates of gaze, eye
+        // center and pupil circle center, these should intersect,
+        // otherwise find the nearest point to both lines)
+        Vector3 pupilCenter = nearest_intersect(Line3(sphere.center, pupil.mCircle.normal),
+                               Line3(mCameraCenter, pupil.mCircle.center.normalized()));
+        auto distance = (pupilCenter - sphere.center).norm();
+        eyeRadiusAcc += distance;
+        ++eyeRadiusCount;
+    }
+
+    // Set the eye radius as the mean distance from pupil centers to eye center
+    sphere.radius = eyeRadiusAcc / eyeRadiusCount;
+
+    // Second estimate of pupil radius, used to get position of pupil on eye
+
+    //TODO do we really need this if we don't do refinement ?????
+    for ( auto& pupil : mSupportingPupils) {
+        initialiseSingleObservation(sphere, pupil);
+    }
+
+    // Scale eye to anthropomorphic average radius of 12mm
+    auto scale = kEyeRadius / sphere.radius;
+    sphere.radius = kEyeRadius;
+    sphere.center *= scale;
+    for ( auto& pupil : mSupportingPupils) {
+        pupil.mParams.radius *= scale;
+        pupil.mCircle = circleFromParams(sphere, pupil.mParams);
+    }
+
+    return sphere;
+
+}
+
+double EyeModel::refineWithEdges(Sphere& sphere, const Detector3DProperties& props )
+{
+    if (sphere == Sphere::Null || mSupportingPupils.empty()) {
+        return 0;
+    }
+
+    // The problem lives as long as the model. Pupils which are already part of it
+    // keep their residual blocks, only new pupils are added and evicted ones were
+    // removed in tryTransferNewObservations.
+    // The residuals store the eye radius, so it has to be the same for every refinement.
+    assert(sphere.radius == kEyeRadius);
+    mEyeParams[0] = sphere.center[0];
+    mEyeParams[1] = sphere.center[1];
+    mEyeParams[2] = sphere.center[2];
+
+    for (auto& pupil : mSupportingPupils) {
+        const auto& pupilInliers = pupil.mObservationPtr->getEdges();
+        if (pupil.mParamBlock || pupilInliers.rows() == 0) {
+            continue;
+        }
+        if (mHasSolution) {
+            // parametrise the new pupil on the previous solution, without a new initialiseModel
+            pupil.mCircle = selectUnprojectedCircle(sphere, pupil.mObservationPtr->getUnprojectedCirclePair());
+            initialiseSingleObservation(sphere, pupil);
+        }
+        pupil.mParamBlock.reset(new double[3]{ pupil.mParams.theta, pupil.mParams.psi, pupil.mParams.radius });
+        mProblem->AddResidualBlock(
+            new ceres::AutoDiffCostFunction<EllipseDistanceResidualFunction<double>, ceres::DYNAMIC, 3, 3>(
+            new EllipseDistanceResidualFunction<double>( pupilInliers, sphere.radius, mFocalLength),
+            pupilInliers.rows()
+            ),
+            new ceres::CauchyLoss(0.01),
+            mEyeParams, pupil.mParamBlock.get());
+    }
+
+    ceres::Solver::Options options;
+    switch (props.refinement_linear_solver) {
+        case 1:
+            options.linear_solver_type = ceres::SPARSE_SCHUR;
+            break;
+        case 2:
+            options.linear_solver_type = ceres::ITERATIVE_SCHUR;
+            break;
+        default:
+            options.linear_solver_type = ceres::DENSE_SCHUR;
+    }
+    if (options.linear_solver_type == ceres::SPARSE_SCHUR &&
+        !ceres::IsSparseLinearAlgebraLibraryTypeAvailable(options.sparse_linear_algebra_library_type)) {
+        options.linear_solver_type = ceres::DENSE_SCHUR; // ceres was built without a sparse library
+    }
+    options.max_num_iterations = props.refinement_max_iterations;
+    if (props.refinement_max_solver_time > 0) {
+        options.max_solver_time_in_seconds = props.refinement_max_solver_time;
+    }
+    options.function_tolerance = 1e-10;
+    options.minimizer_progress_to_stdout = false;
+    options.update_state_every_iteration = false;
+    // if (callback) {
+    //     struct CallCallbackWrapper : public ceres::IterationCallback
+    //     {
+    //         double eye_radius;
+    //         const CallbackFunction& callback;
+    //         const Eigen::Matrix<double, Eigen::Dynamic, 1>& x;
+
+    //         CallCallbackWrapper(const EyeModelFitter& fitter, const CallbackFunction& callback, const Eigen::Matrix<double, Eigen::Dynamic, 1>& x)
+    //             : eye_radius(fitter.eye.radius), callback(callback), x(x) {}
+
+    //         virtual ceres::CallbackReturnType operator() (const ceres::IterationSummary& summary) {
+    //             Eigen::Matrix<double, 3, 1> eye_pos(x[0], x[1], x[2]);
+    //             Sphere eye(eye_pos, eye_radius);
+
+    //             std::vector<Circle> pupils;
+    //             for (int i = 0; i < (x.size() - 3)/3; ++i) {
+    //                 auto&& pupil_param_v = x.segment<3>(3 + 3 * i);
+    //                 pupils.push_back(EyeModelFitter::circleFromParams(eye, PupilParams(pupil_param_v[0], pupil_param_v[1], pupil_param_v[2])));
+    //             }
+
+    //             callback(eye, pupils);
+
+    //             return ceres::SOLVER_CONTINUE;
+    //         }
+    //     };
+    //     options.callbacks.push_back(new CallCallbackWrapper(*this, callback, x));
+    // }
+    ceres::Solver::Summary summary;
+    ceres::Solve(options, mProblem.get(), &summary);
+    mHasSolution = true;
+
+
+    double fit = 0;
+    sphere.center = Vector3(mEyeParams[0], mEyeParams[1], mEyeParams[2]);
+
+     for (auto& pupil : mSupportingPupils) {
+        if (pupil.mParamBlock) {
+            pupil.mParams = PupilParams(pupil.mParamBlock[0], pupil.mParamBlock[1], pupil.mParamBlock[2]);
+        }
+        const Circle& unprojectedCircle = selectUnprojectedCircle(sphere, pupil.mObservationPtr->getUnprojectedCirclePair() );
+        Circle optimizedCircle = circleFromParams(sphere, pupil.mParams );
+        fit += calculateModelFit( unprojectedCircle , optimizedCircle );
+    }
+
+    fit /= mSupportingPupils.size();
+
+
+    return fit;
+
+}
+
+// void EyeModel::setSensitivity( float sensitivity ){
+
+//     static const float minWindowSize = 0.01;
+//     static const float maxWindowSize = 20.0;
+//     // sensitivity could influence other values too
+//     mPerformanceWindowSize  = math::lerp(minWindowSize, maxWindowSize, sensitivity);
+// }
+
+EyeModel::Sphere EyeModel::getSphere() const {
+    std::lock_guard<std::mutex> lockModel(mModelMutex);
+    return mSphere;
+};
+
+EyeModel::Sphere EyeModel::getInitialSphere() const {
+    std::lock_guard<std::mutex> lockModel(mModelMutex);
+    return mInitialSphere;
+};
+
+double EyeModel::getMaturity() const {
+
+    //Spatial variance
+    // Our bins are just on half of the sphere and by observing different models, it turned out
+    // that if a eighth of half the sphere is filled it gives a good maturity.
+    // Thus we scale it that a the maturity will be 1 if a eighth is filled
+    using std::floor;
+    using std::pow;
+    return  mSpatialBins.size()/(mTotalBins/8.0);
+}
+
+double EyeModel::getConfidence() const {
+    return fmin(1.,fmax(0.,fmod(mPerformance.getAverage(),0.99)*100));
+}
+double EyeModel::getPerformance() const {
+    return mPerformance.getAverage();
+}
+double EyeModel::getPerformanceGradient() const {
+    return mPerformanceGradient;
+}
+double EyeModel::getSolverFit() const {
+    return mSolverFit;
+}
+
+std::vector<Vector3> EyeModel::getBinPositions() const {
+    std::vector<Vector3> positions;
+    positions.reserve(mSpatialBins.size());
+    for (const auto& bin : mSpatialBins) {
+        positions.push_back(bin.second.position);
+    }
+    return positions;
+}
+
+bool EyeModel::tryTransferNewObservations( int maxPupils ){
+    bool ownPupil = mPupilMutex.try_lock();
+    if( ownPupil ){
+        for( auto pending = mSupportingPupilsToAdd.begin(); pending != mSupportingPupilsToAdd.end(); ++pending){
+            Pupil& pupil = *pending;
+
+            if (pupil.mReplaceSlot >= 0) {
+                // reservoir replacement, take the place of the n-th pupil in the same bin
+                // the bin count the slot was drawn from includes pupils which are still pending
+                int slot = pupil.mReplaceSlot;
+                auto inBinSlot = [&](const Pupil& p){
+                    return p.mBin == pupil.mBin && p.mReplaceSlot < 0 && slot-- == 0;
+                };
+                auto replaced = std::find_if(mSupportingPupils.begin(), mSupportingPupils.end(), inBinSlot);
+                if (replaced != mSupportingPupils.end()) {
+                    removeFromProblem(*replaced);
+                    *replaced = std::move(pupil);
+                    replaced->mReplaceSlot = -1;
+                    continue;
+                }
+                auto replacedPending = std::find_if(pending + 1, mSupportingPupilsToAdd.end(), inBinSlot);
+                if (replacedPending != mSupportingPupilsToAdd.end()) {
+                    // takes the place (and the bin count) of the pending pupil, it is transferred when its turn comes
+                    *replacedPending = std::move(pupil);
+                    replacedPending->mReplaceSlot = -1;
+                    continue;
+                }
+                // the bin lost pupils in the meantime, drop the observation, the bin is at its limit anyway
+                continue;
+            } else if (pupil.mBin >= 0 && mSpatialBins.find(pupil.mBin) == mSpatialBins.end()) {
+                // isSpatialRelevant counted the pupil in its bin, which keeps the bin alive until here.
+                // Should it be gone anyway, unbin the pupil, so removeFromSpatialBin never touches a later bin with that key
+                pupil.mBin = -1;
+            }
+            mSupportingPupils.push_back( std::move(pupil) );
+        }
+        mSupportingPupilsToAdd.clear();
+
+        // if the store is full, thin out the fullest bin first and take its oldest pupil,
+        // thus every bin keeps representatives as long as possible
+        // pupils without a bin (added before the model had a sphere) count as a bin of their own
+        while (maxPupils > 0 && mSupportingPupils.size() > static_cast<size_t>(maxPupils)) {
+            const int unbinned = std::count_if(mSupportingPupils.begin(), mSupportingPupils.end(), [](const Pupil& p){ return p.mBin < 0; });
+            auto binCount = [&](const Pupil& p){
+                if (p.mBin < 0)
+                    return unbinned;
+                auto search = mSpatialBins.find(p.mBin);
+                return search != mSpatialBins.end() ? search->second.count : 0;
+            };
+            auto evicted = std::max_element(mSupportingPupils.begin(), mSupportingPupils.end(), [&](const Pupil& a, const Pupil& b){
+                const int countA = binCount(a);
+                const int countB = binCount(b);
+                return countA < countB || (countA == countB && a.mObservationPtr->getTimestamp() > b.mObservationPtr->getTimestamp());
+            });
+            removeFromSpatialBin(*evicted);
+            removeFromProblem(*evicted);
+            // the order of the pupils doesn't matter
+            if (evicted != mSupportingPupils.end() - 1)
+                *evicted = std::move(mSupportingPupils.back());
+            mSupportingPupils.pop_back();
+        }
+        mPupilMutex.unlock();
+        std::lock_guard<std::mutex> lockModel(mModelMutex);
+        mSupportingPupilSize = mSupportingPupils.size();
+        return true;
+    }else{
+        return false;
+    }
+
+}
+
+ConfidenceValue EyeModel::calculateModelOberservationFit(const Circle&  unprojectedCircle, const Circle& initialisedCircle, double confidence2D) const {
+
+    // the angle between the unprojected and the initialised circle normal tells us how good the current observation supports our current model
+    // if our model is good these normals should align.
+    const auto& n1 = unprojectedCircle.normal;
+    const auto& n2 = initialisedCircle.normal;
+    ConfidenceValue oberservationFit;
+    oberservationFit.value = n1.dot(n2);
+
+    // if the 2d pupil is almost a circle the unprojection gets inaccurate, thus the normal doesn't align well with the initialised circle
+    // this is the case when looking directly into the camera.
+    // we take this into account be calculation a confidence which depends on the angle between the normal and the direction from the sphere to the camera
+    const Vector3 sphereToCameraDirection = (mCameraCenter - mSphere.center).normalized();
+    const double eccentricity = sphereToCameraDirection.dot(initialisedCircle.normal);
+    //std::cout << "inaccuracy: " <<  inaccuracy << std::endl;
+
+    // the we calculate a how much we usefullness we give the oberservationFit value by merging the 2d confidence with eccentriciy.
+    // we do this using a function with parameters that are tweaked through experimentation.
+    // a plot of the fn can be found here:
+    // http://www.livephysics.com/tools/mathematical-tools/online-3-d-function-grapher/?xmin=0&xmax=1&ymin=0&ymax=1&zmin=Auto&zmax=Auto&f=x%5E10%2A%281-y%5E20%29
+    oberservationFit.confidence =  (1-pow(eccentricity,20)) * pow(confidence2D,15);
+
+    return oberservationFit;
+}
+
+void EyeModel::updatePerformance( const ConfidenceValue& performance_datum, double averageFramerate ){
+
+    // dont add values with 0.0 confidence.
+    if( performance_datum.value <= 0.0 )
+        return;
+
+    const double previousPerformance = mPerformance.getAverage();
+
+    // whenever there is a change in framerate bigger than 1, change the window size
+    // window size linearly depends on the framerate
+    // the average frame rate changes slowly to compensate onetime big changes
+    if( std::abs(averageFramerate  - mPerformance.getWindowSize()/mPerformanceWindowSize) > 1 ){
+        int newWindowSize = std::round(  averageFramerate * mPerformanceWindowSize );
+        mPerformance.changeWindowSize(newWindowSize);
+    }
+
+    mPerformance.addValue(performance_datum.value , performance_datum.confidence); // weighted average
+
+    using namespace std::chrono;
+
+    Clock::time_point now( Clock::now() );
+    duration<double, std::milli> deltaTimeMs = now - mLastPerformanceCalculationTime;
+    // calculate performance gradient (backward difference )
+    mPerformanceGradient =  (mPerformance.getAverage() - previousPerformance) / deltaTimeMs.count();
+    mLastPerformanceCalculationTime =  now;
+}
+
+
+double EyeModel::calculateModelFit(const Circle&  unprojectedCircle, const Circle& optimizedCircle) const {
+
+    // the angle between the unprojected and the initialised circle normal tells us how good the current observation supports our current model
+    // if our model is good and the camera didn't change perspective or so, these normals should align pretty well
+    const auto& n1 = unprojectedCircle.normal;
+    const auto& n2 = optimizedCircle.normal;
+    const double normalsAngle = n1.dot(n2);
+    return normalsAngle;
+}
+
+void EyeModel::resetProblem(){
+
+    // fast removal, evicted pupils are removed from the problem frequently
+    ceres::Problem::Options problemOptions;
+    problemOptions.enable_fast_removal = true;
+    mProblem.reset(new ceres::Problem(problemOptions));
+    mProblem->AddParameterBlock(mEyeParams, 3);
+    // the old problem is gone, so are the residual blocks of the pupils
+    for (auto& pupil : mSupportingPupils) {
+        pupil.mParamBlock.reset();
+    }
+    mHasSolution = false;
+}
+
+void EyeModel::removeFromProblem( Pupil& pupil ){
+
+    if (pupil.mParamBlock) {
+        // removes the residual block of the pupil too
+        mProblem->RemoveParameterBlock(pupil.mParamBlock.get());
+        pupil.mParamBlock.reset();
+    }
+}
+
+void EyeModel::addToSpatialBin( Pupil& pupil ){
+
+    auto search = mSpatialBins.find(pupil.mBin);
+    if (search != mSpatialBins.end()) {
+        search->second.count++;
+    } else {
+        // the bin was emptied by the eviction, the pupil isn't binned anymore
+        pupil.mBin = -1;
+    }
+}
+
+void EyeModel::removeFromSpatialBin( const Pupil& pupil ){
+
+    auto search = mSpatialBins.find(pupil.mBin);
+    if (search != mSpatialBins.end() && --search->second.count <= 0) {
+        mSpatialBins.erase(search);
+    }
+}
+
+bool EyeModel::isSpatialRelevant(const Circle& circle, int maxPupilsPerBin, int& bin, int& replaceSlot){
+
+ /* In order to check if new observations are unique (not in the same area as previous one ),
+     the position on the sphere (only x,y coords) are binned  (spatial binning) an inserted into the right bin.
+     !! This is not a correct method to check if they are uniformly distibuted, because if x,y are uniformly distibuted
+     it doesn't mean points on the spehre are uniformly distibuted.
+     To uniformly distribute points on a sphere you have to check if the area is equal on the sphere of two bins.
+     We just look on half of the sphere, it's like projecting a checkboard grid on the sphere, thus the bins are more dense in the projection center,
+     and less dense further back.
+     Still it gives good results an works for our purpose
+    */
+    Vector3 pupilNormal =  circle.normal; // the same as a vector from unit sphere center to the pupil center
+
+    // calculate bin
+    // values go from -1 to 1
+    double x = pupilNormal.x();
+    double y = pupilNormal.y();
+    const int binX = std::floor( x / mBinResolution + 0.5 );
+    const int binY = std::floor( y / mBinResolution + 0.5 );
+    x = binX * mBinResolution;
+    y = binY * mBinResolution;
+
+    // bin indices are within [-1/mBinResolution, 1/mBinResolution]
+    const int binsPerAxis = 2 * mTotalBinsPerAxis + 1;
+    bin = (binX + mTotalBinsPerAxis) * binsPerAxis + (binY + mTotalBinsPerAxis);
+    replaceSlot = -1;
+    auto search = mSpatialBins.find(bin);
+
+    if (search == mSpatialBins.end()) {
+
+        // there is no bin at this coord
+        // so add one
+        double z = std::copysign(std::sqrt(std::max(0.0, 1.0 - x * x - y * y)),  pupilNormal.z());
+        mSpatialBins.emplace(bin, SpatialBin{1, 1, Vector3(x , y, z)});
+        return true;
+    }
+
+    SpatialBin& spatialBin = search->second;
+    spatialBin.seen++;
+    if (spatialBin.count < maxPupilsPerBin) {
+        spatialBin.count++;
+        return true;
+    }
+
+    // a single pupil per bin keeps the first observation of the bin
+    if (maxPupilsPerBin <= 1) {
+        return false;
+    }
+
+    // reservoir sampling, every observation of a bin is kept with the same probability
+    int slot = random(0, spatialBin.seen - 1);
+    if (slot < maxPupilsPerBin) {
+        replaceSlot = slot;
+        return true;
+    }
+
+    return false;
+
+}
+
+
+
+const Circle& EyeModel::selectUnprojectedCircle( const Sphere& sphere,  const std::pair<const Circle, const Circle>& circles) const
+{
+    const Vector3& c = circles.first.center;
+    const Vector3& v = circles.first.normal;
+    Vector2 centerProjected = project(c, mFocalLength);
+    Vector2 directionProjected = project(v + c, mFocalLength) - centerProjected;
+    directionProjected.normalize();
+    Vector2 eyeCenterProjected = project(sphere.center, mFocalLength);
+
+    if ((centerProjected - eyeCenterProjected).dot(directionProjected) >= 0) {
+        return circles.first;
+
+    } else {
+       return circles.second;
+    }
+
+}
+
+void EyeModel::initialiseSingleObservation( const Sphere& sphere, Pupil& pupil) const
+{
+    // Ignore the circle normal, and intersect the circle
+    // center projection line with the sphere
+
+    std::pair<Vector3,Vector3> pupil_center_sphere_intersect;
+    bool didIntersect =  intersect(Line3(mCameraCenter, pupil.mCircle.center.normalized()), sphere, pupil_center_sphere_intersect);
+
+    if(didIntersect){
+
+        auto new_pupil_center = pupil_center_sphere_intersect.first;
+        // Now that we have 3D positions for the pupil (rather than just a
+        // projection line), recalculate the pupil radius at that position.
+        auto pupil_radius_at_1 = pupil.mCircle.radius / pupil.mCircle.center.z();
+        auto new_pupil_radius = pupil_radius_at_1 * new_pupil_center.z();
+        // Parametrise this new pupil position using spherical coordinates
+        Vector3 center_to_pupil = new_pupil_center - sphere.center;
+        double r = center_to_pupil.norm();
+        pupil.mParams.theta = acos(center_to_pupil[1] / r);
+        pupil.mParams.psi = atan2(center_to_pupil[2], center_to_pupil[0]);
+        pupil.mParams.radius = new_pupil_radius;
+        // Update pupil circle to match parameters
+        pupil.mCircle = circleFromParams(sphere,  pupil.mParams );
+
+
+    } else {
+        // pupil.mCircle =  Circle::Null;
+        // pupil.mParams = PupilParams();
+        auto pupil_radius_at_1 = pupil.mCircle.radius / pupil.mCircle.center.z();
+        auto new_pupil_radius = pupil_radius_at_1 * sphere.center.z();
+        pupil.mParams.radius = new_pupil_radius;
+        pupil.mParams.theta = acos(pupil.mCircle.normal[1] / sphere.radius);
+        pupil.mParams.psi = atan2(pupil.mCircle.normal[2], pupil.mCircle.normal[0]);
+        // Update pupil circle to match parameters
+        pupil.mCircle = circleFromParams(sphere,  pupil.mParams );
+    }
+
+
+}
+
+Circle EyeModel::getIntersectedCircle( const Sphere& sphere, const Circle& circle) const
+{
+    // Ignore the circle normal, and intersect the circle
+    // center projection line with the sphere
+    std::pair<Vector3,Vector3> pupil_center_sphere_intersect;
+    bool didIntersect =  intersect(Line3(mCameraCenter, circle.center.normalized()), sphere, pupil_center_sphere_intersect);
+
+    if(didIntersect){
+
+        auto new_pupil_center = pupil_center_sphere_intersect.first;
+        // Now that we have 3D positions for the pupil (rather than just a
+        // projection line), recalculate the pupil radius at that position.
+        auto pupil_radius_at_1 = circle.radius / circle.center.z();
+        auto new_pupil_radius = pupil_radius_at_1 * new_pupil_center.z();
+        // Parametrise this new pupil position using spherical coordinates
+        Vector3 center_to_pupil = new_pupil_center - sphere.center;
+        double r = center_to_pupil.norm();
+        double theta = acos(center_to_pupil[1] / r);
+        double psi = atan2(center_to_pupil[2], center_to_pupil[0]);
+        double radius = new_pupil_radius;
+        // Update pupil circle to match parameters
+        auto pupilParams = PupilParams(theta, psi, radius);
+        return  circleFromParams(sphere,  pupilParams);
+
+    } else {
+        return Circle::Null;
+    }
+
+}
+
+
+Circle EyeModel::circleFromParams(const Sphere& eye, const PupilParams& params) const
+{
+    if (params.radius == 0)
+        return Circle::Null;
+
+    Vector3 radial = math::sph2cart<double>(double(1), params.theta, params.psi);
+    return Circle(eye.center + eye.radius * radial,
+                  radial,
+                  params.radius);
+}
+
+
+} // singleeyefitter
@@ -3,12 +3,16 @@
 
 #include "common/types.h"
 #include "mathHelper.h"
+#include <ceres/problem.h>
 #include <thread>
 #include <mutex>
+#include <condition_variable>
 #include <unordered_map>
 #include <vector>
 #include <list>
 #include <atomic>
+#include <numeric>
+#include <algorithm>
 
 namespace singleeyefitter {
 
@@ -21,20 +25,53 @@ namespace singleeyefitter {
 
     */
     class Observation {
-        std::shared_ptr<const Detector2DResult> mObservation2D;
+        // only what the models need is kept, not the whole 2D result
+        double mTimestamp;
+        double mConfidence2D;
+        EdgesCompact2D mEdges; // final edges of the 2D fit
         std::pair<Circle,Circle> mUnprojectedCirclePair;
         Line mProjectedCircleGaze;
 
 
     public:
-        Observation(std::shared_ptr<const Detector2DResult> observation, double focalLength) :
-            mObservation2D(observation)
+        // maxEdges limits the edges kept for the model refinement, 0 keeps all
+        Observation(std::shared_ptr<const Detector2DResult> observation, double focalLength, int maxEdges = 0) :
+            mTimestamp(observation->timestamp),
+            mConfidence2D(observation->confidence)
         {
+                const Edges2D& edges = observation->final_edges;
+                const int edgeCount = edges.size();
+                std::vector<int> selected(edgeCount);
+                std::iota(selected.begin(), selected.end(), 0);
+
+                if (maxEdges > 0 && edgeCount > maxEdges) {
+                    // order the edges by their angle around the ellipse center and
+                    // take one edge of every stratum, thus the samples are spread evenly along the contour
+                    const auto& center = observation->ellipse.center;
+                    std::vector<double> angles(edgeCount);
+                    for (int i = 0; i < edgeCount; ++i) {
+                        angles[i] = std::atan2(edges[i].y - center[1], edges[i].x - center[0]);
+                    }
+                    std::sort(selected.begin(), selected.end(), [&](int a, int b){ return angles[a] < angles[b]; });
+
+                    std::vector<int> strata(maxEdges);
+                    for (int k = 0; k < maxEdges; ++k) {
+                        strata[k] = selected[(2 * k + 1) * edgeCount / (2 * maxEdges)];
+                    }
+                    selected = std::move(strata);
+                }
+
+                mEdges.resize(selected.size(), 2);
+                for (int i = 0; i < mEdges.rows(); ++i) {
+                    mEdges(i, 0) = edges[selected[i]].x;
+                    mEdges(i, 1) = edges[selected[i]].y;
+                }
+
                 const double circleRadius = 1.0;
                 // Do a per-image unprojection of the pupil ellipse into the two fixed
                 // sized circles that would project onto it. The size of the circles
                 // doesn't matter here, only their center and normal does.
-                mUnprojectedCirclePair = unproject(mObservation2D->ellipse, circleRadius , focalLength);
+                mUnprojectedCirclePair = unproject(observation->ellipse, circleRadius , focalLength);
                  // Get projected circles and gaze vectors
                 //
                 // Project the circle centers and gaze vectors down back onto the image
@@ -52,7 +89,9 @@ namespace singleeyefitter {
         Observation( const Observation& that ) = delete; // forbid copying
         Observation( Observation&& that ) = delete; // forbid moving
         Observation() = delete; // forbid default construction
-        const std::shared_ptr<const Detector2DResult> getObservation2D() const { return mObservation2D;};
+        double getTimestamp() const { return mTimestamp; };
+        double getConfidence2D() const { return mConfidence2D; };
+        const EdgesCompact2D& getEdges() const { return mEdges; };
         const std::pair<Circle,Circle>& getUnprojectedCirclePair() const { return mUnprojectedCirclePair; };
         const Line& getProjectedCircleGaze() const { return mProjectedCircleGaze; };
 
@@ -72,7 +111,7 @@ class EyeModel {
         ~EyeModel();
 
 
-        std::pair<Circle,ConfidenceValue> presentObservation(const ObservationPtr observation, double averageFramerate  );
+        std::pair<Circle,ConfidenceValue> presentObservation(const ObservationPtr observation, double averageFramerate, const Detector3DProperties& props );
         Sphere getSphere() const;
         Sphere getInitialSphere() const;
 
@@ -91,12 +130,14 @@ class EyeModel {
         double getBirthTimestamp() const { return mBirthTimestamp; };
 
         // ----- Visualization --------
-        std::vector<Vector3> getBinPositions() const {return mBinPositions;};
+        std::vector<Vector3> getBinPositions() const;
         // ----- Visualization END --------
 
 
     private:
 
+        // checks the sphere estimation and the refinement worker, see Tests/EyeModelTest
+        friend class EyeModelTest;
 
         struct PupilParams {
             double theta, psi, radius;
@@ -107,20 +148,36 @@ class EyeModel {
         struct Pupil{
             Circle mCircle;
             PupilParams mParams;
-            const ObservationPtr mObservationPtr;
-            Pupil( const ObservationPtr observationPtr ) : mObservationPtr( observationPtr ){};
+            ObservationPtr mObservationPtr;
+            int mBin; // key of the spatial bin, -1 if the pupil wasn't binned
+            int mReplaceSlot; // for new pupils, which pupil of the bin it replaces or -1
+            std::unique_ptr<double[]> mParamBlock; // theta, psi, radius in the refinement problem, null if not added yet
+            Pupil( const ObservationPtr observationPtr, int bin = -1, int replaceSlot = -1 ) :
+                mObservationPtr( observationPtr ), mBin(bin), mReplaceSlot(replaceSlot){};
+        };
+
+        struct SpatialBin {
+            int count; // stored and new pupils in this bin
+            int seen; // relevant observations which fell into this bin
+            Vector3 position; // for visualization
         };
 
         Sphere findSphereCenter( bool use_ransac = true);
         Sphere initialiseModel();
-        double refineWithEdges( Sphere& sphere  );
-        bool tryTransferNewObservations();
+        double refineWithEdges( Sphere& sphere, const Detector3DProperties& props );
+        bool tryTransferNewObservations( int maxPupils );
+        void addToSpatialBin( Pupil& pupil );
+        void removeFromSpatialBin( const Pupil& pupil );
+        void removeFromProblem( Pupil& pupil );
+        void resetProblem();
+        void refinementLoop();
+        void collectRefinement();
 
         ConfidenceValue calculateModelOberservationFit(const Circle&  unprojectedCircle, const Circle& initialisedCircle, double confidence) const;
         void updatePerformance( const ConfidenceValue& observation_fit,  double averageFramerate);
 
         double calculateModelFit(const Circle&  unprojectedCircle, const Circle& optimizedCircle) const;
-        bool isSpatialRelevant(const Circle& circle);
+        bool isSpatialRelevant(const Circle& circle, int maxPupilsPerBin, int& bin, int& replaceSlot);
 
         const Circle& selectUnprojectedCircle(const Sphere& sphere, const std::pair<const Circle, const Circle>& circles) const;
         void initialiseSingleObservation( const Sphere& sphere, Pupil& pupil) const;
@@ -131,14 +188,37 @@ class EyeModel {
 
 
 
-        std::unordered_map<Vector2, bool, math::matrix_hash<Vector2>> mSpatialBins;
-        std::vector<Vector3> mBinPositions; // for visualization
+        // bounded store, with more than one pupil per bin every bin keeps a reservoir sample of its observations
+        std::unordered_map<int, SpatialBin> mSpatialBins;
 
         mutable std::mutex mModelMutex;
         std::mutex mPupilMutex;
-        std::thread mWorker;
         Clock::time_point mLastModelRefinementTime;
 
+        // refinement worker, lives as long as the model
+        std::thread mWorker;
+        std::mutex mWorkMutex;
+        std::condition_variable mWorkCondition;
+        bool mWorkPending; // guarded by mWorkMutex
+        bool mStopWorker; // guarded by mWorkMutex
+        Detector3DProperties mRefinementProps; // solver budget of the pending refinement, guarded by mWorkMutex
+
+        // hand-off of the refined model from the worker
+        // the worker writes mRefinement only while mRefinementReady is false,
+        // presentObservation reads it only while it is true
+        struct Refinement {
+            Sphere sphere;
+            Sphere initialSphere;
+            double fit;
+        };
+        Refinement mRefinement;
+        std::atomic<bool> mRefinementReady;
+
+        // refinement problem, kept between refinements and only used with mPupilMutex locked
+        std::unique_ptr<ceres::Problem> mProblem;
+        double mEyeParams[3]; // sphere center, parameter block of the problem
+        bool mHasSolution;
+
 
         // Factors which describe how good certain properties of the model are
         //std::list<double> mModelSupports; // values to calculate the average
@@ -153,6 +233,7 @@ class EyeModel {
         const int mInitialUncheckedPupils;
         const double mBinResolution;
         const int mTotalBins;
+        const int mTotalBinsPerAxis; // bins on each side of the center
         const int mModelID;
         double mBirthTimestamp;
 
@@ -38,9 +38,17 @@ namespace singleeyefitter {
             // it decides what happens ,since not all observations are added
             Detector3DResult updateAndDetect( std::shared_ptr<Detector2DResult>& observation,const Detector3DProperties& props, bool debug = false );
 
+            // for frames between full detections, tracks the kalman prediction with the raw edges of the observation
+            // the observation only needs raw edges, no ellipse fit
+            Detector3DResult predictAndDetect( std::shared_ptr<Detector2DResult>& observation,const Detector3DProperties& props, bool debug = false );
+            bool hasModel() const { return mCurrentSphere != Sphere::Null; };
+
 
         private:
 
+            // checks the private helpers, see Tests/EyeModelFitterTest
+            friend class EyeModelFitterTest;
+
             const Vector3 mCameraCenter;
             const double mFocalLength;
 
@@ -57,19 +65,23 @@ namespace singleeyefitter {
 
             cv::KalmanFilter mPupilState;
 
-            double mLastFrameTimestamp; //needed to calculate framerate
+            double mLastFrameTimestamp; // last frame, predicted or fully detected
+            double mLastObservationTimestamp; //needed to calculate framerate of the observations the models see
             int mApproximatedFramerate;
             math::SMA<double> mAverageFramerate;
 
             pupillabs::PyCppLogger mLogger;
 
-            void checkModels( float sensitivity,double frame_timestamp);
+            void checkModels( float sensitivity, int maxAltAmountModels, double frame_timestamp);
+            void presentToAlternativeModels( const ObservationPtr& observation, const Detector3DProperties& props );
 
             //Contours3D unprojectContours( const Contours_2D& contours) const;
-            Edges3D unprojectEdges(const Edges2D& edges) const;
+            // edges are relative to the roi with origin roiOffset, the result is on the current sphere
+            EdgesCompact3D unprojectEdges(const Edges2D& edges, const cv::Point& roiOffset, int imageWidthHalf, int imageHeightHalf) const;
 
             // whenever the 2D fit is bad we wanna call this and predict an new circle to use for findCircle
-            Circle predictPupilState( double deltaTime );
+            // scaleNoise scales the process noise with deltaTime instead of using the fixed per frame value
+            Circle predictPupilState( double deltaTime, bool scaleNoise = false );
             Circle correctPupilState( const Circle& circle );
             double getPupilPositionErrorVar () const;
             double getPupilSizeErrorVar() const;
@@ -77,8 +89,8 @@ namespace singleeyefitter {
 
             //void fitCircle(const Contours_2D& contours2D , const Detector3DProperties& props,  Detector3DResult& result) const;
             void filterCircle(const Edges2D& rawEdge, const Detector3DProperties& props,  Detector3DResult& result) const;
-            void filterCircle2( const Circle& predictedCircle, const Edges2D& rawEdge, const Detector3DProperties& props,  Detector3DResult& result) const;
-            void filterCircle3( const Circle& predictedCircle, const Edges2D& rawEdge, const Detector3DProperties& props,  Detector3DResult& result) const;
+            void filterCircle2( const Circle& predictedCircle, const EdgesCompact3D& edgesOnSphere, const Detector3DProperties& props,  Detector3DResult& result) const;
+            void filterCircle3( const Circle& predictedCircle, const EdgesCompact3D& edgesOnSphere, const Detector3DProperties& props,  Detector3DResult& result) const;
 
     };
 
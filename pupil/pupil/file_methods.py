@@ -11,9 +11,13 @@ See COPYING and COPYING.LESSER for license details.
 
 import collections
 import logging
+import mmap
 import os
 import pickle
+import queue
 import shutil
+import struct
+import threading
 import traceback as tb
 from glob import iglob
 
@@ -27,6 +31,33 @@ logger = logging.getLogger(__name__)
 UnpicklingError = pickle.UnpicklingError
 
 PLData = collections.namedtuple('PLData', ['data', 'timestamps', 'topics'])
+PLColumns = collections.namedtuple('PLColumns', ['columns', 'timestamps'])
+
+# Columns of the columnar pupil store: name -> (key path into the datum, dtype, shape of one entry).
+# Entries that are missing in a datum (e.g. 3d fields in 2d data) are NaN, or -1 for integer columns.
+pupil_columns = collections.OrderedDict([
+    ('confidence', (('confidence',), np.float64, ())),
+    ('norm_pos', (('norm_pos',), np.float64, (2,))),
+    ('diameter', (('diameter',), np.float64, ())),
+    ('ellipse_center', (('ellipse', 'center'), np.float64, (2,))),
+    ('ellipse_axes', (('ellipse', 'axes'), np.float64, (2,))),
+    ('ellipse_angle', (('ellipse', 'angle'), np.float64, ())),
+    ('diameter_3d', (('diameter_3d',), np.float64, ())),
+    ('circle_3d_center', (('circle_3d', 'center'), np.float64, (3,))),
+    ('circle_3d_normal', (('circle_3d', 'normal'), np.float64, (3,))),
+    ('circle_3d_radius', (('circle_3d', 'radius'), np.float64, ())),
+    ('sphere_center', (('sphere', 'center'), np.float64, (3,))),
+    ('sphere_radius', (('sphere', 'radius'), np.float64, ())),
+    ('projected_sphere_center', (('projected_sphere', 'center'), np.float64, (2,))),
+    ('projected_sphere_axes', (('projected_sphere', 'axes'), np.float64, (2,))),
+    ('projected_sphere_angle', (('projected_sphere', 'angle'), np.float64, ())),
+    ('theta', (('theta',), np.float64, ())),
+    ('phi', (('phi',), np.float64, ())),
+    ('model_confidence', (('model_confidence',), np.float64, ())),
+    ('model_id', (('model_id',), np.int32, ())),
+    ('model_birth_timestamp', (('model_birth_timestamp',), np.float64, ())),
+    ('id', (('id',), np.int32, ())),
+])
 
 class Persistent_Dict(dict):
     """a dict class that uses pickle to save inself to file"""
@@ -130,6 +161,247 @@ def load_pldata_file(directory, topic):
     return PLData(data, data_ts, topics)
 
 
+def _read_raw_header(buffer, position):
+    '''Parses a msgpack str or bin header, returns (start, end) of its data'''
+    marker = buffer[position]
+    if 0xa0 <= marker <= 0xbf:  # fixstr
+        start = position + 1
+        return start, start + (marker & 0x1f)
+    if marker in (0xc4, 0xd9):  # bin 8, str 8
+        size_format = '>B'
+    elif marker in (0xc5, 0xda):  # bin 16, str 16
+        size_format = '>H'
+    elif marker in (0xc6, 0xdb):  # bin 32, str 32
+        size_format = '>I'
+    else:
+        raise ValueError('Unexpected msgpack type 0x{:x} at byte {}'.format(marker, position))
+    start = position + 1 + struct.calcsize(size_format)
+    return start, start + struct.unpack_from(size_format, buffer, position + 1)[0]
+
+
+def iter_pldata_file(directory, topic, topics=None):
+    '''Yields (timestamp, topic, Serialized_Dict) for each record of `<topic>.pldata`
+
+    The file is memory mapped and every Serialized_Dict references its
+    payload with a memoryview into the mapping, memory use does not grow with
+    the file size. Records whose topic is not in `topics` are skipped without
+    touching their payload.
+
+    The mapping is closed when the iterator is exhausted, closed or garbage
+    collected. The yielded payloads are only valid until then, decode them or
+    copy them (bytes()) to keep them longer. The mapping can not be closed as
+    long as payload memoryviews still exist, it then stays open until they are
+    released.
+    '''
+    ts_file = os.path.join(directory, topic + '_timestamps.npy')
+    msgpack_file = os.path.join(directory, topic + '.pldata')
+    data_ts = np.load(ts_file, mmap_mode='r')
+    if topics is not None:
+        topics = set(topics)
+
+    with open(msgpack_file, 'rb') as fh:
+        if not os.fstat(fh.fileno()).st_size:
+            return
+        mapped = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+
+    try:
+        position = 0
+        for timestamp in data_ts:
+            if position >= len(mapped):
+                break
+            # every record is a (topic, payload) fixarray
+            if mapped[position] != 0x92:
+                raise ValueError('Unexpected record at byte {} in {}'.format(position, msgpack_file))
+            topic_start, topic_end = _read_raw_header(mapped, position + 1)
+            payload_start, payload_end = _read_raw_header(mapped, topic_end)
+            position = payload_end
+
+            record_topic = mapped[topic_start:topic_end].decode('utf-8')
+            if topics is not None and record_topic not in topics:
+                continue
+            yield timestamp, record_topic, Serialized_Dict(msgpack_bytes=view[payload_start:payload_end])
+    finally:
+        view.release()
+        try:
+            mapped.close()
+        except BufferError:
+            # payloads still reference the mapping, it is closed once they are gone
+            pass
+
+
+def _build_pldata_offsets(msgpack_file):
+    '''Byte offset of every record in a pldata file written without offsets'''
+    offsets = []
+    with open(msgpack_file, 'rb') as fh:
+        unpacker = msgpack.Unpacker(fh, raw=False, use_list=False)
+        while True:
+            position = unpacker.tell()
+            try:
+                unpacker.skip()
+            except msgpack.OutOfData:
+                break
+            offsets.append(position)
+    return np.array(offsets, dtype=np.int64)
+
+
+def load_pldata_offsets(directory, topic):
+    '''Loads `<topic>_offsets.npy` or builds (and stores) it for older recordings'''
+    offsets_file = os.path.join(directory, topic + '_offsets.npy')
+    msgpack_file = os.path.join(directory, topic + '.pldata')
+    try:
+        if os.path.getmtime(offsets_file) >= os.path.getmtime(msgpack_file):
+            return np.load(offsets_file, mmap_mode='r')
+    except FileNotFoundError:
+        pass
+    offsets = _build_pldata_offsets(msgpack_file)
+    try:
+        np.save(offsets_file, offsets)
+    except OSError:
+        logger.warning('Could not save pldata offsets to {}'.format(offsets_file))
+    return offsets
+
+
+def load_pldata_range(directory, topic, start_ts, stop_ts):
+    '''Loads the records of `<topic>.pldata` with start_ts <= timestamp < stop_ts
+
+    The window is located with a binary search on the timestamps and only
+    the bytes of the window are read from the memory mapped file.
+    '''
+    ts_file = os.path.join(directory, topic + '_timestamps.npy')
+    msgpack_file = os.path.join(directory, topic + '.pldata')
+    data = collections.deque()
+    topics = collections.deque()
+    try:
+        data_ts = np.load(ts_file, mmap_mode='r')
+        offsets = load_pldata_offsets(directory, topic)
+    except FileNotFoundError:
+        return PLData([], [], [])
+
+    start, stop = np.searchsorted(data_ts, (start_ts, stop_ts), side='left')
+    stop = min(stop, len(offsets))
+    if start >= stop:
+        return PLData(data, data_ts[start:start], topics)
+
+    with open(msgpack_file, 'rb') as fh, \
+            mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        begin = int(offsets[start])
+        end = int(offsets[stop]) if stop < len(offsets) else len(mapped)
+        unpacker = msgpack.Unpacker(raw=False, use_list=False)
+        unpacker.feed(mapped[begin:end])
+        for record_topic, payload in unpacker:
+            data.append(Serialized_Dict(msgpack_bytes=payload))
+            topics.append(record_topic)
+
+    return PLData(data, data_ts[start:stop], topics)
+
+
+def _pldata_column_path(directory, topic, column):
+    return os.path.join(directory, '{}_{}.npy'.format(topic, column))
+
+
+def _missing_value(dtype):
+    return -1 if np.issubdtype(dtype, np.integer) else np.nan
+
+
+def export_pldata_columns(directory, topic, columns=None, chunk_size=10000):
+    '''Writes the columns `columns` to `<topic>_<column>.npy`
+
+    Row i of each column belongs to the i-th record of `<topic>.pldata` and
+    thus to the i-th entry of `<topic>_timestamps.npy`. Missing values are
+    -1 for integer columns and nan otherwise.
+
+    :param columns: Column names, see `pupil_columns`. Defaults to all.
+    :param chunk_size: Records decoded into memory before they are written
+    '''
+    names = list(pupil_columns) if columns is None else list(columns)
+    ts_file = os.path.join(directory, topic + '_timestamps.npy')
+    msgpack_file = os.path.join(directory, topic + '.pldata')
+    data_ts = np.load(ts_file, mmap_mode='r')
+    count = len(data_ts)
+
+    arrays = collections.OrderedDict()
+    for name in names:
+        _, dtype, shape = pupil_columns[name]
+        arrays[name] = np.lib.format.open_memmap(_pldata_column_path(directory, topic, name),
+                                                 mode='w+', dtype=dtype, shape=(count,) + shape)
+
+    # the records are decoded into a chunk of rows, which is written to the columns with one slice each
+    chunk = np.empty(min(chunk_size, count), dtype=[(name, pupil_columns[name][1], pupil_columns[name][2])
+                                                     for name in names])
+
+    def write_chunk(start, rows):
+        for name, array in arrays.items():
+            array[start:start + rows] = chunk[name][:rows]
+
+    def clear_chunk():
+        for name in names:
+            chunk[name] = _missing_value(chunk.dtype[name].base)
+
+    start = 0
+    clear_chunk()
+    index = -1
+    with open(msgpack_file, "rb") as fh:
+        for index, (_, payload) in enumerate(msgpack.Unpacker(fh, raw=False, use_list=False)):
+            if index >= count:
+                logger.warning('{} contains more records than its {} timestamps.'.format(msgpack_file, count))
+                index = count - 1
+                break
+            if index - start == len(chunk):
+                write_chunk(start, len(chunk))
+                start = index
+                clear_chunk()
+            datum = msgpack.unpackb(payload, raw=False, use_list=False)
+            row = chunk[index - start]
+            for name in names:
+                value = datum
+                try:
+                    for key in pupil_columns[name][0]:
+                        value = value[key]
+                except (KeyError, TypeError, IndexError):
+                    continue
+                row[name] = value
+    written = index + 1
+    if written > start:
+        write_chunk(start, written - start)
+    if written != count:
+        logger.warning('{} contains {} records but {} timestamps.'.format(msgpack_file, written, count))
+        for array in arrays.values():
+            array[written:] = _missing_value(array.dtype)
+
+    for array in arrays.values():
+        array.flush()
+
+
+def load_pldata_columns(directory, topic, columns=None, mmap_mode='r'):
+    '''Loads columns of `<topic>.pldata` as (memory mapped) numpy arrays
+
+    The columns are exported on first use and whenever the pldata file is
+    newer than the exported columns.
+
+    :param columns: Column names, see `pupil_columns`. Defaults to all.
+    :return: PLColumns with a dict of column arrays and the timestamps
+    '''
+    names = list(pupil_columns) if columns is None else list(columns)
+    unknown = set(names) - set(pupil_columns)
+    if unknown:
+        raise ValueError('Unknown columns: {}'.format(', '.join(sorted(unknown))))
+
+    msgpack_file = os.path.join(directory, topic + '.pldata')
+    paths = {name: _pldata_column_path(directory, topic, name) for name in names}
+    try:
+        outdated = any(os.path.getmtime(path) < os.path.getmtime(msgpack_file)
+                       for path in paths.values())
+    except FileNotFoundError:
+        outdated = True
+    if outdated:
+        export_pldata_columns(directory, topic, names)
+
+    data_ts = np.load(os.path.join(directory, topic + '_timestamps.npy'), mmap_mode=mmap_mode)
+    data = {name: np.load(path, mmap_mode=mmap_mode) for name, path in paths.items()}
+    return PLColumns(data, data_ts)
+
+
 class PLData_Writer(object):
     """docstring for PLData_Writer"""
     def __init__(self, directory, name):
@@ -137,6 +409,8 @@ class PLData_Writer(object):
         self.directory = directory
         self.name = name
         self.ts_queue = collections.deque()
+        self.offset_queue = collections.deque()
+        self.offset = 0
         file_name = name + '.pldata'
         self.file_handle = open(os.path.join(directory, file_name), 'wb')
 
@@ -148,8 +422,10 @@ class PLData_Writer(object):
 
     def append_serialized(self, timestamp, topic, datum_serialized):
         self.ts_queue.append(timestamp)
+        self.offset_queue.append(self.offset)
         pair = msgpack.packb((topic, datum_serialized), use_bin_type=True)
         self.file_handle.write(pair)
+        self.offset += len(pair)
 
     def extend(self, data):
         for datum in data:
@@ -164,6 +440,11 @@ class PLData_Writer(object):
         np.save(ts_path, self.ts_queue)
         self.ts_queue = None
 
+        # byte offset of each record, aligned with the timestamps
+        offsets_path = os.path.join(self.directory, self.name + '_offsets.npy')
+        np.save(offsets_path, np.array(self.offset_queue, dtype=np.int64))
+        self.offset_queue = None
+
     def __enter__(self):
         return self
 
@@ -171,6 +452,91 @@ class PLData_Writer(object):
         self.close()
 
 
+class Buffered_PLData_Writer(PLData_Writer):
+    """PLData_Writer that serializes into memory and writes in a background thread
+
+    Records are packed with a reusable msgpack.Packer into a buffer. Full
+    buffers are handed to a writer thread. If `max_pending` buffers wait to
+    be written the `overflow` policy applies: 'block' waits for the writer
+    thread, 'drop' discards the new buffer together with its timestamps.
+    """
+    def __init__(self, directory, name, buffer_size=1 << 20, max_pending=16, overflow='block'):
+        assert overflow in ('block', 'drop'), 'invalid overflow policy: {}'.format(overflow)
+        super().__init__(directory, name)
+        self.buffer_size = buffer_size
+        self.overflow = overflow
+        self.dropped = 0
+        self.packer = msgpack.Packer(use_bin_type=True)
+        self._buffer = bytearray()
+        self._buffer_ts = []
+        self._buffer_offsets = []  # relative to the buffer start
+        self._pending = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._writer = threading.Thread(target=self._write_buffers, name='PLData writer')
+        self._writer.daemon = True
+        self._writer.start()
+
+    def _write_buffers(self):
+        # timestamps and offsets are only recorded for buffers that were written
+        while True:
+            item = self._pending.get()
+            if item is None:
+                return
+            if self._error is not None:
+                continue
+            buffer, timestamps, offsets = item
+            try:
+                self.file_handle.write(buffer)
+            except Exception as e:
+                self._error = e
+                continue
+            self.ts_queue.extend(timestamps)
+            self.offset_queue.extend(self.offset + o for o in offsets)
+            self.offset += len(buffer)
+
+    def append(self, datum):
+        self.append_serialized(datum['timestamp'], datum['topic'], self.packer.pack(datum))
+
+    def append_serialized(self, timestamp, topic, datum_serialized):
+        self._buffer_ts.append(timestamp)
+        self._buffer_offsets.append(len(self._buffer))
+        self._buffer += self.packer.pack((topic, datum_serialized))
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+
+    def extend(self, data):
+        pack = self.packer.pack
+        for datum in data:
+            self._buffer_ts.append(datum['timestamp'])
+            self._buffer_offsets.append(len(self._buffer))
+            self._buffer += pack((datum['topic'], pack(datum)))
+            if len(self._buffer) >= self.buffer_size:
+                self.flush()
+
+    def flush(self):
+        '''Hands the current buffer to the writer thread'''
+        if not self._buffer_ts:
+            return
+        item = self._buffer, self._buffer_ts, self._buffer_offsets
+        self._buffer, self._buffer_ts, self._buffer_offsets = bytearray(), [], []
+        if self.overflow == 'block':
+            self._pending.put(item)
+        else:
+            try:
+                self._pending.put_nowait(item)
+            except queue.Full:
+                self.dropped += len(item[1])
+                logger.warning('Writer for {} can not keep up. Dropped {} records.'.format(self.name, len(item[1])))
+
+    def close(self):
+        self.flush()
+        self._pending.put(None)
+        self._writer.join()
+        super().close()
+        if self._error is not None:
+            raise self._error
+
+
 def next_export_sub_dir(root_export_dir):
     # match any sub directories or files a three digit pattern
     pattern = os.path.join(root_export_dir, '[0-9][0-9][0-9]')
@@ -211,7 +577,7 @@ class Serialized_Dict(object):
         if type(python_dict) is dict:
             self._ser_data = msgpack.packb(python_dict, use_bin_type=True,
                                            default=self.packing_hook)
-        elif type(msgpack_bytes) is bytes:
+        elif type(msgpack_bytes) in (bytes, memoryview):
             self._ser_data = msgpack_bytes
         else:
             raise ValueError("Neither mapping nor payload is supplied or wrong format.")
@@ -233,7 +599,7 @@ class Serialized_Dict(object):
     @classmethod
     def packing_hook(self, obj):
         if isinstance(obj, self):
-            return msgpack.ExtType(self.MSGPACK_EXT_CODE, obj.serialized)
+            return msgpack.ExtType(self.MSGPACK_EXT_CODE, bytes(obj.serialized))
         raise TypeError("can't serialize {}({})".format(type(obj), repr(obj)))
 
     @classmethod
@@ -0,0 +1,213 @@
+'''
+(*)~---------------------------------------------------------------------------
+Pupil - eye tracking platform
+Copyright (C) 2012-2018 Pupil Labs
+
+Distributed under the terms of the GNU
+Lesser General Public License (LGPL v3.0).
+See COPYING and COPYING.LESSER for license details.
+---------------------------------------------------------------------------~(*)
+'''
+"""Headless 2D pupil detection over complete recordings
+
+The video is split into chunks that start on a keyframe so that every chunk
+can be decoded independently. Each chunk is decoded and detected in a worker
+process and the serialized results are written, in timestamp order, to a
+``<name>.pldata`` file next to the recording.
+
+2D detection does not carry state between frames, so the result is identical
+to running ``Detector_2D.detect`` over every frame in sequence.
+
+Usage::
+
+    python -m pupil.offline_detection eye0.mp4 --workers 8
+"""
+
+import os
+import re
+import argparse
+from multiprocessing import Pool, cpu_count
+
+import av
+import msgpack
+import numpy as np
+
+from pupil.file_methods import PLData_Writer
+from pupil.video_capture.file_backend import Frame, load_seek_index
+
+import logging
+logger = logging.getLogger(__name__)
+
+# per process detector state, populated by `_init_worker`
+_worker = {}
+
+
+def _open_video_stream(video_path):
+    container = av.open(str(video_path))
+    video_stream = next(s for s in container.streams if s.type == 'video')
+    return container, video_stream
+
+
+def gop_chunks(keyframes, min_chunk_size):
+    """Split frame indices into [start, stop) chunks that begin on keyframes
+
+    Consecutive GOPs are merged until a chunk holds at least `min_chunk_size`
+    frames to keep the per chunk seek and process overhead low.
+    """
+    frame_count = len(keyframes)
+    starts = np.flatnonzero(keyframes).tolist()
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+
+    chunks = []
+    chunk_start = 0
+    for start in starts[1:]:
+        if start - chunk_start >= min_chunk_size:
+            chunks.append((chunk_start, start))
+            chunk_start = start
+    if chunk_start < frame_count:
+        chunks.append((chunk_start, frame_count))
+    return chunks
+
+
+def eye_id_from_path(video_path):
+    '''Eye id of a `eye<id>.mp4` video, 0 for other names'''
+    match = re.match(r'eye(\d+)', os.path.basename(video_path))
+    return int(match.group(1)) if match else 0
+
+
+def _init_worker(video_path, settings, topic, eye_id):
+    # Detector_2D can not be pickled, every worker builds its own instance
+    from pupil.detectors.detector_2d import Detector_2D
+    _worker['video_path'] = video_path
+    _worker['topic'] = topic
+    _worker['eye_id'] = eye_id
+    _worker['detector'] = Detector_2D(settings=settings)
+
+
+def _detect_chunk(chunk):
+    """Decode and detect all frames of one chunk
+
+    Returns the index of the first frame and a list with the msgpack
+    serialized pupil datum of each frame. Frames that could not be decoded
+    are `None`.
+    """
+    from pupil.methods_python import Roi
+
+    start, chunk_pts, chunk_timestamps = chunk
+    detector = _worker['detector']
+    container, video_stream = _open_video_stream(_worker['video_path'])
+
+    frame_lookup = {pts: i for i, pts in enumerate(chunk_pts.tolist())}
+    last_pts = int(chunk_pts[-1])
+    results = [None] * len(chunk_pts)
+    remaining = len(chunk_pts)
+    roi = None
+
+    # the first frame of a chunk is a keyframe, decoding starts right there
+    video_stream.seek(int(chunk_pts[0]))
+    done = False
+    for packet in container.demux(video_stream):
+        for av_frame in packet.decode():
+            if not av_frame or av_frame.pts is None:
+                continue
+            if av_frame.pts > last_pts:
+                done = True
+                break
+            i = frame_lookup.get(av_frame.pts)
+            if i is None or results[i] is not None:
+                continue
+            frame = Frame(float(chunk_timestamps[i]), av_frame, start + i)
+            if roi is None:
+                roi = Roi((frame.height, frame.width))
+            datum = detector.detect(frame, roi, False)
+            # like the eye process does
+            datum['id'] = _worker['eye_id']
+            datum['topic'] = _worker['topic']
+            results[i] = msgpack.packb(datum, use_bin_type=True)
+            remaining -= 1
+        if done or not remaining:
+            break
+    del container
+    return start, results
+
+
+def detect_recording(video_path, output_dir=None, name='pupil', settings=None,
+                     workers=None, min_chunk_size=300, topic='pupil', eye_id=None):
+    """Run 2D pupil detection over a complete recording
+
+    Parameters
+    ----------
+    video_path : str
+        Eye video, a `<video>_timestamps.npy` file is expected next to it
+    output_dir : str
+        Directory to write `<name>.pldata` to, defaults to the video directory
+    name : str
+        Base name of the pldata file
+    settings : dict
+        Detector_2D settings, see `detect_pupil.define_detector_settings`
+    workers : int
+        Number of worker processes, defaults to the number of cores
+    min_chunk_size : int
+        Minimum number of frames that are handed to a worker at once
+    topic : str
+        Topic of the pupil data
+    eye_id : int
+        Stored as 'id' of the pupil data, defaults to the id in the video name
+
+    Returns
+    -------
+    int
+        Number of pupil data written
+    """
+    timestamps_path = os.path.splitext(video_path)[0] + '_timestamps.npy'
+    timestamps = np.load(timestamps_path)
+    if output_dir is None:
+        output_dir = os.path.dirname(os.path.abspath(video_path))
+    workers = workers or cpu_count()
+    if eye_id is None:
+        eye_id = eye_id_from_path(video_path)
+
+    # the seek index is cached next to the video, File_Source reuses it
+    seek_index = load_seek_index(video_path)
+    pts, keyframes = seek_index['pts'], seek_index['keyframe']
+    if len(pts) != len(timestamps):
+        logger.warning('Video has {} frames but {} timestamps were found. '
+                       'Extra frames are ignored.'.format(len(pts), len(timestamps)))
+    frame_count = min(len(pts), len(timestamps))
+    pts, keyframes = pts[:frame_count], keyframes[:frame_count]
+
+    # keep every worker busy but give it enough frames to amortise the seek
+    min_chunk_size = max(1, min(min_chunk_size, frame_count // (workers * 4)))
+    chunks = gop_chunks(keyframes, min_chunk_size)
+    logger.debug('Detecting {} frames in {} chunks with {} workers'.format(
+        frame_count, len(chunks), workers))
+
+    tasks = ((start, pts[start:stop], timestamps[start:stop]) for start, stop in chunks)
+    written = 0
+    with Pool(workers, initializer=_init_worker, initargs=(video_path, settings, topic, eye_id)) as pool, \
+            PLData_Writer(output_dir, name) as writer:
+        # imap keeps the chunk order, results are thus written in timestamp order
+        for start, results in pool.imap(_detect_chunk, tasks):
+            for i, payload in enumerate(results):
+                if payload is None:
+                    logger.warning('Could not decode frame {}'.format(start + i))
+                    continue
+                writer.append_serialized(timestamps[start + i], topic, payload)
+                written += 1
+    return written
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline 2D pupil detection')
+    parser.add_argument('video_file', help='Eye video with a _timestamps.npy file next to it')
+    parser.add_argument('--output', default=None, help='Output directory')
+    parser.add_argument('--name', default='pupil', help='Name of the pldata file')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes')
+    parser.add_argument('--eye-id', type=int, default=None, help='Eye id, defaults to the id in the video name')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    count = detect_recording(args.video_file, output_dir=args.output,
+                             name=args.name, workers=args.workers, eye_id=args.eye_id)
+    logger.info('Wrote {} pupil positions'.format(count))
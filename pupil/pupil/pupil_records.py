@@ -0,0 +1,180 @@
+'''
+(*)~---------------------------------------------------------------------------
+Pupil - eye tracking platform
+Copyright (C) 2012-2018 Pupil Labs
+
+Distributed under the terms of the GNU
+Lesser General Public License (LGPL v3.0).
+See COPYING and COPYING.LESSER for license details.
+---------------------------------------------------------------------------~(*)
+'''
+"""Fixed binary schema for pupil data
+
+Pupil datums are stored as rows of a packed numpy structured array instead
+of msgpack encoded dicts. A `<name>.plrec` file starts with a 16 byte header
+(magic, version, detection method) followed by the raw rows, it can be memory
+mapped and sliced without decoding.
+
+The field names are the column names of `file_methods.pupil_columns`.
+"""
+
+import os
+import numpy as np
+
+from pupil.file_methods import pupil_columns
+
+import logging
+logger = logging.getLogger(__name__)
+
+PLREC_MAGIC = b'PLDREC'
+PLREC_VERSION = 1
+
+plrec_header_dtype = np.dtype([('magic', 'S6'), ('version', '<u2'), ('method', 'S8')])
+
+pupil_2d_dtype = np.dtype([
+    ('timestamp', '<f8'),
+    ('id', '<i4'),
+    ('confidence', '<f4'),
+    ('norm_pos', '<f4', (2,)),
+    ('diameter', '<f4'),
+    ('ellipse_center', '<f4', (2,)),
+    ('ellipse_axes', '<f4', (2,)),
+    ('ellipse_angle', '<f4'),
+])
+
+pupil_3d_dtype = np.dtype(pupil_2d_dtype.descr + [
+    ('diameter_3d', '<f4'),
+    ('circle_3d_center', '<f4', (3,)),
+    ('circle_3d_normal', '<f4', (3,)),
+    ('circle_3d_radius', '<f4'),
+    ('sphere_center', '<f4', (3,)),
+    ('sphere_radius', '<f4'),
+    ('projected_sphere_center', '<f4', (2,)),
+    ('projected_sphere_axes', '<f4', (2,)),
+    ('projected_sphere_angle', '<f4'),
+    ('theta', '<f4'),
+    ('phi', '<f4'),
+    ('model_confidence', '<f4'),
+    ('model_id', '<i4'),
+    ('model_birth_timestamp', '<f8'),
+])
+
+pupil_dtypes = {'2d': pupil_2d_dtype, '3d': pupil_3d_dtype}
+pupil_methods = {'2d': '2d c++', '3d': '3d c++'}
+
+
+def datum_to_record(datum, record, eye_id=0):
+    '''Fills the structured array row `record` from a pupil datum dict
+
+    The detectors don't set 'id', `eye_id` is used for datums without it.
+    Other missing fields are stored as -1 (integers) or nan, like in
+    `file_methods.export_pldata_columns`.
+    '''
+    record['timestamp'] = datum['timestamp']
+    for name in record.dtype.names[1:]:
+        value = datum
+        try:
+            for key in pupil_columns[name][0]:
+                value = value[key]
+        except KeyError:
+            if name == 'id':
+                value = eye_id
+            else:
+                value = -1 if np.issubdtype(record.dtype[name].base, np.integer) else np.nan
+        record[name] = value
+
+
+def record_to_datum(record, method, topic='pupil'):
+    '''Builds the pupil datum dict (as produced by the detectors) from a row'''
+    datum = {'topic': topic, 'method': method, 'timestamp': float(record['timestamp'])}
+    for name in record.dtype.names[1:]:
+        key_path = pupil_columns[name][0]
+        value = record[name]
+        value = tuple(value.tolist()) if value.shape else value.item()
+        target = datum
+        for key in key_path[:-1]:
+            target = target.setdefault(key, {})
+        target[key_path[-1]] = value
+    return datum
+
+
+class PLRecord_Writer(object):
+    """Writes pupil data as fixed size records to `<name>.plrec`
+
+    `kind` is '2d' or '3d' and selects the record schema. `eye_id` is
+    stored for datums without an 'id', e.g. the ones of `Detector_2D.detect`.
+    """
+    def __init__(self, directory, name, kind='3d', buffer_records=1000, eye_id=0):
+        super().__init__()
+        self.dtype = pupil_dtypes[kind]
+        self.eye_id = eye_id
+        self.path = os.path.join(directory, name + '.plrec')
+        self.file_handle = open(self.path, 'wb')
+        header = np.zeros(1, dtype=plrec_header_dtype)
+        header['magic'] = PLREC_MAGIC
+        header['version'] = PLREC_VERSION
+        header['method'] = kind.encode()
+        self.file_handle.write(header.tobytes())
+        self._buffer = np.zeros(buffer_records, dtype=self.dtype)
+        self._buffered = 0
+
+    def append(self, datum):
+        datum_to_record(datum, self._buffer[self._buffered], self.eye_id)
+        self._buffered += 1
+        if self._buffered == len(self._buffer):
+            self.flush()
+
+    def extend(self, data):
+        for datum in data:
+            self.append(datum)
+
+    def append_records(self, records):
+        '''Writes an array of `self.dtype` rows as they are'''
+        self.flush()
+        self.file_handle.write(np.ascontiguousarray(records, dtype=self.dtype).tobytes())
+
+    def flush(self):
+        if self._buffered:
+            self.file_handle.write(self._buffer[:self._buffered].tobytes())
+            self._buffered = 0
+
+    def close(self):
+        self.flush()
+        self.file_handle.close()
+        self.file_handle = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load_pupil_records(directory, name, mmap_mode='r'):
+    '''Memory maps `<name>.plrec`
+
+    :return: (records, kind), records is a structured array with the 2d or 3d schema
+    '''
+    path = os.path.join(directory, name + '.plrec')
+    header = np.fromfile(path, dtype=plrec_header_dtype, count=1)
+    if not len(header) or header['magic'][0] != PLREC_MAGIC:
+        raise ValueError('{} is not a pupil record file'.format(path))
+    if header['version'][0] != PLREC_VERSION:
+        raise ValueError('{} has unsupported version {}'.format(path, header['version'][0]))
+    kind = header['method'][0].decode()
+    dtype = pupil_dtypes[kind]
+
+    count = (os.path.getsize(path) - plrec_header_dtype.itemsize) // dtype.itemsize
+    if not count:
+        return np.zeros(0, dtype=dtype), kind
+    records = np.memmap(path, dtype=dtype, mode=mmap_mode,
+                        offset=plrec_header_dtype.itemsize, shape=(count,))
+    return records, kind
+
+
+def iter_pupil_datums(directory, name, topic='pupil'):
+    '''Yields the records of `<name>.plrec` as pupil datum dicts'''
+    records, kind = load_pupil_records(directory, name)
+    method = pupil_methods[kind]
+    for record in records:
+        yield record_to_datum(record, method, topic)
@@ -21,6 +21,7 @@ namespace singleeyefitter {
     typedef std::vector<std::vector<cv::Point> > Contours_2D;
     typedef std::vector<cv::Point> Contour_2D;
     typedef std::vector<cv::Point> Edges2D;
+    typedef Eigen::Matrix<short, Eigen::Dynamic, 2> EdgesCompact2D; // edge coordinates as int16 x and y columns
     typedef std::vector<int> ContourIndices;
     typedef Ellipse2D<double> Ellipse;
 
@@ -35,6 +36,7 @@ namespace singleeyefitter {
 
     typedef std::vector<Vector3> Contour3D;
     typedef std::vector<Vector3> Edges3D;
+    typedef Eigen::Matrix<float, Eigen::Dynamic, 3> EdgesCompact3D; // edge positions as float x, y and z columns
     typedef std::vector<std::vector<Vector3>> Contours3D;
 
     struct ConfidenceValue{
@@ -125,6 +127,14 @@ namespace singleeyefitter {
 
     struct Detector3DProperties {
         float model_sensitivity;
+        float refinement_max_solver_time; // in seconds, 0 doesn't limit the solver time
+        int refinement_max_iterations;
+        int model_max_pupils; // observations an eye model keeps at most
+        int model_pupils_per_bin; // observations kept per spatial bin, 1 keeps the first, more keep a reservoir sample
+        int refinement_edges_per_pupil; // edges of every pupil used in the refinement, 0 uses all
+        int refinement_linear_solver; // 0: dense schur, 1: sparse schur, 2: iterative schur
+        int model_max_alternatives; // alternative models which are tried at the same time
+        int model_alternative_updates_per_frame; // alternative models updated per frame, 0 updates all
     };
 
 } // singleeyefitter namespace
@@ -12,6 +12,8 @@ import cv2
 
 import os
 import av
+import queue
+import threading
 from time import sleep
 
 from .base_backend import Base_Source, Playback_Source, Base_Manager, EndofVideoError
@@ -35,6 +37,48 @@ class FileSeekError(Exception):
     pass
 
 
+# frame index -> presentation timestamp and keyframe flag
+seek_index_dtype = np.dtype([('pts', np.int64), ('keyframe', np.bool_)])
+
+
+def build_seek_index(source_path):
+    """Demux (without decoding) the first video stream and index all packets"""
+    container = av.open(str(source_path))
+    video_stream = next(s for s in container.streams if s.type == "video")
+    entries = []
+    for packet in container.demux(video_stream):
+        # flushing packets do not carry any data
+        if packet.pts is None:
+            continue
+        entries.append((packet.pts, packet.is_keyframe))
+    del container
+    seek_index = np.array(entries, dtype=seek_index_dtype)
+    # packets are demuxed in decoding order, frame indices follow presentation order
+    seek_index.sort(order='pts', kind='mergesort')
+    return seek_index
+
+
+def load_seek_index(source_path):
+    """Load the seek index cached next to the video or build and cache it"""
+    index_path = os.path.splitext(source_path)[0] + '_seek_index.npy'
+    try:
+        if os.path.getmtime(index_path) >= os.path.getmtime(source_path):
+            seek_index = np.load(index_path)
+            if seek_index.dtype == seek_index_dtype:
+                logger.debug("Loaded seek index from %s" % index_path)
+                return seek_index
+    except (IOError, OSError, ValueError):
+        pass
+
+    logger.debug("Building seek index for %s" % source_path)
+    seek_index = build_seek_index(source_path)
+    try:
+        np.save(index_path, seek_index)
+    except (IOError, OSError):
+        logger.warning("Could not cache seek index at %s" % index_path)
+    return seek_index
+
+
 class Frame(object):
     """docstring of Frame"""
     def __init__(self, timestamp, av_frame, index):
@@ -43,6 +87,7 @@ class Frame(object):
         self.index = index
         self._img = None
         self._gray = None
+        self._remap_maps = None
         self.jpeg_buffer = None
         self.yuv_buffer = None
         self.height, self.width = av_frame.height, av_frame.width
@@ -54,6 +99,9 @@ class Frame(object):
     def img(self):
         if self._img is None:
             self._img = self._av_frame.to_nd_array(format='bgr24')
+            if self._remap_maps is not None:
+                # deferred by remap(..., lazy_bgr=True)
+                self._img = cv2.remap(self._img, *self._remap_maps, interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_TRANSPARENT)
         return self._img
 
     @property
@@ -68,11 +116,24 @@ class Frame(object):
             try:
                 self._gray.shape = self.height, self.width
             except ValueError:
-                self._gray = self._gray.reshape(-1, plane.line_size)
-                self._gray = np.ascontiguousarray(self._gray[:, :self.width])
+                # padded lines: strided view into the plane, no copy.
+                # The detectors take the line stride into account.
+                self._gray = self._gray.reshape(-1, plane.line_size)[:, :self.width]
         return self._gray
     
-    def remap(self, map_x, map_y):
+    def remap(self, map_x, map_y, lazy_bgr=False):
+        """Undistort the frame with the given cv2.remap maps
+
+        With `lazy_bgr` only the gray (luma) plane is remapped. The BGR image
+        is converted and remapped the first time `img` is accessed, which
+        headless detection never does.
+        """
+        if lazy_bgr:
+            self._gray = cv2.remap(self.gray, map_x, map_y, interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_TRANSPARENT)
+            self._img = None
+            self._remap_maps = (map_x, map_y)
+            return
+
         # get the image converted to numpy
         img = self._av_frame.to_nd_array(format='bgr24')
         # remap 
@@ -88,9 +149,12 @@ class File_Source(Playback_Source, Base_Source):
     Attributes:
         source_path (str): Path to source file
         timestamps (str): Path to timestamps file
+        read_ahead (bool): Decode frames in a background thread
+        queue_size (int): Number of frames the background thread decodes ahead
     """
 
-    def __init__(self, g_pool, source_path=None, loop=False, *args, **kwargs):
+    def __init__(self, g_pool, source_path=None, loop=False, read_ahead=False,
+                 queue_size=32, *args, **kwargs):
         super().__init__(g_pool, *args, **kwargs)
         if self.timing == 'external':
             self.recent_events = self.recent_events_external_timing
@@ -102,6 +166,11 @@ class File_Source(Playback_Source, Base_Source):
         self.source_path = source_path
         self.timestamps = None
         self.loop = loop
+        self.read_ahead = read_ahead
+        self.queue_size = queue_size
+        self._read_ahead_thread = None
+        self._read_ahead_stop = None
+        self._frame_queue = None
 
         if not source_path or not os.path.isfile(source_path):
             logger.error('Init failed. Source file could not be found at `%s`'%source_path)
@@ -141,11 +210,7 @@ class File_Source(Playback_Source, Base_Source):
         if avg_rate is None:
             avg_rate = Fraction(0,1)
 
-        if float(avg_rate)%1 != 0.0:
-            logger.error('Videofile pts are not evenly spaced, pts to index conversion may fail and be inconsitent.')
-
         # load/generate timestamps.
-        import pdb;pdb.set_trace()
         timestamps_path, ext = os.path.splitext(source_path)
         timestamps_path += '_timestamps.npy'
         try:
@@ -159,10 +224,14 @@ class File_Source(Playback_Source, Base_Source):
         assert isinstance(self.timestamps[0], float), 'Timestamps need to be instances of python float, got {}'.format(type(self.timestamps[0]))
         self.timestamps = self.timestamps
 
-        # set the pts rate to convert pts to frame index. We use videos with pts writte like indecies.
-        self.next_frame = self._next_frame()
-        f0, f1 = next(self.next_frame), next(self.next_frame)
-        self.pts_rate = f1.pts
+        # pts <-> frame index lookup and seek entry points
+        self.seek_index = load_seek_index(source_path)
+        if not len(self.seek_index):
+            logger.error('Init failed. Video stream does not contain any frames.')
+            self._initialised = False
+            return
+        self._index_pts = self.seek_index['pts']
+        self._keyframe_idx = np.flatnonzero(self.seek_index['keyframe'])
         self.seek_to_frame(0)
         self.average_rate = (self.timestamps[-1]-self.timestamps[0])/len(self.timestamps)
 
@@ -205,6 +274,8 @@ class File_Source(Playback_Source, Base_Source):
             settings = super().get_init_dict()
             settings['source_path'] = self.source_path
             settings['loop'] = self.loop
+            settings['read_ahead'] = self.read_ahead
+            settings['queue_size'] = self.queue_size
             return settings
         else:
             raise NotImplementedError()
@@ -231,28 +302,98 @@ class File_Source(Playback_Source, Base_Source):
 
     @ensure_initialisation()
     def pts_to_idx(self, pts):
-        # some older mkv did not use perfect timestamping so we are doing int(round()) to clear that.
-        # With properly spaced pts (any v0.6.100+ recording) just int() would suffice.
-        # print float(pts*self.video_stream.time_base*self.video_stream.average_rate),round(pts*self.video_stream.time_base*self.video_stream.average_rate)
-        return int(pts/self.pts_rate)
+        # pts that are not in the index (e.g. unevenly spaced timestamps of
+        # older mkv files) map to the preceding frame.
+        return max(0, int(np.searchsorted(self._index_pts, pts, side='right')) - 1)
 
     @ensure_initialisation()
     def idx_to_pts(self, idx):
-        return idx*self.pts_rate
+        return int(self._index_pts[min(idx, len(self._index_pts) - 1)])
 
-    @ensure_initialisation()
-    def get_frame(self):
+    def keyframe_idx(self, idx):
+        """Index of the closest keyframe at or before frame `idx`"""
+        pos = int(np.searchsorted(self._keyframe_idx, idx, side='right')) - 1
+        return int(self._keyframe_idx[pos]) if pos >= 0 else 0
+
+    def _decode_frame(self, target_idx):
+        """Decode forward to `target_idx`. Returns None at the end of the file."""
         frame = None
         for frame in self.next_frame:
             index = self.pts_to_idx(frame.pts)
-            if index == self.target_frame_idx:
+            if index == target_idx:
                 break
-            elif index < self.target_frame_idx:
+            elif index < target_idx:
                 pass
                 # logger.info('Frame index not consistent. Skipping forward')
             else:
                 logger.debug('Frame index not consistent.')
                 break
+        if not frame:
+            return None
+        try:
+            timestamp = self.timestamps[index]
+        except IndexError:
+            logger.info("Reached end of timestamps list.")
+            raise EndofVideoError("Reached end of timestamps list.")
+        return Frame(timestamp, frame, index=index)
+
+    def _read_ahead(self, stop_event, frame_queue, target_idx):
+        """Decoder thread. Puts frames, the end of file (None) or the raised
+        exception into `frame_queue` until `stop_event` is set."""
+        def put(item):
+            while not stop_event.is_set():
+                try:
+                    frame_queue.put(item, timeout=0.05)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        try:
+            while True:
+                frame = self._decode_frame(target_idx)
+                if frame is None:
+                    put(None)
+                    return
+                # convert in this thread, the consumer only hands it on
+                frame.gray
+                target_idx = frame.index + 1
+                if not put(frame):
+                    return
+        except Exception as e:
+            put(e)
+
+    def _start_read_ahead(self, target_idx):
+        self._read_ahead_stop = threading.Event()
+        self._frame_queue = queue.Queue(maxsize=self.queue_size)
+        self._read_ahead_thread = threading.Thread(
+            target=self._read_ahead, name='File_Source read ahead',
+            args=(self._read_ahead_stop, self._frame_queue, target_idx))
+        self._read_ahead_thread.daemon = True
+        self._read_ahead_thread.start()
+
+    def _stop_read_ahead(self):
+        if self._read_ahead_thread is None:
+            return
+        self._read_ahead_stop.set()
+        self._read_ahead_thread.join()
+        self._read_ahead_thread = None
+        self._frame_queue = None
+
+    @ensure_initialisation()
+    def get_frame(self):
+        if self.read_ahead:
+            if self._read_ahead_thread is None:
+                self._start_read_ahead(self.target_frame_idx)
+            frame = self._frame_queue.get()
+            if frame is None or isinstance(frame, Exception):
+                # the decoder thread has terminated, restart it on the next call
+                self._stop_read_ahead()
+                if frame is not None:
+                    raise frame
+        else:
+            frame = self._decode_frame(self.target_frame_idx)
+
         if not frame:
             if self.loop:
                 logger.info('Looping enabled. Seeking to beginning.')
@@ -262,15 +403,10 @@ class File_Source(Playback_Source, Base_Source):
             else:
                 logger.debug("End of videofile %s %s"%(self.current_frame_idx,len(self.timestamps)))
                 raise EndofVideoError('Reached end of video file')
-        try:
-            timestamp = self.timestamps[index]
-        except IndexError:
-            logger.info("Reached end of timestamps list.")
-            raise EndofVideoError("Reached end of timestamps list.")
 
-        self.target_frame_idx = index+1
-        self.current_frame_idx = index
-        return Frame(timestamp, frame, index=index)
+        self.target_frame_idx = frame.index+1
+        self.current_frame_idx = frame.index
+        return frame
 
     @ensure_initialisation(fallback_func=lambda evt: sleep(0.05))
     def recent_events_external_timing(self, events):
@@ -321,9 +457,12 @@ class File_Source(Playback_Source, Base_Source):
 
     @ensure_initialisation()
     def seek_to_frame(self, seek_pos):
-        # frame accurate seeking
+        # the decoder thread owns the container while running
+        self._stop_read_ahead()
+        # frame accurate seeking: start decoding at the preceding keyframe,
+        # get_frame() drops the frames up to `seek_pos`
         try:
-            self.video_stream.seek(int(self.idx_to_pts(seek_pos)))
+            self.video_stream.seek(self.idx_to_pts(self.keyframe_idx(seek_pos)))
         except av.AVError as e:
             raise FileSeekError()
         else:
@@ -339,6 +478,9 @@ class File_Source(Playback_Source, Base_Source):
         elif notification['subject'] == 'file_source.should_pause' and notification.get('source_path') == self.source_path:
             self.play = False
 
+    def cleanup(self):
+        self._stop_read_ahead()
+
     def seek_to_prev_frame(self):
         self.seek_to_frame(max(0, self.current_frame_idx - 1))
 
@@ -175,8 +175,8 @@ Return value:
 
     # OpenMP
     if use_openmp:
-        compile_args.insert( 0, openmp_compile_args )
-        link_args.insert( 0, openmp_link_args )
+        compile_args = openmp_compile_args + compile_args
+        link_args    = openmp_link_args + link_args
     
     extra_objects = []
     language = "c++"
@@ -261,7 +261,7 @@ ext_module_detector_2d = declare_cython_extension("pupil.detectors.detector_2d",
                                                   library_dirs=[opencv_library_dir, boost_library_dir],
                                                   depends=dependencies,
                                                   use_math=True,
-                                                  use_openmp=False,
+                                                  use_openmp=True,
                                                   include_dirs=my_include_dirs)
 
 # detector 3d extension
@@ -276,7 +276,7 @@ ext_module_detector_3d = declare_cython_extension("pupil.detectors.detector_3d",
                                                   library_dirs=[opencv_library_dir, boost_library_dir, glog_library_dir],
                                                   depends=dependencies,
                                                   use_math=True,
-                                                  use_openmp=False,
+                                                  use_openmp=True,
                                                   include_dirs=my_include_dirs)
 
 